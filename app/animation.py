@@ -0,0 +1,87 @@
+# animation.py
+# Earth-rotation playback of a uv coverage over hour angle (see the aperture
+# synthesis widget). Frame k holds the first k time slices of the track
+# (uv_coverage.hour_angles). The gridded counts are linear in the samples, so
+# moving to another frame only adds (or, going backwards, subtracts) the
+# samples of the slices in between to a running uv grid and density image,
+# touching only the cells they hit, instead of regridding the whole track.
+# Cells emptied again are zeroed, whatever the rounding of fractional weights.
+# The dirty beam of a frame is the weighted grid through one real FFT, as
+# pipeline.compute_dirty_beam: the same beam once all the slices are in.
+import numpy as np
+
+import fft
+import gridding
+import uv_coverage
+from rendering import DENSITY_BINS, bin_indices, log_density
+
+
+class TrackAnimation:
+    def __init__(self, uv_points, params, weights=None, density_limit=None, density_bins=DENSITY_BINS):
+        # uv_points (and their weights) ordered (channel, time, baseline), as
+        # pipeline.compute_aperture; density_limit: half-width (k-units) of
+        # the density image, None for the extent of the uv grid
+        self.params = params
+        self.hours = uv_coverage.hour_angles(params)
+        self.n_frames = len(self.hours)
+        self.Npx = params['Npx']
+        self.fov_size = params['fov']
+        self.weighting = params.get('weighting', 'uniform')
+        self.robust = params.get('robust', 0.)
+        self.n_samples = len(uv_points)
+        gridding.check_uv_range(*gridding.uv_extent(uv_points, 2**20), self.Npx, self.fov_size)
+        # (channel, time, baseline) views, a time slice is [:, t]
+        self._uv = np.asarray(uv_points).reshape(params['nchan'], self.n_frames, -1, 3)
+        self._weights = None
+        if weights is not None:
+            self._weights = np.asarray(weights, dtype=float).reshape(self._uv.shape[:-1])
+            self._min_weight = self._weights.min() if self._weights.size else 1.
+        if density_limit is None:
+            density_limit = (180 / np.pi) * self.Npx / (2 * self.fov_size) / 1e3
+        self.density_limit = density_limit
+        self.density_bins = density_bins
+        self.counts = np.zeros(self.Npx * self.Npx)
+        self._density = np.zeros(density_bins * density_bins)
+        self.frame = 0
+
+    def seek(self, frame):
+        # Grid the first `frame` time slices, from the current frame or from
+        # scratch, whichever touches fewer slices
+        frame = min(max(int(frame), 0), self.n_frames)
+        if abs(frame - self.frame) > frame:
+            self.counts[:] = 0
+            self._density[:] = 0
+            self.frame = 0
+        for t in range(self.frame, frame):
+            self._add_slice(t, 1.)
+        for t in range(frame, self.frame):
+            self._add_slice(t, -1.)
+        self.frame = frame
+
+    def _add_slice(self, t, sign):
+        samples = self._uv[:, t].reshape(-1, 3)
+        cells = gridding.cell_indices(samples, self.Npx, self.fov_size)
+        if self._weights is None:
+            weights = np.full(len(cells), sign)
+        else:
+            weights = sign * self._weights[:, t].ravel()
+        np.add.at(self.counts, cells, weights)
+        if sign < 0 and self._weights is not None:
+            gridding.clear_residues(self.counts, cells, self._min_weight)
+        np.add.at(self._density, bin_indices(samples[:, :2], self.density_limit, self.density_bins), sign)
+
+    def hour_angle(self):
+        # Hour angle (hr) of the last slice in
+        return self.hours[max(self.frame - 1, 0)]
+
+    def points(self):
+        # uv samples of the frame (copy), for scatter plots of small tracks
+        return self._uv[:, :self.frame].reshape(-1, 3)
+
+    def density(self):
+        # Log-density image of the frame (see rendering.density_image)
+        return log_density(self._density, self.density_bins)
+
+    def beam(self):
+        grid = gridding.weight_grid(self.counts.reshape(self.Npx, self.Npx), self.weighting, self.robust)
+        return fft.uv2sky(grid, hermitian=fft.is_hermitian(grid))
@@ -1,12 +1,28 @@
 # main.py
+# The window is shown before the simulation modules are imported, and the
+# default array is drawn once it is painted (see startup.py). With
+# --timings, the startup times are printed; they are also in the profiling
+# overlay.
 import sys
-from PyQt6.QtWidgets import QApplication
 
-from main_window import SimulationApp
+from startup import Startup
 
 if __name__ == "__main__":
+    startup = Startup()
+    print_timings = '--timings' in sys.argv
+    if print_timings:
+        sys.argv.remove('--timings')
+
+    from PyQt6.QtWidgets import QApplication
+    from main_window import SimulationApp
+    startup.mark('imports')
+
     app = QApplication(sys.argv)
-    window = SimulationApp()
+    window = SimulationApp(startup=startup, print_timings=print_timings)
     window.resize(1200, 1000)
     window.show()
+    startup.mark('window')
+    # Imported once the window is shown, so as not to delay it
+    startup.preload()
+    window.start()
     sys.exit(app.exec())
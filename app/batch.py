@@ -0,0 +1,308 @@
+# batch.py
+# Headless parameter sweeps over the GUI pipeline (no Qt needed):
+#
+#   python app/batch.py sweep.yaml -o results/ -j 8
+#
+# The sweep file (YAML or JSON) sets the simulation parameters; every
+# parameter given as a list is swept, over the cartesian product of all the
+# lists. Array templates are names of catalog templates (see catalog.py), or
+# paths to .enu.txt files, or "all". Example:
+#
+#   arrays: [Kat-7, Meerkat]
+#   declination: [-60, -30, 0]
+#   duration: [2, 8]
+#   nchan: [1, 5]
+#   noise: [0, 0.1, 1]
+#   latitude: -30.7
+#   fov: 0.5
+#   Npx: 512
+#   weighting: [uniform, natural, briggs]
+#   channel_beams: true
+#   precision: float32
+#   primary_beam: [false, true]
+#
+# weighting (and robust) set the weighting of the dirty beams, and
+# imaging_weighting that of the observation. precision (float64 or float32)
+# sets the dtype of the uv samples, grids and beams. primary_beam (with
+# dish_diameter, m) and w_stacking (with w_planes, None for automatic)
+# simulate the wide-field effects in the observation.
+#
+# Each worker process drives a session (see session.py) through its runs:
+# runs that only differ by their noise level are computed by the same worker,
+# and only the imaging of the session is dirty from one to the next, so the
+# aperture and model visibilities are only computed once.
+# Each run is written as a result store (see store.py) to
+# <output>/<index>.argosim as soon as it is done, and a line (with the
+# per-stage timings) is appended to <output>/results.jsonl. With --resume, the
+# runs already recorded as done are skipped.
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import numpy as np
+
+import catalog
+# Compiled JAX kernels are kept on disk, shared by the worker processes and runs
+JAX_CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                             'argosim-gui', 'jax')
+
+# GUI defaults (sizes in arcsec). Unlike the GUI the seed defaults to 0, so
+# that sweeps are reproducible.
+DEFAULTS = {
+    'arrays': 'Kat-7',
+    'latitude': 35.,
+    'declination': 35.,
+    'start_time': -1.,
+    'duration': 2.,
+    'timestep': 15.,
+    'central_freq': 2.,
+    'bandwidth': 0.2,
+    'nchan': 5,
+    'fov': 0.1,
+    'Npx': 256,
+    'grid_memory': 256.,
+    'redundancy': False,
+    'max_baselines': None,
+    'weighting': 'uniform',
+    'robust': 0.,
+    'channel_beams': False,
+    'precision': 'float64',
+    'n_sources': 3,
+    'min_size': 5.,
+    'max_size': 10.,
+    'noise': 0.1,
+    'seed': 0,
+    'imaging_weighting': 'natural',
+    'primary_beam': False,
+    'dish_diameter': 12.,
+    'w_stacking': False,
+    'w_planes': None,
+}
+# Products that can be saved for each run
+PRODUCTS = ['uv_points', 'uv_weights', 'uv_mask', 'dirty_beam', 'channel_beams', 'sky_model', 'observation']
+DEFAULT_PRODUCTS = ['dirty_beam', 'observation']
+
+
+def load_sweep(path):
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("Reading YAML sweeps requires PyYAML (pip install pyyaml), or use JSON.")
+            sweep = yaml.safe_load(f)
+        else:
+            sweep = json.load(f)
+    unknown = set(sweep) - set(DEFAULTS) - {'save'}
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+    return sweep
+
+
+def expand_sweep(sweep):
+    # List of the run parameters, noise varying fastest
+    values = {key: sweep.get(key, default) for key, default in DEFAULTS.items()}
+    if values['arrays'] == 'all':
+        values['arrays'] = catalog.TemplateCatalog().names()
+    keys = list(values)
+    axes = [v if isinstance(v, list) else [v] for v in values.values()]
+    runs = []
+    for combination in itertools.product(*axes):
+        run = dict(zip(keys, combination))
+        run['array'] = run.pop('arrays')
+        runs.append(run)
+    return runs
+
+
+def group_runs(runs):
+    # Runs sharing everything but the noise level, as (indices, runs) lists
+    groups = {}
+    for index, run in enumerate(runs):
+        key = json.dumps({k: v for k, v in run.items() if k != 'noise'}, sort_keys=True)
+        groups.setdefault(key, ([], []))
+        groups[key][0].append(index)
+        groups[key][1].append(run)
+    return list(groups.values())
+
+
+def _init_worker(fft_workers, jax_cache_dir):
+    if jax_cache_dir:
+        import jax
+        jax.config.update('jax_compilation_cache_dir', jax_cache_dir)
+        jax.config.update('jax_persistent_cache_min_compile_time_secs', 0.5)
+    # One FFT thread per process when several processes share the cores
+    if fft_workers is not None:
+        import fft
+        fft.WORKERS = fft_workers
+
+
+def session_params(run):
+    # (aperture, imaging) parameters of a session for the run
+    import session
+    aperture = {p.name: run[p.name] for p in session.APERTURE_PARAMS}
+    imaging = {
+        'n_sources': run['n_sources'],
+        'min_source_size': run['min_size'] / 3600,
+        'max_source_size': run['max_size'] / 3600,
+        'noise_level': run['noise'],
+        'seed': run['seed'],
+        'weighting': run['imaging_weighting'],
+        'robust': run['robust'],
+        'primary_beam': run['primary_beam'],
+        'dish_diameter': run['dish_diameter'],
+        'w_stacking': run['w_stacking'],
+        'w_planes': run['w_planes'],
+    }
+    return aperture, imaging
+
+
+def check_runs(runs):
+    # Raises ValueError at the first run with invalid session parameters
+    from session import Session
+    session = Session()
+    for index, run in enumerate(runs):
+        aperture, imaging = session_params(run)
+        try:
+            session.parse('aperture', aperture)
+            session.parse('imaging', imaging)
+        except ValueError as e:
+            raise ValueError(f"Run {index:05d}: {e}") from e
+
+
+def run_group(indices, runs, output, products):
+    # Runs one group in a worker process and writes each result to disk.
+    # Returns one record per run, whose stages are those computed for it.
+    import profiling
+    import store
+    from cache import StageCache
+    from session import Session
+
+    session = Session(cache=StageCache())
+    templates = catalog.TemplateCatalog()
+    records = []
+    for index, run in zip(indices, runs):
+        record = {'index': index, 'params': run}
+        start = time.perf_counter()
+        trace = profiling.Trace(f"run {index}")
+        try:
+            session.set_array(templates.antenna(run['array']), label=run['array'],
+                              load_baselines=partial(templates.baselines, run['array']))
+            aperture_params, imaging_params = session_params(run)
+            session.update('aperture', aperture_params)
+            session.update('imaging', imaging_params)
+            imaging = session.compute('imaging', trace=trace)
+            aperture = session.result('aperture')
+            results = {
+                'uv_points': aperture['uv_points'],
+                'uv_weights': aperture['uv_weights'],
+                'uv_mask': np.abs(aperture['uv_mask']),
+                'dirty_beam': aperture['dirty_beam'],
+                'channel_beams': aperture['channel_beams'],
+                'sky_model': imaging['sky_model'],
+                'observation': imaging['observation'],
+            }
+            path = store.save_result(os.path.join(output, f"{index:05d}"),
+                                     {p: results[p] for p in products}, run)
+            record.update(status='ok', file=os.path.basename(path))
+        except Exception as e:
+            record.update(status='error', error=f"{type(e).__name__}: {e}")
+        record['time'] = round(time.perf_counter() - start, 4)
+        record['stages'] = trace.stages
+        records.append(record)
+    return records
+
+
+def _done_indices(results_path):
+    done = set()
+    if os.path.exists(results_path):
+        with open(results_path) as f:
+            for line in f:
+                record = json.loads(line)
+                if record['status'] == 'ok':
+                    done.add(record['index'])
+    return done
+
+
+def run_sweep(sweep, output, workers=None, resume=False, jax_cache_dir=JAX_CACHE_DIR, log=print):
+    products = sweep.get('save', DEFAULT_PRODUCTS)
+    unknown = set(products) - set(PRODUCTS)
+    if unknown:
+        raise ValueError(f"Unknown products: {', '.join(sorted(unknown))}. Choose from {', '.join(PRODUCTS)}.")
+    runs = expand_sweep(sweep)
+    check_runs(runs)
+    templates = catalog.TemplateCatalog()
+    for name in {run['array'] for run in runs}:
+        templates.path(name)
+    os.makedirs(output, exist_ok=True)
+    with open(os.path.join(output, 'sweep.json'), 'w') as f:
+        json.dump(sweep, f, indent=2)
+
+    results_path = os.path.join(output, 'results.jsonl')
+    done = _done_indices(results_path) if resume else set()
+    if not resume and os.path.exists(results_path):
+        os.remove(results_path)
+    groups = []
+    for indices, group in group_runs(runs):
+        todo = [(i, r) for i, r in zip(indices, group) if i not in done]
+        if todo:
+            groups.append(([i for i, _ in todo], [r for _, r in todo]))
+
+    workers = workers or os.cpu_count() or 1
+    workers = min(workers, max(len(groups), 1))
+    n_todo = sum(len(indices) for indices, _ in groups)
+    log(f"{len(runs)} runs ({len(runs) - n_todo} already done) in {len(groups)} groups on {workers} processes")
+    n_done = 0
+    n_failed = 0
+    start = time.perf_counter()
+    # JAX is not fork-safe: always start fresh interpreters
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(1 if workers > 1 else None, jax_cache_dir)) as executor, \
+            open(results_path, 'a') as results_file:
+        futures = [executor.submit(run_group, indices, group, output, products) for indices, group in groups]
+        for future in as_completed(futures):
+            for record in future.result():
+                results_file.write(json.dumps(record) + '\n')
+                n_done += 1
+                if record['status'] != 'ok':
+                    n_failed += 1
+                run = record['params']
+                log(f"[{n_done}/{n_todo}] {record['index']:05d} {run['array']} dec={run['declination']} "
+                    f"dur={run['duration']} nchan={run['nchan']} noise={run['noise']}: "
+                    f"{record['status']} ({record['time']:.2f} s)"
+                    + (f" {record['error']}" if record['status'] != 'ok' else ""))
+            results_file.flush()
+    log(f"Done in {time.perf_counter() - start:.1f} s, {n_failed} failed. Results in {results_path}")
+    return n_failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run an argosim parameter sweep without the GUI.")
+    parser.add_argument('sweep', help="YAML or JSON sweep file")
+    parser.add_argument('-o', '--output', default='results', help="output directory (default: results)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="number of worker processes (default: number of cores)")
+    parser.add_argument('--resume', action='store_true', help="skip the runs already done in the output directory")
+    parser.add_argument('--jax-cache', default=JAX_CACHE_DIR,
+                        help=f"directory of the compiled JAX kernels, '' to disable (default: {JAX_CACHE_DIR})")
+    parser.add_argument('--dry-run', action='store_true', help="list the runs and exit")
+    args = parser.parse_args(argv)
+
+    sweep = load_sweep(args.sweep)
+    if args.dry_run:
+        for index, run in enumerate(expand_sweep(sweep)):
+            print(f"{index:05d} {json.dumps(run)}")
+        return 0
+    n_failed = run_sweep(sweep, args.output, workers=args.workers, resume=args.resume,
+                         jax_cache_dir=args.jax_cache)
+    return 1 if n_failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,302 @@
+# benchmark.py
+# Reproducible benchmark of the GUI pipeline, run headless on the offscreen Qt
+# platform:
+#
+#   python app/benchmark.py run -o bench.json [--quick]
+#   python app/benchmark.py compare old.json new.json
+#
+# Each case (array x Npx x channels x track length) drives the widgets as a
+# click would (ApertureSynthesisWidget._simulate, then
+# ImagingWidget._simulate_imaging) with a cold stage cache, and records the
+# wall time of every stage (including drawing) from the profiling traces. One
+# extra run per case traces the memory allocations (tracemalloc) to get the
+# peak memory of each stage. A warm-up run per case keeps JAX compilation out
+# of the timings.
+#
+# The FOV of each case is set from the longest baseline so that the uv
+# samples fill ~90% of the uv grid: cases at different Npx image the same
+# resolution over a larger field.
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import numpy as np
+
+import catalog
+from profiling import peak_rss_mb
+
+C_LIGHT = 299792458.0
+
+TEMPLATES = ['Argos', 'Kat-7', 'Meerkat', 'SKA-Mid_197']
+# Synthetic arrays: name -> (argosim.antenna_utils function, kwargs)
+SYNTHETIC = {
+    'Y-shaped_21': ('y_antenna_arr', {'n_antenna': 7, 'r': 1e3, 'alpha': 12}),
+    'Y-shaped_60': ('y_antenna_arr', {'n_antenna': 20, 'r': 5e3, 'alpha': 12}),
+    'Uniform_10x6': ('uni_antenna_array', {'n_antenna_E': 10, 'n_antenna_N': 6, 'E_lim': 2e3, 'N_lim': 1e3}),
+}
+SWEEP = {'Npx': [128, 256, 512], 'nchan': [1, 5], 'duration': [2, 8]}
+QUICK_SWEEP = {'Npx': [128, 256], 'nchan': [1], 'duration': [2]}
+# Fixed aperture parameters (GUI defaults)
+PARAMS = {
+    'latitude': 35., 'declination': 35., 'start_time': -1., 'timestep': 15.,
+    'central_freq': 2., 'bandwidth': 0.2, 'grid_memory': 256.,
+}
+
+
+def load_array(name):
+    import argosim.antenna_utils
+    if name in SYNTHETIC:
+        function, kwargs = SYNTHETIC[name]
+        return np.asarray(getattr(argosim.antenna_utils, function)(**kwargs))
+    # Bundled templates only, so that user templates cannot shadow the reference arrays
+    return catalog.TemplateCatalog(dirs=[catalog.ASSETS_DIR]).antenna(name)
+
+
+def fit_fov(baselines, Npx, params, fill=0.9):
+    # FOV (deg) for which the longest baseline at the highest frequency lies
+    # at `fill` of the uv grid edge (uv cell = 1 / fov)
+    f_max = (params['central_freq'] + params['bandwidth'] / 2) * 1e9
+    max_uv = np.max(np.linalg.norm(baselines, axis=1)) * f_max / C_LIGHT
+    return float(fill * (Npx / 2) / max_uv * 180 / np.pi)
+
+
+def git_version():
+    try:
+        out = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    import argosim
+    import jax
+    import matplotlib
+    import scipy
+    return {
+        'version': git_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'matplotlib': matplotlib.__version__,
+        'jax': jax.__version__,
+        'argosim': getattr(argosim, '__version__', None),
+    }
+
+
+class Bench:
+    def __init__(self):
+        from PyQt6.QtWidgets import QApplication
+        self.app = QApplication.instance() or QApplication(sys.argv)
+        from main_window import SimulationApp
+        self.window = SimulationApp()
+        self.window.resize(1200, 1000)
+        self.window.show()
+        # Runs are started explicitly
+        self.window.aperture_widget.live_checkbox.setChecked(False)
+        self.window.imaging_widget.live_checkbox.setChecked(False)
+        self.errors = []
+        self.window.aperture_widget.runner.failed.connect(self.errors.append)
+        self.window.imaging_widget.runner.failed.connect(self.errors.append)
+        self._wait(self.window.array_widget.runner)
+
+    def _wait(self, runner, timeout=3600):
+        start = time.perf_counter()
+        self.app.processEvents()
+        while runner.is_running():
+            self.app.processEvents()
+            time.sleep(0.001)
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError("benchmark run timed out")
+        self.app.processEvents()
+
+    def set_array(self, antenna):
+        import pipeline
+        baselines = pipeline.compute_baselines(antenna)
+        self.window.array_widget.show_results({}, {'antenna': antenna})
+        self._wait(self.window.array_widget.runner)
+        return baselines
+
+    def run_once(self, params, imaging_params, capture=False):
+        # One cold run of the aperture and imaging widgets, returns their traces
+        window = self.window
+        window.cache.clear()
+        window.aperture_widget.coverage.reset()
+        window.profiler.capture = capture
+        traces = {}
+        self.errors.clear()
+        window.aperture_widget.set_params(params)
+        window.aperture_widget._simulate()
+        self._wait(window.aperture_widget.runner)
+        if self.errors:
+            raise self.errors[0]
+        traces['aperture'] = window.profiler.last()
+        imaging = window.imaging_widget
+        imaging.n_sources_input.setText(str(imaging_params['n_sources']))
+        imaging.min_size_input.setText(f"{imaging_params['min_size']:g}")
+        imaging.max_size_input.setText(f"{imaging_params['max_size']:g}")
+        imaging.noise_input.setText(str(imaging_params['noise']))
+        imaging.seed_input.setText(str(imaging_params['seed']))
+        imaging._simulate_imaging()
+        self._wait(imaging.runner)
+        if self.errors:
+            raise self.errors[0]
+        traces['imaging'] = window.profiler.last()
+        window.profiler.capture = False
+        return traces
+
+
+def _summarize(timed, memory):
+    # Per-stage min/median time over the timed runs, peak memory from the
+    # memory run
+    stages = {}
+    for trace in timed:
+        for s in trace.stages:
+            entry = stages.setdefault(s['stage'], {'times': []})
+            entry['times'].append(s['time'])
+            if 'nbytes' in s:
+                entry['nbytes'] = s['nbytes']
+            if 'shape' in s:
+                entry['shape'] = s['shape']
+    for entry in stages.values():
+        entry['time'] = min(entry['times'])
+        entry['median'] = statistics.median(entry['times'])
+    if memory is not None:
+        for s in memory.stages:
+            if s['stage'] in stages and 'peak_traced_mb' in s:
+                stages[s['stage']]['peak_mb'] = s['peak_traced_mb']
+    totals = [t.total() for t in timed]
+    return {
+        'time': min(totals),
+        'median': statistics.median(totals),
+        'sizes': timed[-1].sizes(),
+        'stages': stages,
+    }
+
+
+def run_benchmark(arrays, sweep, repeat=3, memory=True, redundancy=False, log=print):
+    bench = Bench()
+    cases = []
+    for name in arrays:
+        antenna = load_array(name)
+        baselines = bench.set_array(antenna)
+        for Npx in sweep['Npx']:
+            for nchan in sweep['nchan']:
+                for duration in sweep['duration']:
+                    params = dict(PARAMS, Npx=Npx, nchan=nchan, duration=duration, redundancy=redundancy)
+                    params['fov'] = fit_fov(baselines, Npx, params)
+                    # Source sizes (arcsec) relative to the field
+                    fov_arcsec = params['fov'] * 3600
+                    imaging_params = {'n_sources': 3, 'min_size': fov_arcsec / 40, 'max_size': fov_arcsec / 20,
+                                      'noise': 0.1, 'seed': 0}
+                    case_id = f"{name}/Npx{Npx}/nchan{nchan}/dur{duration:g}" + ("/redundant" if redundancy else "")
+                    case = {'id': case_id, 'array': name, 'n_antennas': len(antenna),
+                            'n_baselines': len(baselines), 'Npx': Npx, 'nchan': nchan,
+                            'duration': duration, 'fov': params['fov']}
+                    try:
+                        bench.run_once(params, imaging_params)  # warm-up
+                        timed = [bench.run_once(params, imaging_params) for _ in range(repeat)]
+                        mem = bench.run_once(params, imaging_params, capture=True) if memory else None
+                        for part in ['aperture', 'imaging']:
+                            case[part] = _summarize([t[part] for t in timed], mem[part] if mem else None)
+                        case['peak_rss_mb'] = peak_rss_mb()
+                        log(f"{case_id}: aperture {case['aperture']['time']:.3f} s, "
+                            f"imaging {case['imaging']['time']:.3f} s")
+                    except Exception as e:
+                        case['error'] = f"{type(e).__name__}: {e}"
+                        log(f"{case_id}: {case['error']}")
+                    cases.append(case)
+    bench.window.close()
+    return cases
+
+
+def compare(old, new, threshold=0.2, min_time=0.005, log=print):
+    # Ratios new/old of the stage and total times of the cases in both runs.
+    # A regression is a slowdown above threshold (relative) and min_time (s).
+    old_cases = {c['id']: c for c in old['cases'] if 'error' not in c}
+    regressions = []
+    log(f"{'case':<40} {'part/stage':<26} {'old (s)':>9} {'new (s)':>9} {'ratio':>7}")
+    for case in new['cases']:
+        ref = old_cases.get(case['id'])
+        if ref is None or 'error' in case:
+            continue
+        for part in ['aperture', 'imaging']:
+            rows = [(part, ref[part]['time'], case[part]['time'])]
+            for stage, entry in case[part]['stages'].items():
+                if stage in ref[part]['stages']:
+                    rows.append((f"{part}/{stage}", ref[part]['stages'][stage]['time'], entry['time']))
+            for label, t_old, t_new in rows:
+                ratio = t_new / t_old if t_old > 0 else float('inf')
+                flag = ""
+                if t_new - t_old > min_time and ratio > 1 + threshold:
+                    flag = "  REGRESSION"
+                    regressions.append((case['id'], label, t_old, t_new))
+                log(f"{case['id']:<40} {label:<26} {t_old:>9.4f} {t_new:>9.4f} {ratio:>7.2f}{flag}")
+    log(f"{len(regressions)} regressions (>{threshold:.0%} and >{min_time * 1e3:g} ms slower)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the argosim GUI pipeline headless.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help="run the benchmark")
+    run_parser.add_argument('-o', '--output', default='benchmark.json', help="JSON output (default: benchmark.json)")
+    run_parser.add_argument('--arrays', nargs='+', default=TEMPLATES + list(SYNTHETIC),
+                            help=f"arrays to run, among {', '.join(TEMPLATES + list(SYNTHETIC))}")
+    run_parser.add_argument('--npx', nargs='+', type=int, help=f"Npx values (default: {SWEEP['Npx']})")
+    run_parser.add_argument('--nchan', nargs='+', type=int, help=f"channel counts (default: {SWEEP['nchan']})")
+    run_parser.add_argument('--duration', nargs='+', type=float,
+                            help=f"track lengths in hours (default: {SWEEP['duration']})")
+    run_parser.add_argument('--repeat', type=int, default=3, help="timed runs per case (default: 3)")
+    run_parser.add_argument('--redundancy', action='store_true', help="merge redundant baselines")
+    run_parser.add_argument('--no-memory', action='store_true', help="skip the memory-traced run")
+    run_parser.add_argument('--quick', action='store_true',
+                            help=f"small sweep {QUICK_SWEEP}, one timed run per case")
+    compare_parser = subparsers.add_parser('compare', help="compare two benchmark results")
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.2,
+                                help="relative slowdown reported as a regression (default: 0.2)")
+    compare_parser.add_argument('--min-time', type=float, default=0.005,
+                                help="absolute slowdown (s) below which differences are ignored (default: 0.005)")
+    args = parser.parse_args(argv)
+
+    if args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(old, new, threshold=args.threshold, min_time=args.min_time)
+        return 1 if regressions else 0
+
+    unknown = set(args.arrays) - set(TEMPLATES) - set(SYNTHETIC)
+    if unknown:
+        parser.error(f"unknown arrays: {', '.join(sorted(unknown))}")
+    sweep = dict(QUICK_SWEEP if args.quick else SWEEP)
+    for key, values in [('Npx', args.npx), ('nchan', args.nchan), ('duration', args.duration)]:
+        if values:
+            sweep[key] = values
+    repeat = 1 if args.quick else args.repeat
+    result = {'environment': environment(), 'sweep': sweep, 'repeat': repeat, 'redundancy': args.redundancy}
+    result['cases'] = run_benchmark(args.arrays, sweep, repeat=repeat, memory=not args.no_memory,
+                                    redundancy=args.redundancy)
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Results in {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# cache.py
+# Content-hashed, size-bounded LRU cache for the simulation stages.
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def hash_key(*parts):
+    # Stable digest of arrays, scalars, strings and nested dicts/lists/tuples
+    h = hashlib.blake2b(digest_size=16)
+
+    def update(part):
+        if isinstance(part, dict):
+            h.update(b'{')
+            for k in sorted(part):
+                update(k)
+                update(part[k])
+            h.update(b'}')
+        elif isinstance(part, (list, tuple)):
+            h.update(b'[')
+            for p in part:
+                update(p)
+            h.update(b']')
+        elif isinstance(part, (str, int, float, bool, type(None), np.generic)):
+            h.update(repr(part).encode())
+            h.update(b';')
+        else:
+            array = np.ascontiguousarray(np.asarray(part))
+            h.update(f"array{array.dtype.str}{array.shape}".encode())
+            h.update(array.data)
+
+    for part in parts:
+        update(part)
+    return h.hexdigest()
+
+
+def _nbytes(value):
+    if isinstance(value, dict):
+        return sum(_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(v) for v in value)
+    return getattr(value, 'nbytes', 0)
+
+
+class StageCache:
+    def __init__(self, max_bytes=1024 * 2**20, max_entries=128):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (stage, key) -> (value, nbytes)
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def get(self, stage, key):
+        with self._lock:
+            entry = self._entries.get((stage, key))
+            if entry is None:
+                self.misses[stage] = self.misses.get(stage, 0) + 1
+                return None
+            self._entries.move_to_end((stage, key))
+            self.hits[stage] = self.hits.get(stage, 0) + 1
+            return entry[0]
+
+    def put(self, stage, key, value):
+        nbytes = _nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop((stage, key), None)
+            if old is not None:
+                self._nbytes -= old[1]
+            self._entries[(stage, key)] = (value, nbytes)
+            self._nbytes += nbytes
+            while self._entries and (self._nbytes > self.max_bytes or len(self._entries) > self.max_entries):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._nbytes -= evicted
+
+    def get_or_compute(self, stage, key, compute):
+        # The value is computed outside the lock: concurrent misses on the same
+        # key may compute it twice, but never block the other stages.
+        value = self.get(stage, key)
+        if value is None:
+            value = compute()
+            self.put(stage, key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits.clear()
+            self.misses.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'nbytes': self._nbytes,
+                'hits': dict(self.hits),
+                'misses': dict(self.misses),
+            }
+
+    def summary(self):
+        stats = self.stats()
+        hits = sum(stats['hits'].values())
+        misses = sum(stats['misses'].values())
+        return (f"Cache: {stats['entries']} entries, {stats['nbytes'] / 2**20:.1f} MB | "
+                f"hits {hits} / misses {misses}")
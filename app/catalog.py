@@ -0,0 +1,123 @@
+# catalog.py
+# Catalog of the template antenna arrays: every *.enu.txt file of the bundled
+# assets directory, of the user templates directory and of the directories
+# listed in $ARGOSIM_TEMPLATES (separated by os.pathsep). Earlier directories
+# take precedence for templates of the same name.
+#
+# Listing the catalog only reads the directories, so that startup does not
+# depend on the number of templates. A template is parsed the first time it
+# is loaded and converted to a binary cache, <cache_dir>/<file hash>.npz,
+# which holds its antenna positions and, once the simulation needs them, its
+# baselines. An edited file gets a new hash and is converted again.
+import glob
+import hashlib
+import os
+import threading
+
+import numpy as np
+
+ASSETS_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'assets'))
+USER_DIR = os.path.join(os.environ.get('XDG_DATA_HOME', os.path.expanduser('~/.local/share')),
+                        'argosim-gui', 'templates')
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+                         'argosim-gui', 'templates')
+SUFFIX = '.enu.txt'
+# Bumped when the content of the cached files changes
+_CACHE_VERSION = b'1'
+
+
+def template_dirs():
+    extra = os.environ.get('ARGOSIM_TEMPLATES', '')
+    return [ASSETS_DIR, USER_DIR] + [d for d in extra.split(os.pathsep) if d]
+
+
+def file_hash(path):
+    h = hashlib.blake2b(_CACHE_VERSION, digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class TemplateCatalog:
+    def __init__(self, dirs=None, cache_dir=CACHE_DIR):
+        self.dirs = template_dirs() if dirs is None else list(dirs)
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._hashes = {}  # path -> (mtime_ns, size, hash)
+        self.refresh()
+
+    def refresh(self):
+        # Rescan the template directories
+        paths = {}
+        for directory in self.dirs:
+            for path in sorted(glob.glob(os.path.join(glob.escape(directory), '*' + SUFFIX))):
+                paths.setdefault(os.path.basename(path)[:-len(SUFFIX)], os.path.abspath(path))
+        with self._lock:
+            self._paths = paths
+
+    def names(self):
+        return sorted(self._paths, key=str.lower)
+
+    def path(self, name):
+        # Path of a template, given by name or as a path to a .enu.txt file
+        if name in self._paths:
+            return self._paths[name]
+        if os.path.isfile(name):
+            return os.path.abspath(name)
+        raise FileNotFoundError(f"No array template '{name}' in {', '.join(self.dirs)}")
+
+    def _cache_file(self, path):
+        stat = os.stat(path)
+        with self._lock:
+            known = self._hashes.get(path)
+        if known is None or known[:2] != (stat.st_mtime_ns, stat.st_size):
+            known = (stat.st_mtime_ns, stat.st_size, file_hash(path))
+            with self._lock:
+                self._hashes[path] = known
+        return os.path.join(self.cache_dir, known[2] + '.npz')
+
+    def _read(self, cache_file, key):
+        # One array of a cached template (npz members are read on access), None if missing
+        try:
+            with np.load(cache_file) as data:
+                return data[key] if key in data.files else None
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, cache_file, arrays):
+        # Atomic write, so that concurrent readers never see a partial file
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp = f"{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, cache_file)
+
+    def antenna(self, name):
+        # (n_antennas, 3) ENU positions, as argosim.antenna_utils.load_antenna_enu_txt
+        path = self.path(name)
+        cache_file = self._cache_file(path)
+        antenna = self._read(cache_file, 'antenna')
+        if antenna is None:
+            import argosim.antenna_utils
+            antenna = np.asarray(argosim.antenna_utils.load_antenna_enu_txt(path))
+            try:
+                self._write(cache_file, {'antenna': antenna})
+            except OSError:
+                pass  # read-only cache: parse again next time
+        return antenna
+
+    def baselines(self, name):
+        # Baselines of a template, as pipeline.compute_baselines, computed once
+        path = self.path(name)
+        cache_file = self._cache_file(path)
+        baselines = self._read(cache_file, 'baselines')
+        if baselines is None:
+            import pipeline
+            antenna = self.antenna(name)
+            baselines = pipeline.compute_baselines(antenna)
+            try:
+                self._write(cache_file, {'antenna': antenna, 'baselines': baselines})
+            except OSError:
+                pass
+        return baselines
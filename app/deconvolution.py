@@ -0,0 +1,152 @@
+# deconvolution.py
+# CLEAN deconvolution of the dirty images (see pipeline.compute_clean), in the
+# Clark scheme. Each major cycle selects the residual pixels above a fraction
+# of the residual peak, the highest sidelobe of the beam outside a central
+# patch. The minor cycle runs Hogbom iterations on those pixels only: the peak
+# search and the subtraction of the beam patch around each component are
+# vectorized over them. The major cycle then subtracts all the components
+# from the dirty image through the full beam, in one FFT convolution. As
+# argosim.clean.clean_hogbom, the cleaning is positive-only, the beam is
+# shifted without wrap-around and the restoring beam is round, of the mean
+# FWHM of the beam main lobe (argosim.metrics_utils.fit_elliptical_beam).
+import numpy as np
+import scipy.fft
+
+import fft
+
+# Most pixels of a minor cycle (the brightest ones)
+MAX_ACTIVE = 50000
+# Highest minor cycle limit, as a fraction of the residual peak
+MAX_MINOR_LIMIT = 0.95
+
+
+class Convolver:
+    # Linear convolution of (ny, nx) images with a kernel of the same shape,
+    # centred on pixel (ny // 2, nx // 2), through the real FFT of the
+    # zero-padded kernel computed once
+    def __init__(self, kernel):
+        ny, nx = kernel.shape
+        self.shape = (ny, nx)
+        self.fft_shape = (scipy.fft.next_fast_len(2 * ny, real=True), scipy.fft.next_fast_len(2 * nx, real=True))
+        self.kernel_ft = scipy.fft.rfft2(kernel, s=self.fft_shape, workers=fft.WORKERS)
+
+    def __call__(self, image):
+        ny, nx = self.shape
+        image_ft = scipy.fft.rfft2(image, s=self.fft_shape, workers=fft.WORKERS)
+        image_ft *= self.kernel_ft
+        full = scipy.fft.irfft2(image_ft, s=self.fft_shape, workers=fft.WORKERS, overwrite_x=True)
+        return full[ny // 2:ny // 2 + ny, nx // 2:nx // 2 + nx]
+
+
+def beam_patch(beam, half_width):
+    # Central (2 h + 1)^2 patch of the beam, h at most half_width, and the
+    # highest sidelobe outside it
+    ny, nx = beam.shape
+    cy, cx = ny // 2, nx // 2
+    h = max(0, min(half_width, cy, cx, ny - 1 - cy, nx - 1 - cx))
+    window = (slice(cy - h, cy + h + 1), slice(cx - h, cx + h + 1))
+    outside = np.abs(beam)
+    outside[window] = 0
+    return beam[window].copy(), float(outside.max())
+
+
+def restoring_beam(shape, fwhm):
+    # Round Gaussian of unit peak and FWHM (pixels), centred as the beams
+    ny, nx = shape
+    y = np.arange(ny) - ny // 2
+    x = np.arange(nx) - nx // 2
+    r2 = y[:, None]**2 + x[None, :]**2
+    return np.exp(-4 * np.log(2) * r2 / fwhm**2)
+
+
+def main_lobe_fwhm(patch):
+    # Mean FWHM (pixels) of the main lobe, fitted on the beam patch
+    from argosim.metrics_utils import fit_elliptical_beam
+    fit = fit_elliptical_beam(patch)
+    return float((fit['width'] + fit['height']) / 2)
+
+
+def minor_cycle(values, ys, xs, patch, gain, limit, max_iter):
+    # Hogbom iterations on the active pixels (values at rows ys, columns xs),
+    # updated in place; returns the flux of their components and the number
+    # of iterations
+    h = patch.shape[0] // 2
+    components = np.zeros(len(values))
+    for n in range(max_iter):
+        i = int(np.argmax(values))
+        peak = values[i]
+        if peak <= limit:
+            return components, n
+        flux = gain * peak
+        components[i] += flux
+        dy = ys - ys[i]
+        dx = xs - xs[i]
+        near = np.flatnonzero((np.abs(dy) <= h) & (np.abs(dx) <= h))
+        values[near] -= flux * patch[dy[near] + h, dx[near] + h]
+    return components, max_iter
+
+
+def clean(dirty, beam, gain=0.1, max_iter=1000, threshold=0., patch=25, max_major=100, progress=None,
+          stop=None):
+    # Clark CLEAN of a dirty image with its dirty beam (normalised to a unit
+    # peak), for at most max_iter components. Stops once the residual peak is
+    # below threshold, or grows from one major cycle to the next, or when
+    # stop() is true (checked after each major cycle). progress(percent,
+    # message) is called after each major cycle.
+    dirty = np.asarray(dirty, dtype=np.float64)
+    beam = np.asarray(beam, dtype=np.float64)
+    beam = beam / beam.max()
+    ny, nx = dirty.shape
+    convolve = Convolver(beam)
+    window, sidelobe = beam_patch(beam, patch)
+    fraction = min(sidelobe, MAX_MINOR_LIMIT)
+    model = np.zeros_like(dirty)
+    residual = dirty.copy()
+    peaks = []
+    n_iter = 0
+    n_major = 0
+    reason = 'max_iter'
+    while n_iter < max_iter:
+        peak = float(residual.max())
+        if peaks and peak > peaks[-1]:
+            reason = 'diverging'
+            break
+        peaks.append(peak)
+        if peak <= threshold:
+            reason = 'threshold'
+            break
+        if n_major == max_major:
+            reason = 'max_major'
+            break
+        if stop is not None and stop():
+            reason = 'stopped'
+            break
+        # Minor cycle on the pixels above the limit (the brightest MAX_ACTIVE)
+        limit = max(threshold, fraction * peak)
+        flat = residual.ravel()
+        active = np.flatnonzero(flat > limit)
+        if len(active) > MAX_ACTIVE:
+            active = active[np.argpartition(flat[active], -MAX_ACTIVE)[-MAX_ACTIVE:]]
+        ys, xs = np.divmod(active, nx)
+        components, n = minor_cycle(flat[active], ys, xs, window, gain, limit, max_iter - n_iter)
+        n_iter += n
+        model.ravel()[active] += components
+        # Major cycle
+        residual = dirty - convolve(model)
+        n_major += 1
+        if progress is not None:
+            progress(min(99, 100 * n_iter // max_iter), f"CLEAN: {n_iter} components, residual peak {peak:.3g}")
+
+    fwhm = main_lobe_fwhm(window)
+    restored = Convolver(restoring_beam(beam.shape, fwhm))(model) + residual
+    return {
+        'model': model,
+        'residual': residual,
+        'restored': restored,
+        'restoring_fwhm': fwhm,
+        'iterations': n_iter,
+        'major_cycles': n_major,
+        'peaks': peaks,
+        'residual_peak': float(residual.max()),
+        'stop_reason': reason,
+    }
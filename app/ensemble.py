@@ -0,0 +1,130 @@
+# ensemble.py
+# Monte Carlo ensembles of observations (see pipeline.compute_ensemble): K
+# random skies and noise realizations drawn from one local
+# np.random.Generator, so that the global numpy random state is never
+# touched. The skies follow argosim.data_utils.n_source_sky (Gaussian
+# sources at random positions, normalised to a unit peak), rendered in
+# batches in numpy. The FFTs of a batch are stacked in one call; the
+# Kaiser-Bessel degridding and gridding of argosim.imaging_utils run per
+# realization, on the kernels already compiled for single observations
+# (vectorizing them with jax.vmap compiles new kernels for each batch size,
+# which takes longer than the whole ensemble). The skies, noise and
+# statistics are float64, or float32 (dtype) to halve the batch memory.
+import numpy as np
+
+# Per-realization fidelity metrics of an observation against its sky model
+METRICS = ['rmse', 'correlation', 'peak', 'dynamic_range']
+# Sky pixels below this fraction of the peak are off-source
+OFF_SOURCE = 1e-3
+
+
+def draw_sources(rng, n_realizations, n_sources, min_source_size, max_source_size):
+    # Sizes (deg), means in [-1, 1]^2 and covariances of the sources, as
+    # argosim.data_utils.random_source, each of shape (K, n_sources, ...)
+    shape = (n_realizations, n_sources)
+    sizes = rng.random(shape) * (max_source_size - min_source_size) + min_source_size
+    mu = rng.random(shape + (2,)) * 2 - 1
+    var = rng.random(shape + (2,)) + 5
+    cov = (rng.random(shape) * 2 - 1) * np.sqrt(var[..., 0] * var[..., 1]) * 0.5
+    return {'sizes': sizes, 'mu': mu, 'var': var, 'cov': cov}
+
+
+def render_skies(sources, Npx, fov_size, dtype=np.float64):
+    # (K, Npx, Npx) sky models, as argosim.data_utils.gauss_source summed over
+    # the sources with unit intensities, normalised by their maximum
+    fwhm = 2.355
+    axis = np.linspace(-fwhm / 2, fwhm / 2, Npx, dtype=dtype)
+    n_realizations, n_sources = sources['sizes'].shape
+    sources = {k: np.asarray(v, dtype=dtype) for k, v in sources.items()}
+    skies = np.zeros((n_realizations, Npx, Npx), dtype=dtype)
+    for s in range(n_sources):
+        pix_size = sources['sizes'][:, s] * Npx / fov_size
+        a = sources['var'][:, s, 0]
+        c = sources['var'][:, s, 1]
+        b = sources['cov'][:, s]
+        det = a * c - b * b
+        # det(sigma) times the scale of the covariance, pix_size**2 / (Npx**2 * sqrt(det))
+        scale = pix_size**2 / (Npx * Npx) * np.sqrt(det)
+        dx = (axis[None, :] - sources['mu'][:, s, 0, None] * fwhm / 2)[:, None, :]
+        dy = (axis[None, :] - sources['mu'][:, s, 1, None] * fwhm / 2)[:, :, None]
+        q = (c[:, None, None] * dx**2 - 2 * b[:, None, None] * dx * dy + a[:, None, None] * dy**2)
+        skies += np.exp(-q / (2 * scale[:, None, None]))
+    skies /= skies.max(axis=(1, 2), keepdims=True)
+    return skies
+
+
+def draw_noise(rng, n_realizations, n_vis, sigma, weights=None, dtype=np.float64):
+    # (K, n_vis) complex noise of total variance sigma^2 per visibility, as
+    # argosim.imaging_utils.add_noise_vis; sigma^2 / m for a sample of weight m.
+    # Drawn in float64 whatever the dtype, so that both precisions see the same noise.
+    noise = (rng.standard_normal((n_realizations, n_vis, 2)) * (sigma / np.sqrt(2))).astype(dtype, copy=False)
+    noise = noise[..., 0] + 1j * noise[..., 1]
+    if weights is not None:
+        noise /= np.sqrt(np.asarray(weights, dtype=dtype))
+    return noise
+
+
+def degrid_batch(sky_uv, uv_px, grid_shape, W, beta):
+    # (K, n_vis) argosim.imaging_utils.degrid_visibilities_conv of each grid of sky_uv
+    import argosim.imaging_utils as iu
+    return np.stack([np.asarray(iu.degrid_visibilities_conv(uv, uv_px, grid_shape, W, beta)) for uv in sky_uv])
+
+
+def grid_batch(vis, uv_px, grid_shape, W, beta):
+    # (K, ny, nx) argosim.imaging_utils.grid_visibilities_conv of each row of vis
+    import argosim.imaging_utils as iu
+    import jax.numpy as jnp
+    return np.stack([np.asarray(iu.grid_visibilities_conv(jnp.asarray(v), uv_px, grid_shape, W, beta)) for v in vis])
+
+
+def fidelity(observations, skies):
+    # Metrics of each (Npx, Npx) observation against its sky model: RMS of
+    # the residual, Pearson correlation, peak, and peak over the off-source RMS
+    residual = observations - skies
+    axes = (1, 2)
+    obs_c = observations - observations.mean(axis=axes, keepdims=True)
+    sky_c = skies - skies.mean(axis=axes, keepdims=True)
+    peak = observations.max(axis=axes)
+    off = skies < OFF_SOURCE
+    off_rms = np.sqrt((observations**2 * off).sum(axis=axes) / np.maximum(off.sum(axis=axes), 1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return {
+            'rmse': np.sqrt((residual**2).mean(axis=axes)),
+            'correlation': (obs_c * sky_c).sum(axis=axes) / np.sqrt((obs_c**2).sum(axis=axes) * (sky_c**2).sum(axis=axes)),
+            'peak': peak,
+            'dynamic_range': peak / off_rms,
+        }
+
+
+class RunningStats:
+    # Mean and standard deviation of images added batch by batch (Chan et al.
+    # parallel variance), without keeping the batches, accumulated in dtype
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def add(self, batch):
+        batch = np.asarray(batch, dtype=self.dtype)
+        n = len(batch)
+        mean = batch.mean(axis=0)
+        m2 = ((batch - mean)**2).sum(axis=0)
+        if self.count == 0:
+            self.count, self.mean, self.m2 = n, mean, m2
+            return
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (n / total)
+        self.m2 = self.m2 + m2 + delta**2 * (self.count * n / total)
+        self.count = total
+
+    def std(self):
+        # Sample standard deviation (zero for a single realization)
+        return np.sqrt(self.m2 / max(self.count - 1, 1))
+
+
+def summarize(metrics):
+    # "name mean ± std" of each metric over the realizations
+    return ", ".join(f"{name} {np.mean(values):.3g} ± {np.std(values):.2g}"
+                     for name, values in metrics.items())
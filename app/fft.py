@@ -0,0 +1,118 @@
+# fft.py
+# FFT layer for the GUI pipeline, on scipy.fft (pocketfft, which also keeps
+# its own cache of FFT plans). Centred transforms use the checkerboard
+# identity fftshift(F(ifftshift(x))) = C * F(C * x), C = (-1)**(i + j), valid
+# for even shapes, which replaces the two shift copies by in-place products.
+# Real inputs/outputs go through rfft2/irfft2. The checkerboards are computed
+# once per shape and shared by all threads (as pocketfft's plan cache is).
+# The checkerboard product goes into a new array, transformed in place where
+# scipy can: no scratch buffer outlives a call, and no two calls share one.
+import os
+import threading
+
+import numpy as np
+import scipy.fft
+
+# Threads used by each transform
+WORKERS = os.cpu_count() or 1
+
+
+# Read-only, shared by the threads
+_checkerboards = {}
+_checkerboards_lock = threading.Lock()
+
+
+def _checkerboard(shape, dtype):
+    key = (shape, np.dtype(dtype).str)
+    board = _checkerboards.get(key)
+    if board is None:
+        sign_y = 1 - 2 * (np.arange(shape[0]) % 2)
+        sign_x = 1 - 2 * (np.arange(shape[1]) % 2)
+        board = np.outer(sign_y, sign_x).astype(dtype)
+        board.flags.writeable = False
+        with _checkerboards_lock:
+            board = _checkerboards.setdefault(key, board)
+    return board
+
+
+def clear_workspace():
+    with _checkerboards_lock:
+        _checkerboards.clear()
+
+
+def _even(shape):
+    return shape[-2] % 2 == 0 and shape[-1] % 2 == 0
+
+
+def _real_dtype(dtype):
+    return np.float32 if np.dtype(dtype) in (np.float32, np.complex64) else np.float64
+
+
+def _complex_dtype(dtype):
+    return np.complex64 if np.dtype(dtype) in (np.float32, np.complex64) else np.complex128
+
+
+def is_hermitian(uv):
+    # uv[k] == conj(uv[-k]) around the centre pixel (Npx // 2) of a centred uv grid
+    uv = np.asarray(uv)
+    if not _even(uv.shape):
+        return bool(np.array_equal(uv, np.conj(uv[..., ::-1, ::-1])))
+    if np.any(uv[..., 0, :]) or np.any(uv[..., :, 0]):
+        return False
+    inner = uv[..., 1:, 1:]
+    return bool(np.array_equal(inner, np.conj(inner[..., ::-1, ::-1])))
+
+
+def uv2sky(uv, hermitian=False, real=True, workers=None):
+    # Real part of fftshift(ifft2(ifftshift(uv))) over the last two axes, as
+    # argosim.imaging_utils.uv2sky, or the complex image with real=False. With
+    # hermitian=True (e.g. a symmetric uv mask) only half of the plane is
+    # transformed, with irfft2.
+    workers = WORKERS if workers is None else workers
+    uv = np.asarray(uv)
+    axes = (-2, -1)
+    if not _even(uv.shape):
+        sky = scipy.fft.fftshift(scipy.fft.ifft2(scipy.fft.ifftshift(uv, axes=axes), workers=workers), axes=axes)
+        return sky.real if real else sky
+    ny, nx = uv.shape[-2:]
+    cdtype = _complex_dtype(uv.dtype)
+    board = _checkerboard((ny, nx), _real_dtype(cdtype))
+    if hermitian:
+        buf = np.multiply(uv[..., :nx // 2 + 1], board[:, :nx // 2 + 1], dtype=cdtype)
+        sky = scipy.fft.irfft2(buf, s=(ny, nx), workers=workers, overwrite_x=True)
+        sky *= board
+        return sky
+    buf = np.multiply(uv, board, dtype=cdtype)
+    if not real:
+        sky = scipy.fft.ifft2(buf, workers=workers, overwrite_x=True)
+        sky *= board
+        return sky
+    sky = scipy.fft.ifft2(buf, workers=workers, overwrite_x=True)
+    return np.multiply(sky.real, board)
+
+
+def sky2uv(sky, workers=None):
+    # fftshift(fft2(ifftshift(sky))) over the last two axes, as
+    # argosim.imaging_utils.sky2uv. A real sky goes through rfft2 and the other
+    # half of the plane is filled in by Hermitian symmetry.
+    workers = WORKERS if workers is None else workers
+    sky = np.asarray(sky)
+    axes = (-2, -1)
+    if not _even(sky.shape):
+        uv = scipy.fft.fft2(scipy.fft.ifftshift(sky, axes=axes), workers=workers)
+        return scipy.fft.fftshift(uv, axes=axes)
+    ny, nx = sky.shape[-2:]
+    if np.iscomplexobj(sky):
+        board = _checkerboard((ny, nx), _real_dtype(sky.dtype))
+        uv = scipy.fft.fft2(np.multiply(sky, board), workers=workers, overwrite_x=True)
+        uv *= board
+        return uv
+    board = _checkerboard((ny, nx), sky.dtype)
+    half = scipy.fft.rfft2(np.multiply(sky, board), workers=workers)
+    uv = np.empty(sky.shape[:-1] + (nx,), dtype=half.dtype)
+    uv[..., :nx // 2 + 1] = half
+    # F[ky, kx] = conj(F[-ky, -kx]) for a real input
+    rows = (-np.arange(ny)) % ny
+    np.conjugate(half[..., rows, nx // 2 - 1:0:-1], out=uv[..., nx // 2 + 1:])
+    uv *= board
+    return uv
@@ -0,0 +1,321 @@
+# gridding.py
+# Chunked nearest-neighbour uv gridding. Produces the same cells as
+# argosim.imaging_utils.grid_uv_samples, but streams the samples through a
+# preallocated grid in fixed-size chunks so that the temporaries stay within a
+# memory budget, and can grid only one half of a Hermitian-symmetric uv set.
+# Also groups redundant baselines and subsamples large baseline sets, both
+# returning per-baseline weights that the gridding carries. The grids are
+# float64 by default, or float32 (dtype) to halve their memory; the weighted
+# grids keep the precision of the counts.
+import numpy as np
+
+# Default memory ceiling (bytes) for the uv grid plus the per-chunk temporaries
+DEFAULT_MEMORY_BUDGET = 256 * 2**20
+# Temporaries per gridded sample: (u, v) cell offsets and flat index (int64),
+# rounding buffer (float64 x2) and weight (float64)
+_BYTES_PER_SAMPLE = 56
+_MIN_CHUNK = 4096
+# Floating-point precisions of the grids (and of the aperture arrays, see pipeline.real_dtype)
+PRECISIONS = ['float64', 'float32']
+
+
+def _cell_scale(fov_size):
+    # argosim scales by u / max_uv / 2 * Npx with max_uv = (180/pi) * Npx / (2 * fov),
+    # i.e. one uv cell per 1/fov wavelengths
+    return fov_size * np.pi / 180
+
+
+def chunk_size(Npx, memory_budget=None, n_grids=1, itemsize=8):
+    # Number of samples per chunk once the grid(s) are allocated
+    memory_budget = DEFAULT_MEMORY_BUDGET if memory_budget is None else memory_budget
+    grid_bytes = n_grids * Npx * Npx * itemsize
+    if grid_bytes > memory_budget:
+        raise MemoryError(
+            f"The {Npx}x{Npx} uv grid needs {grid_bytes / 2**20:.0f} MB, above the "
+            f"gridding memory budget of {memory_budget / 2**20:.0f} MB.")
+    return max(_MIN_CHUNK, (memory_budget - grid_bytes) // _BYTES_PER_SAMPLE)
+
+
+def uv_extent(uv_samples, chunk=None):
+    # Per-axis (min, max) of the (u, v) coordinates, computed chunk by chunk
+    chunk = len(uv_samples) if chunk is None else chunk
+    uv_min = np.full(2, np.inf)
+    uv_max = np.full(2, -np.inf)
+    for start in range(0, len(uv_samples), max(chunk, 1)):
+        uv = np.asarray(uv_samples[start:start + chunk, :2])
+        uv_min = np.minimum(uv_min, uv.min(axis=0))
+        uv_max = np.maximum(uv_max, uv.max(axis=0))
+    return uv_min, uv_max
+
+
+def check_uv_range(uv_min, uv_max, Npx, fov_size, hermitian=False):
+    # Cheap precheck on the uv extent only, before any sample is gridded.
+    # With hermitian=True the mirrored samples (-u, -v) must fit as well.
+    scale = _cell_scale(fov_size)
+    k_lo = np.rint(np.asarray(uv_min) * scale)
+    k_hi = np.rint(np.asarray(uv_max) * scale)
+    if hermitian:
+        k_hi = np.maximum(k_hi, -k_lo)
+        k_lo = -k_hi
+    c = Npx // 2
+    if np.any(k_lo + c < 0) or np.any(k_hi + c > Npx - 1):
+        max_abs = np.maximum(np.abs(uv_min), np.abs(uv_max))
+        required_npix = np.ceil(max_abs * 2 * np.pi * fov_size / 180)
+        raise ValueError(f"uv samples lie out of the uv-plane. Required Npix > {required_npix}")
+
+
+def cell_indices(uv_samples, Npx, fov_size):
+    # Flat (v, u) cell index of each sample. The range must have been checked.
+    k = np.rint(np.asarray(uv_samples)[:, :2] * _cell_scale(fov_size)).astype(np.int64)
+    k += Npx // 2
+    return k[:, 1] * Npx + k[:, 0]
+
+
+def mirror_cells(cells, Npx):
+    # Flat index of the cells of the mirrored samples (-u, -v)
+    c2 = 2 * (Npx // 2)
+    iv, iu = np.divmod(cells, Npx)
+    return (c2 - iv) * Npx + (c2 - iu)
+
+
+def add_mirror(grid):
+    # grid + grid(-u, -v), for a grid filled with one half of a Hermitian set
+    Npx = grid.shape[-1]
+    if Npx % 2:
+        return grid + grid[..., ::-1, ::-1]
+    # Even Npx: the centre is at Npx // 2, so cell i mirrors to Npx - i and
+    # the first row/column (no mirror in the grid) must be empty
+    out = grid.copy()
+    out[..., 1:, 1:] += grid[..., :0:-1, :0:-1]
+    return out
+
+
+def clear_residues(grid, cells, min_weight):
+    # Zeroes the cells (flat indices of the flat grid) whose weights were all
+    # subtracted again but left a rounding residue, i.e. below half the
+    # smallest sample weight, so that they test empty (grid > 0)
+    cells = cells[np.abs(grid[cells]) < min_weight / 2]
+    grid[cells] = 0
+
+
+def clipped_cell_indices(uv_samples, Npx, fov_size, hermitian=False):
+    # Flat cell index of the samples that fall in the grid (and whose mirror
+    # does too, with hermitian=True), and the mask of those samples
+    k = np.rint(np.asarray(uv_samples)[:, :2] * _cell_scale(fov_size)).astype(np.int64)
+    k += Npx // 2
+    lo = 1 if hermitian and Npx % 2 == 0 else 0
+    inside = np.all((k >= lo) & (k <= Npx - 1), axis=1)
+    k = k[inside]
+    return k[:, 1] * Npx + k[:, 0], inside
+
+
+def grid_uv_counts(uv_samples, Npx, fov_size, weights=None, hermitian=False, memory_budget=None, clip=False,
+                   dtype=np.float64):
+    # (Npx, Npx) histogram (or sum of weights) of the uv samples per cell.
+    # With hermitian=True, uv_samples holds one sample of each (uv, -uv) pair
+    # and the mirrored half is added at the end. With clip=True the samples
+    # out of the grid are dropped instead of raising (low-resolution previews).
+    chunk = chunk_size(Npx, memory_budget, itemsize=np.dtype(dtype).itemsize)
+    if not clip:
+        uv_min, uv_max = uv_extent(uv_samples, chunk)
+        check_uv_range(uv_min, uv_max, Npx, fov_size, hermitian=hermitian)
+
+    grid = np.zeros(Npx * Npx, dtype=dtype)
+    ones = np.ones(min(chunk, len(uv_samples)), dtype=dtype)
+    for start in range(0, len(uv_samples), chunk):
+        samples = uv_samples[start:start + chunk]
+        w = ones[:len(samples)] if weights is None else np.asarray(weights[start:start + chunk], dtype=float)
+        if clip:
+            cells, inside = clipped_cell_indices(samples, Npx, fov_size, hermitian=hermitian)
+            w = w[inside]
+        else:
+            cells = cell_indices(samples, Npx, fov_size)
+        np.add.at(grid, cells, w)
+    grid = grid.reshape(Npx, Npx)
+    return add_mirror(grid) if hermitian else grid
+
+
+def grid_uv_cube(uv_samples, nchan, Npx, fov_size, weights=None, memory_budget=None, clip=False,
+                 dtype=np.float64):
+    # (nchan, Npx, Npx) sums of the sample weights per cell and channel, for
+    # uv samples ordered (channel, time, baseline) as uv_track_multiband. All
+    # the channels are binned in one pass: a sample goes to the flat index
+    # channel * Npx^2 + cell. The bincount of each chunk is float64.
+    chunk = chunk_size(Npx, memory_budget, n_grids=nchan, itemsize=np.dtype(dtype).itemsize + 8)
+    if not clip:
+        uv_min, uv_max = uv_extent(uv_samples, chunk)
+        check_uv_range(uv_min, uv_max, Npx, fov_size)
+    per_channel = len(uv_samples) // nchan
+    grid = np.zeros(nchan * Npx * Npx, dtype=dtype)
+    for start in range(0, len(uv_samples), chunk):
+        samples = uv_samples[start:start + chunk]
+        channel = np.arange(start, start + len(samples)) // per_channel
+        w = None if weights is None else np.asarray(weights[start:start + chunk], dtype=float)
+        if clip:
+            cells, inside = clipped_cell_indices(samples, Npx, fov_size)
+            channel = channel[inside]
+            w = None if w is None else w[inside]
+        else:
+            cells = cell_indices(samples, Npx, fov_size)
+        grid += np.bincount(channel * (Npx * Npx) + cells, weights=w, minlength=nchan * Npx * Npx)
+    return grid.reshape(nchan, Npx, Npx)
+
+
+WEIGHTINGS = ['uniform', 'natural', 'briggs']
+
+
+def _briggs_f2(counts, robust, axes=None):
+    # Briggs (1995) robust weighting: f^2 = (5 * 10^-R)^2 / (sum W^2 / sum W),
+    # with W the natural weight of each cell
+    total = np.sum(counts, axis=axes, keepdims=axes is not None)
+    squares = np.sum(np.square(counts), axis=axes, keepdims=axes is not None)
+    return (5 * 10 ** -robust) ** 2 * np.divide(total, squares, out=np.zeros_like(total), where=squares > 0)
+
+
+def weight_grid(counts, weighting='uniform', robust=0.):
+    # Gridded imaging weights, over the last two axes, from the natural-weight
+    # grid (sum of the sample weights per cell). Per sample, uniform weighting
+    # is w / W(cell) and Briggs weighting w / (1 + W(cell) f^2), so that a
+    # cell holds 1, resp. W / (1 + W f^2). The grids are scaled to the number
+    # of sampled cells: all the weightings give beams of the same peak as the
+    # binary uv mask, which uniform weighting is. float32 counts give float32
+    # grids.
+    dtype = np.float32 if np.asarray(counts).dtype == np.float32 else np.float64
+    counts = np.asarray(counts, dtype=dtype)
+    axes = (-2, -1)
+    if weighting == 'uniform':
+        return (counts > 0).astype(dtype)
+    if weighting == 'natural':
+        grid = counts
+    elif weighting == 'briggs':
+        grid = counts / (1 + counts * _briggs_f2(counts, robust, axes))
+    else:
+        raise ValueError(f"Invalid weighting '{weighting}'. Choose from {', '.join(WEIGHTINGS)}.")
+    n_cells = np.count_nonzero(counts, axis=axes)[..., None, None].astype(dtype)
+    total = grid.sum(axis=axes, keepdims=True)
+    return grid * np.divide(n_cells, total, out=np.zeros_like(total), where=total > 0)
+
+
+def sample_imaging_weights(uv_samples, Npx, fov_size, weighting='natural', robust=0., weights=None):
+    # Per-sample imaging weights (see weight_grid), with the cell weights W
+    # binned on the (Npx, Npx) imaging grid. Samples out of the grid count
+    # alone in their cell.
+    w = np.ones(len(uv_samples)) if weights is None else np.asarray(weights, dtype=float)
+    if weighting == 'natural':
+        return w
+    if weighting not in WEIGHTINGS:
+        raise ValueError(f"Invalid weighting '{weighting}'. Choose from {', '.join(WEIGHTINGS)}.")
+    cells, inside = clipped_cell_indices(uv_samples, Npx, fov_size)
+    counts = np.bincount(cells, weights=w[inside], minlength=Npx * Npx)
+    cell_weight = w.copy()
+    cell_weight[inside] = counts[cells]
+    if weighting == 'uniform':
+        return w / cell_weight
+    return w / (1 + cell_weight * _briggs_f2(counts, robust))
+
+
+def uv_mask_from_counts(counts, mask_type='binary'):
+    # Same mask types as argosim.imaging_utils.grid_uv_samples, complex64 for
+    # float32 counts
+    dtype = np.complex64 if np.asarray(counts).dtype == np.float32 else complex
+    if mask_type == 'binary':
+        return (counts > 0).astype(dtype)
+    elif mask_type == 'histogram':
+        return counts.astype(dtype)
+    raise ValueError("Invalid mask type. Choose between 'binary' and 'histogram'.")
+
+
+def hermitian_pairs(baselines):
+    # For baselines ordered as argosim.antenna_utils.get_baselines (every
+    # (i, j) pair with i != j), return the indices of the i < j baselines and,
+    # for every baseline, the index of its i < j counterpart and its sign.
+    # Baselines in mirrored halves (b then -b, see redundant_baselines) are
+    # paired the same way with the first half. Returns None otherwise.
+    n_baselines = len(baselines)
+    b = np.asarray(baselines)
+    n = int(round((1 + np.sqrt(1 + 4 * n_baselines)) / 2))
+    if n * (n - 1) == n_baselines and n >= 2:
+        i, j = np.where(~np.eye(n, dtype=bool))
+        upper = np.flatnonzero(i < j)
+        # Position of (min(i, j), max(i, j)) among the i < j baselines
+        lo, hi = np.minimum(i, j), np.maximum(i, j)
+        half_index = lo * (2 * n - lo - 1) // 2 + (hi - lo - 1)
+        sign = np.where(i < j, 1., -1.)
+        if np.allclose(b, sign[:, None] * b[upper][half_index]):
+            return upper, half_index, sign
+    half = n_baselines // 2
+    if half and n_baselines % 2 == 0 and np.allclose(b[half:], -b[:half]):
+        upper = np.arange(half)
+        sign = np.repeat([1., -1.], half)
+        return upper, np.concatenate([upper, upper]), sign
+    return None
+
+
+def redundant_baselines(baselines, resolution=1e-3):
+    # Groups the baselines equal to within `resolution` (m), as the many
+    # redundant baselines of regular arrays. Returns one baseline per group
+    # and the number of baselines in each group (multiplicity), in mirrored
+    # halves (b then -b) when the set is symmetric, as full baseline sets are.
+    b = np.asarray(baselines, dtype=float)
+    keys = np.rint(b / resolution).astype(np.int64)
+    # Sign of the first non-zero coordinate of each baseline
+    first = np.argmax(keys != 0, axis=1)
+    positive = keys[np.arange(len(keys)), first] >= 0
+    half, index, multiplicity = np.unique(keys[positive], axis=0, return_index=True, return_counts=True)
+    mirror, mirror_multiplicity = np.unique(-keys[~positive], axis=0, return_counts=True)
+    if np.array_equal(half, mirror) and np.array_equal(multiplicity, mirror_multiplicity):
+        half = b[positive][index]
+        return np.concatenate([half, -half]), np.concatenate([multiplicity, multiplicity])
+    _, index, multiplicity = np.unique(keys, axis=0, return_index=True, return_counts=True)
+    return b[index], multiplicity
+
+
+def _allocate(sizes, total):
+    # Split total in proportion to sizes, rounded by largest remainder
+    if total <= 0 or not sizes.sum():
+        return np.zeros(len(sizes), dtype=np.int64)
+    quota = sizes * total / sizes.sum()
+    share = np.floor(quota).astype(np.int64)
+    share[np.argsort(share - quota, kind='stable')[:total - share.sum()]] += 1
+    return share
+
+
+def stratified_subsample(baselines, max_baselines, weights=None, n_lengths=16, n_angles=8, seed=0):
+    # At most max_baselines baselines, drawn without replacement from strata
+    # of baseline length (quantiles) and orientation: one per stratum, the
+    # rest in proportion to the stratum sizes, so that the subset covers the
+    # uv plane like the full set. The weights are scaled by the inverse
+    # sampling fraction of each stratum, which keeps the weighted uv density
+    # and the total weight. Hermitian sets are sampled by (b, -b) pairs and
+    # returned in mirrored halves. Returns (baselines, weights).
+    b = np.asarray(baselines, dtype=float)
+    w = np.ones(len(b)) if weights is None else np.asarray(weights, dtype=float)
+    pairs = hermitian_pairs(b)
+    if pairs is not None:
+        b, w = b[pairs[0]], w[pairs[0]]
+        max_baselines //= 2
+    n = len(b)
+    max_baselines = max(1, min(max_baselines, n))
+    # No more strata than samples
+    n_angles = max(1, min(n_angles, int(np.sqrt(max_baselines / 2))))
+    n_lengths = max(1, min(n_lengths, max_baselines // n_angles))
+    length = np.hypot(b[:, 0], b[:, 1])
+    angle = np.mod(np.arctan2(b[:, 1], b[:, 0]), np.pi)
+    edges = np.quantile(length, np.linspace(0, 1, n_lengths + 1)[1:-1])
+    n_strata = n_lengths * n_angles
+    stratum = (np.searchsorted(edges, length) * n_angles
+               + np.minimum((angle / np.pi * n_angles).astype(np.int64), n_angles - 1))
+    sizes = np.bincount(stratum, minlength=n_strata)
+    filled = (sizes > 0).astype(np.int64)
+    take = filled + _allocate(sizes - filled, max_baselines - filled.sum())
+    # Random order within each stratum, keep the first `take` of each
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(n), stratum))
+    rank = np.arange(n) - (np.cumsum(sizes) - sizes)[stratum[order]]
+    keep = np.sort(order[rank < take[stratum[order]]])
+    total = np.bincount(stratum, w, minlength=n_strata)
+    kept = np.bincount(stratum[keep], w[keep], minlength=n_strata)
+    b, w = b[keep], w[keep] * total[stratum[keep]] / kept[stratum[keep]]
+    if pairs is not None:
+        return np.concatenate([b, -b]), np.concatenate([w, w])
+    return b, w
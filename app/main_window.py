@@ -1,27 +1,52 @@
 # main_window.py
 import sys
 from PyQt6.QtWidgets import (
-    QWidget, QVBoxLayout, QScrollArea
+    QWidget, QVBoxLayout, QHBoxLayout, QScrollArea, QLabel, QPushButton, QFileDialog, QMessageBox, QCheckBox
 )
+from PyQt6.QtCore import QTimer
+
+import store
+from cache import StageCache
+from profiling import Profiler
+from session import Session
 
 from widget_array import InterferometricArrayWidget
 from widget_apsyn import ApertureSynthesisWidget
 from widget_imag import ImagingWidget
+from widget_clean import CleanWidget
+from widget_compare import ComparisonWidget
 
 class SimulationApp(QWidget):
-    def __init__(self):
+    def __init__(self, startup=None, print_timings=False):
+        # With a startup.Startup, the default array is only drawn by start(),
+        # after the first paint of the window
         super().__init__()
         self.setWindowTitle("argosim: radio interferometric simulator")
+        self.startup = startup
+        self.print_timings = print_timings
+
+        # Stage cache shared by the widgets
+        self.cache = StageCache()
+        # Array, parameters and results of the stages, shared by the widgets
+        self.session = Session(cache=self.cache)
+        # Stage timings of the runs of the widgets
+        self.profiler = Profiler()
 
         # Main content widget and layout
         content_widget = QWidget()
         content_layout = QVBoxLayout()
-        self.array_widget = InterferometricArrayWidget()
+        self.array_widget = InterferometricArrayWidget(self.session, profiler=self.profiler,
+                                                       render=startup is None)
         content_layout.addWidget(self.array_widget)
-        self.aperture_widget = ApertureSynthesisWidget(array_widget=self.array_widget)
+        self.aperture_widget = ApertureSynthesisWidget(self.session, profiler=self.profiler)
         content_layout.addWidget(self.aperture_widget)
-        self.imaging_widget = ImagingWidget(aperture_widget=self.aperture_widget)
+        self.imaging_widget = ImagingWidget(self.session, aperture_widget=self.aperture_widget,
+                                            profiler=self.profiler)
         content_layout.addWidget(self.imaging_widget)
+        self.clean_widget = CleanWidget(self.session, imaging_widget=self.imaging_widget, profiler=self.profiler)
+        content_layout.addWidget(self.clean_widget)
+        self.comparison_widget = ComparisonWidget(self.session, profiler=self.profiler)
+        content_layout.addWidget(self.comparison_widget)
         content_widget.setLayout(content_layout)
 
         # Scroll area
@@ -32,4 +57,142 @@ class SimulationApp(QWidget):
         # Main layout
         main_layout = QVBoxLayout()
         main_layout.addWidget(scroll)
+
+        # Cache status bar
+        status_row = QHBoxLayout()
+        self.cache_label = QLabel()
+        status_row.addWidget(self.cache_label, 4)
+        self.clear_cache_button = QPushButton("Clear Cache")
+        self.clear_cache_button.clicked.connect(self.cache.clear)
+        self.clear_cache_button.clicked.connect(self._update_cache_label)
+        status_row.addWidget(self.clear_cache_button, 1)
+        self.save_button = QPushButton("Save Results...")
+        self.save_button.clicked.connect(self._save_results)
+        status_row.addWidget(self.save_button, 1)
+        self.load_button = QPushButton("Load Results...")
+        self.load_button.clicked.connect(self._load_results)
+        status_row.addWidget(self.load_button, 1)
+        main_layout.addLayout(status_row)
+
+        # Profiling overlay: stage timings of the last run
+        profile_row = QHBoxLayout()
+        self.profile_label = QLabel("No run profiled yet.")
+        profile_row.addWidget(self.profile_label, 4)
+        self.capture_checkbox = QCheckBox("cProfile/tracemalloc")
+        self.capture_checkbox.setToolTip("Profile the next runs with cProfile and trace their memory "
+                                         "allocations (slower). The profiles are in the exported trace.")
+        self.capture_checkbox.toggled.connect(self._set_capture)
+        profile_row.addWidget(self.capture_checkbox)
+        self.export_trace_button = QPushButton("Export Trace...")
+        self.export_trace_button.clicked.connect(self._export_trace)
+        profile_row.addWidget(self.export_trace_button, 1)
+        main_layout.addLayout(profile_row)
         self.setLayout(main_layout)
+
+        self.cache_timer = QTimer(self)
+        self.cache_timer.timeout.connect(self._update_cache_label)
+        self.cache_timer.timeout.connect(self._update_profile_label)
+        self.cache_timer.start(500)
+        self._update_cache_label()
+        self._last_trace = None
+
+    def start(self):
+        # Deferred first render: polls until the window is painted and the
+        # background imports are done
+        self.start_timer = QTimer(self)
+        self.start_timer.timeout.connect(self._render_when_ready)
+        self.start_timer.start(20)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.startup is not None:
+            self.startup.mark('first_paint')
+
+    def _render_when_ready(self):
+        if 'first_paint' not in dict(self.startup.milestones) or not self.startup.preloaded():
+            return
+        self.start_timer.stop()
+        self.array_widget.runner.finished.connect(self._on_first_render)
+        self.array_widget.runner.failed.connect(self._on_first_render)
+        self.array_widget.render()
+
+    def _on_first_render(self):
+        self.array_widget.runner.finished.disconnect(self._on_first_render)
+        self.array_widget.runner.failed.disconnect(self._on_first_render)
+        self.startup.mark('first_render')
+        self.profiler.record(self.startup.trace())
+        if self.print_timings:
+            self.startup.report()
+
+    def _update_cache_label(self):
+        stats = self.cache.stats()
+        self.cache_label.setText(self.cache.summary())
+        stages = sorted(set(stats['hits']) | set(stats['misses']))
+        self.cache_label.setToolTip("\n".join(
+            f"{stage}: {stats['hits'].get(stage, 0)} hits / {stats['misses'].get(stage, 0)} misses"
+            for stage in stages))
+
+    def _update_profile_label(self):
+        trace = self.profiler.last()
+        if trace is None or trace is self._last_trace:
+            return
+        self._last_trace = trace
+        self.profile_label.setText(trace.summary())
+        self.profile_label.setToolTip("\n\n".join(t.details() for t in list(self.profiler.traces)[-3:]))
+
+    def _set_capture(self, checked):
+        self.profiler.capture = checked
+
+    def _export_trace(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Trace", "trace.json", "JSON (*.json)")
+        if not path:
+            return
+        try:
+            self.profiler.export(path)
+        except Exception as e:
+            QMessageBox.critical(self, "Export Trace", f"Error:\n{str(e)}")
+
+    def _result_widgets(self):
+        return {'array': self.array_widget, 'aperture': self.aperture_widget, 'imaging': self.imaging_widget,
+                'clean': self.clean_widget}
+
+    def _save_results(self):
+        # Current array, aperture, imaging and CLEAN results in one result store
+        metadata = {}
+        arrays = {}
+        for name, widget in self._result_widgets().items():
+            results = widget.get_results()
+            if results is not None:
+                metadata[name] = results[0]
+                arrays.update(results[1])
+        if not arrays:
+            QMessageBox.information(self, "Save Results", "There are no results to save yet.")
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Save Results", "results" + store.SUFFIX,
+                                              f"Result store (*{store.SUFFIX})")
+        if not path:
+            return
+        try:
+            store.save_result(path, arrays, metadata)
+        except Exception as e:
+            QMessageBox.critical(self, "Save Results", f"Error:\n{str(e)}")
+
+    def _load_results(self):
+        # The arrays are memory-mapped: nothing is recomputed nor read upfront
+        path = QFileDialog.getExistingDirectory(self, "Load Results")
+        if not path:
+            return
+        try:
+            metadata, arrays = store.load_result(path)
+            for name, widget in self._result_widgets().items():
+                if name in metadata:
+                    widget.show_results(metadata[name], arrays)
+        except Exception as e:
+            QMessageBox.critical(self, "Load Results", f"Error:\n{str(e)}")
+
+    def closeEvent(self, event):
+        # Drop any simulation still running in the background
+        for widget in [self.array_widget, self.aperture_widget, self.imaging_widget, self.clean_widget,
+                       self.comparison_widget]:
+            widget.runner.cancel()
+        super().closeEvent(event)
@@ -0,0 +1,820 @@
+# pipeline.py
+# Qt-free simulation stages shared by the widgets: the aperture (baselines, uv
+# tracks and grid, dirty beams), the imaging (sky model and observation),
+# ensembles, array comparisons and CLEAN. Every stage accepts an optional
+# `progress(percent, message)` callback, which the background worker uses both
+# to report progress and to abort cancelled jobs between stages, and an
+# optional profiling.Trace, which records its time, output size and memory.
+#
+# Stages are memoized in an optional StageCache. Keys are chained: each stage
+# key is derived from the key of its inputs and its own parameters, so only
+# the antenna positions are ever hashed by content.
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import argosim
+import argosim.antenna_utils
+import argosim.data_utils
+import argosim.imaging_utils
+import jax.numpy as jnp
+import numpy as np
+
+import deconvolution
+import ensemble
+import fft
+import profiling
+import gridding
+import uv_coverage
+import wide_field
+from cache import hash_key
+
+# Memory (bytes) of the oversampled grids of an ensemble batch
+ENSEMBLE_MEMORY = 256 * 2**20
+
+# argosim draws its random skies and noise from the global numpy random
+# state, which the concurrent simulations of a comparison share
+_RANDOM_LOCK = threading.Lock()
+
+# Observation parameters that the uv tracks depend on
+TRACK_PARAMS = ['latitude', 'declination', 'start_time', 'duration', 'timestep',
+                'central_freq', 'bandwidth', 'nchan']
+# Aperture arrays compared by precision_report
+PRECISION_PRODUCTS = ['uv_points', 'uv_mask', 'dirty_beam', 'channel_beams']
+
+
+class UVRangeError(ValueError):
+    # Raised when the uv samples do not fit in the (Npx, Npx) uv grid
+    pass
+
+
+def _report(progress, percent, message):
+    if progress is not None:
+        progress(percent, message)
+
+
+def _cached(cache, stage, key, compute, trace=None):
+    if trace is None:
+        if cache is None or key is None:
+            return compute()
+        return cache.get_or_compute(stage, key, compute)
+    with trace.stage(stage) as record:
+        computed = []
+
+        def run():
+            computed.append(True)
+            return compute()
+        result = _cached(cache, stage, key, run)
+        record['cached'] = not computed
+        record.update(profiling.describe(result))
+    return result
+
+
+def antenna_key(antenna):
+    return hash_key('antenna', antenna)
+
+
+def real_dtype(params):
+    # dtype of the aperture arrays: float64, or float32 to halve the memory of
+    # the uv samples, grids, uv mask and beams (see precision_report). The
+    # imaging runs in the float32 of the argosim JAX kernels either way.
+    precision = params.get('precision', 'float64')
+    if precision not in gridding.PRECISIONS:
+        raise ValueError(f"Invalid precision '{precision}'. Choose from {', '.join(gridding.PRECISIONS)}.")
+    return np.dtype(precision)
+
+
+def track_key(baselines_key, params):
+    return hash_key('uv_tracks', baselines_key, {k: params[k] for k in TRACK_PARAMS},
+                    params.get('precision', 'float64'))
+
+
+def compute_baselines(antenna, cache=None, key=None, trace=None, progress=None, load=None):
+    # load: optional callable returning precomputed baselines of the antenna
+    # array (e.g. catalog.TemplateCatalog.baselines), called on a cache miss
+    _report(progress, 0, "Computing baselines")
+    if key is None:
+        key = antenna_key(antenna)
+    if load is None:
+        load = lambda: argosim.antenna_utils.get_baselines(antenna)
+    return _cached(cache, 'baselines', key, lambda: np.asarray(load()), trace=trace)
+
+
+def compute_redundancy(baselines, cache=None, key=None, trace=None):
+    # One baseline per group of identical baselines and the group sizes
+    def compute():
+        unique, multiplicity = gridding.redundant_baselines(baselines)
+        return {'baselines': unique, 'weights': multiplicity}
+    return _cached(cache, 'redundancy', key, compute, trace=trace)
+
+
+def compute_subsample(baselines, max_baselines, weights=None, cache=None, key=None, trace=None):
+    # Stratified subset of at most max_baselines baselines and their weights
+    def compute():
+        subset, subset_weights = gridding.stratified_subsample(baselines, max_baselines, weights=weights)
+        return {'baselines': subset, 'weights': subset_weights}
+    return _cached(cache, 'subsample', key, compute, trace=trace)
+
+
+def sample_weights(weights, n_samples, dtype=np.float64):
+    # Per-sample weights of uv tracks ordered (channel, time, baseline)
+    if weights is None:
+        return None
+    return np.tile(np.asarray(weights, dtype=dtype), n_samples // len(weights))
+
+
+def compute_uv_tracks(baselines, params, cache=None, key=None, trace=None):
+    # Same sampling as the incremental engine (see uv_coverage.hour_angles).
+    # argosim computes the tracks in float32, which float64 keeps as is.
+    def compute():
+        hours = uv_coverage.hour_angles(params)
+        uv_points, _ = argosim.antenna_utils.uv_track_multiband(
+            b_ENU=baselines, lat=params['latitude']/180*np.pi, dec=params['declination']/180*np.pi,
+            track_time=hours[-1]-hours[0], t_0=hours[0], n_times=len(hours),
+            f=params['central_freq']*1e9, df=params['bandwidth']*1e9, n_freqs=params['nchan'])
+        if real_dtype(params) == np.float32:
+            return np.asarray(uv_points, dtype=np.float32)
+        return np.asarray(uv_points)
+    return _cached(cache, 'uv_tracks', key, compute, trace=trace)
+
+
+def grid_memory_budget(params):
+    # Gridding memory ceiling in bytes, None for the default
+    if params.get('grid_memory') is None:
+        return None
+    return int(params['grid_memory'] * 2**20)
+
+
+def compute_uv_grid(uv_points, Npx, fov_size, cache=None, key=None, memory_budget=None, clip=False,
+                    weights=None, dtype=np.float64, trace=None):
+    # Sum of the sample weights per uv cell (natural weights)
+    def compute():
+        try:
+            return gridding.grid_uv_counts(uv_points, Npx, fov_size, weights=weights,
+                                           memory_budget=memory_budget, clip=clip, dtype=dtype)
+        except ValueError as e:
+            raise UVRangeError(str(e)) from e
+    return _cached(cache, 'uv_grid', key, compute, trace=trace)
+
+
+def compute_dirty_beam(counts, weighting='uniform', robust=0., cache=None, key=None, trace=None):
+    # Beam of the combined grid of all channels, i.e. the multi-frequency
+    # synthesis (MFS) beam, under uniform, natural or Briggs weighting.
+    # Symmetric grids (always the case for full baseline sets) go through
+    # irfft2. The uniform beam is that of the binary uv mask, as
+    # argosim.imaging_utils.grid_uv_samples.
+    def compute():
+        grid = gridding.weight_grid(counts, weighting, robust)
+        return fft.uv2sky(grid, hermitian=fft.is_hermitian(grid))
+    return _cached(cache, 'dirty_beam', key, compute, trace=trace)
+
+
+def compute_channel_beams(uv_points, nchan, Npx, fov_size, weighting='uniform', robust=0., weights=None,
+                          memory_budget=None, clip=False, dtype=np.float64, cache=None, key=None, trace=None):
+    # (nchan, Npx, Npx) dirty beams, one per channel, from one batched
+    # gridding pass and one batched FFT
+    def compute():
+        try:
+            cube = gridding.grid_uv_cube(uv_points, nchan, Npx, fov_size, weights=weights,
+                                         memory_budget=memory_budget, clip=clip, dtype=dtype)
+        except ValueError as e:
+            raise UVRangeError(str(e)) from e
+        grid = gridding.weight_grid(cube, weighting, robust)
+        return fft.uv2sky(grid, hermitian=fft.is_hermitian(grid))
+    return _cached(cache, 'channel_beams', key, compute, trace=trace)
+
+
+def compute_aperture(antenna, params, cache=None, coverage=None, preview_Npx=None, trace=None, progress=None,
+                     load_baselines=None):
+    # With params['redundancy'], identical baselines (common in regular
+    # arrays) are tracked and gridded once, weighted by their multiplicity:
+    # the uv mask, the dirty beam and the naturally weighted images are the
+    # same as with every baseline. With params['max_baselines'], large arrays
+    # are subsampled for a quick look, each kept baseline weighted by the
+    # inverse sampling fraction. params['weighting'] (and 'robust') weight
+    # the dirty beam; params['channel_beams'] adds one beam per channel.
+    # With a UVCoverage engine, the uv tracks and their grid are updated
+    # incrementally from the previous call instead of being recomputed.
+    # With preview_Npx, the beam is computed on a coarse (preview_Npx,
+    # preview_Npx) grid over the same FOV, dropping the uv samples beyond it.
+    dtype = real_dtype(params)
+    ant_key = antenna_key(antenna)
+    baselines = compute_baselines(antenna, cache=cache, key=ant_key, trace=trace, progress=progress,
+                                  load=load_baselines)
+    n_baselines = len(baselines)
+    geometry_key = ant_key
+    weights = None
+    if params.get('redundancy'):
+        geometry_key = hash_key('redundancy', geometry_key)
+        redundancy = compute_redundancy(baselines, cache=cache, key=geometry_key, trace=trace)
+        baselines, weights = redundancy['baselines'], redundancy['weights']
+    n_subsampled = None
+    if params.get('max_baselines') and params['max_baselines'] < len(baselines):
+        geometry_key = hash_key('subsample', geometry_key, params['max_baselines'])
+        subsample = compute_subsample(baselines, params['max_baselines'], weights=weights, cache=cache,
+                                      key=geometry_key, trace=trace)
+        baselines, weights = subsample['baselines'], subsample['weights']
+        n_subsampled = len(baselines)
+
+    _report(progress, 20, "Tracking uv samples")
+    uv_key = track_key(geometry_key, params)
+    preview = preview_Npx is not None and preview_Npx < params['Npx']
+    Npx = preview_Npx if preview else params['Npx']
+    fov_size = params['fov']
+    counts = None
+    if coverage is None:
+        uv_points = compute_uv_tracks(baselines, params, cache=cache, key=uv_key, trace=trace)
+    else:
+        # Previews track on their own engine and under their own key, so that
+        # the next full-resolution run still reaches (and updates) the grid of
+        # the main engine
+        engine = coverage.preview_engine() if preview else coverage
+        def compute():
+            nonlocal counts
+            uv, counts = engine.update(baselines, params, geometry_key=geometry_key,
+                                       memory_budget=grid_memory_budget(params), grid=not preview,
+                                       weights=weights, dtype=dtype)
+            return uv
+        tracks_key = hash_key('preview', uv_key) if preview else uv_key
+        uv_points = _cached(cache, 'uv_tracks', tracks_key, compute, trace=trace)
+    uv_weights = sample_weights(weights, len(uv_points), dtype=dtype)
+
+    _report(progress, 50, "Gridding uv samples")
+    grid_key = hash_key('uv_grid', uv_key, Npx, fov_size, preview)
+    if counts is not None:
+        engine_counts = counts
+        counts = _cached(cache, 'uv_grid', grid_key, lambda: engine_counts, trace=trace)
+    else:
+        counts = compute_uv_grid(uv_points, Npx, fov_size, cache=cache, key=grid_key,
+                                 memory_budget=grid_memory_budget(params), clip=preview, weights=uv_weights,
+                                 dtype=dtype, trace=trace)
+    uv_mask = _cached(cache, 'uv_mask', grid_key, lambda: gridding.uv_mask_from_counts(counts), trace=trace)
+
+    _report(progress, 75, "Computing dirty beam")
+    weighting = params.get('weighting', 'uniform')
+    robust = params.get('robust', 0.)
+    beam_key = hash_key('dirty_beam', grid_key, weighting, robust)
+    dirty_beam = compute_dirty_beam(counts, weighting, robust, cache=cache, key=beam_key, trace=trace)
+    channel_beams = None
+    if params.get('channel_beams') and not preview:
+        _report(progress, 85, "Computing channel beams")
+        channel_beams = compute_channel_beams(uv_points, params['nchan'], Npx, fov_size, weighting, robust,
+                                              weights=uv_weights, memory_budget=grid_memory_budget(params),
+                                              dtype=dtype, cache=cache, key=hash_key('channel_beams', beam_key),
+                                              trace=trace)
+
+    _report(progress, 100, "Done")
+    return {
+        'params': params,
+        'preview': preview,
+        'uv_key': uv_key,
+        'n_baselines': n_baselines,
+        'n_subsampled': n_subsampled,
+        'baselines': baselines,
+        'uv_points': uv_points,
+        'uv_weights': uv_weights,
+        'uv_mask': uv_mask,
+        'dirty_beam': dirty_beam,
+        'channel_beams': channel_beams,
+        'coverage_stats': dict(coverage.last_update) if coverage is not None else None,
+    }
+
+
+def precision_report(result, reference=None, products=PRECISION_PRODUCTS):
+    # Memory of the arrays of an aperture result, and what they would take in
+    # float64. Against a reference result (the same run in float64), also
+    # their largest absolute and relative differences.
+    report = {}
+    for name in products:
+        if result.get(name) is None:
+            continue
+        array = np.asarray(result[name])
+        entry = {'dtype': array.dtype.name, 'nbytes': int(array.nbytes),
+                 'float64_nbytes': int(array.size * (16 if np.iscomplexobj(array) else 8))}
+        if reference is not None and reference.get(name) is not None and array.size:
+            ref = np.asarray(reference[name])
+            diff = float(np.max(np.abs(array - ref)))
+            scale = float(np.max(np.abs(ref)))
+            entry['max_abs_diff'] = diff
+            entry['max_rel_diff'] = diff / scale if scale else 0.
+        report[name] = entry
+    return report
+
+
+def summarize_precision(report):
+    # One line: memory saved, then the relative differences if known
+    nbytes = sum(entry['nbytes'] for entry in report.values())
+    float64_nbytes = sum(entry['float64_nbytes'] for entry in report.values())
+    line = (f"{nbytes / 2**20:.1f} MB of aperture arrays ({(float64_nbytes - nbytes) / 2**20:.1f} MB "
+            f"saved vs float64)")
+    diffs = [f"{name} {entry['max_rel_diff']:.1e}" for name, entry in report.items() if 'max_rel_diff' in entry]
+    if diffs:
+        line += "; max relative difference to float64: " + ", ".join(diffs)
+    return line
+
+
+def compute_precision_check(antenna, params, cache=None, load_baselines=None, trace=None, progress=None):
+    # The aperture in float32 and in float64, each on its own incremental
+    # engine (float64 uv tracks), and the precision_report of the first
+    # against the second
+    results = {}
+    for i, precision in enumerate(['float32', 'float64']):
+        _report(progress, 50 * i, f"Simulating in {precision}")
+        results[precision] = compute_aperture(antenna, dict(params, precision=precision), cache=cache,
+                                              coverage=uv_coverage.UVCoverage(), trace=trace,
+                                              load_baselines=load_baselines)
+    _report(progress, 100, "Done")
+    return precision_report(results['float32'], results['float64'])
+
+
+def compute_sky_model(Npx, fov_size, n_sources, min_source_size, max_source_size, seed=None):
+    # Simulate the sky model: n_sources with sizes betweeen (min_source_size, max_source_size).
+    # argosim draws from the global numpy random state: with a seed, it is
+    # seeded for this model only and restored afterwards.
+    with _RANDOM_LOCK:
+        state = np.random.get_state() if seed is not None else None
+        try:
+            if seed is not None:
+                np.random.seed(seed)
+            rand_sizes = np.random.rand(n_sources)
+            source_sizes = rand_sizes * (max_source_size-min_source_size) + min_source_size
+            sky_model = argosim.data_utils.n_source_sky((Npx, Npx), fov_size, deg_size_list=source_sizes, source_intensity_list=[1.]*n_sources, seed=seed, norm='max')
+        finally:
+            if state is not None:
+                np.random.set_state(state)
+    return np.asarray(sky_model)
+
+
+def jit_length(n_vis):
+    # The JAX gridding kernels are compiled for each input length: visibility
+    # arrays are zero-padded to a power of two (up to 2**16, then 4 lengths per
+    # octave, at most 25% padding), so that runs with different numbers of
+    # samples share compiled kernels
+    if n_vis <= 1024:
+        return 1024
+    if n_vis <= 2**16:
+        return 2 ** (n_vis - 1).bit_length()
+    step = 2 ** ((n_vis - 1).bit_length() - 3)
+    return -(-n_vis // step) * step
+
+
+def _pad(values, length, fill=0):
+    padded = np.full((length,) + values.shape[1:], fill, dtype=values.dtype)
+    padded[:len(values)] = values
+    return padded
+
+
+def _kb_grid(shape, kernel_support=7, oversampling=2):
+    # Oversampled grid of the Kaiser-Bessel imaging: grid shape, crop of the
+    # image in it, image-domain correction and kernel (W, beta)
+    W = kernel_support
+    beta = 2.34 * W
+    ny, nx = shape
+    ny_p = int(round(oversampling * ny))
+    nx_p = int(round(oversampling * nx))
+    crop = (slice((ny_p - ny) // 2, (ny_p - ny) // 2 + ny), slice((nx_p - nx) // 2, (nx_p - nx) // 2 + nx))
+    corr = np.asarray(argosim.imaging_utils.kb_correction((ny_p, nx_p), W, beta))
+    return (ny_p, nx_p), crop, corr, (W, beta)
+
+
+def compute_sky_grid(sky, kernel_support=7, oversampling=2):
+    # Corrected, zero-padded uv plane of the sky, which the degridding samples.
+    # Padded in the precision of the JAX kernels, as in argosim.
+    grid_shape, crop, corr, _ = _kb_grid(np.shape(sky), kernel_support, oversampling)
+    sky_pad = np.zeros(grid_shape, dtype=corr.dtype)
+    sky_pad[crop] = sky
+    return fft.sky2uv(sky_pad * corr)
+
+
+def _imaging_setup(shape, track, fov_size, weights=None, weighting='natural', robust=0.,
+                   kernel_support=7, oversampling=2):
+    # Sky-independent part of the Kaiser-Bessel imaging: oversampled grid,
+    # image-domain correction, padded sample coordinates and imaging weights,
+    # and the dirty beam peak which normalises the images
+    iu = argosim.imaging_utils
+    ny, nx = shape
+    grid_shape, crop, corr, (W, beta) = _kb_grid(shape, kernel_support, oversampling)
+    ny_p, nx_p = grid_shape
+    fov_os = (fov_size * ny_p / ny, fov_size * nx_p / nx)
+    uv_px = iu.scale_uv_samples_continuous(track, grid_shape, fov_os)
+    uv_px_native = iu.scale_uv_samples_continuous(track, (ny, nx), (fov_size, fov_size))
+    iu.check_uv_in_grid(uv_px_native, (ny, nx), (fov_size, fov_size), "warn")
+    n_vis = uv_px.shape[0]
+    length = jit_length(n_vis)
+    uv_px = jnp.asarray(_pad(np.asarray(uv_px), length, fill=ny_p // 2))
+    if weighting == 'natural':
+        w_vis = np.asarray(iu._visibility_weights(uv_px_native, (ny, nx), "natural"))
+        if weights is not None:
+            w_vis = w_vis * weights
+    else:
+        w_vis = gridding.sample_imaging_weights(track, ny, fov_size, weighting, robust, weights=weights)
+    w_vis = _pad(w_vis, length)
+    psf_grid = iu.grid_visibilities_conv(jnp.asarray(w_vis.astype(complex)), uv_px, grid_shape, W, beta)
+    beam_c = (fft.uv2sky(psf_grid) * corr)[crop]
+    return {
+        'n_vis': n_vis,
+        'uv_px': uv_px,
+        'w_vis': w_vis,
+        'weights': weights,
+        'corr': corr,
+        'crop': crop,
+        'w_sum': float(beam_c[ny // 2, nx // 2]),
+        'kernel': (W, beta),
+        'shape': (ny, nx),
+        'grid_shape': grid_shape,
+    }
+
+
+def compute_noiseless_observation(sky, track, fov_size, weights=None, weighting='natural', robust=0.,
+                                  kernel_support=7, oversampling=2, sky_uv=None):
+    # Noise-independent part of argosim.imaging_utils.simulate_dirty_observation
+    # (Kaiser-Bessel gridding): degridded model visibilities, their noiseless
+    # dirty image and the normalisation by the dirty beam peak. Padded samples
+    # sit at the grid centre with zero weight. weights are the per-sample
+    # baseline weights (redundancy, subsampling), on top of which the imaging
+    # weighting applies (see gridding.sample_imaging_weights). sky_uv is the
+    # compute_sky_grid of the sky, when already known.
+    iu = argosim.imaging_utils
+    setup = _imaging_setup(sky.shape, track, fov_size, weights=weights, weighting=weighting, robust=robust,
+                           kernel_support=kernel_support, oversampling=oversampling)
+    W, beta = setup['kernel']
+    grid_shape = setup['grid_shape']
+    uv_px = setup['uv_px']
+    if sky_uv is None:
+        sky_uv = compute_sky_grid(sky, kernel_support, oversampling)
+    vis = np.array(iu.degrid_visibilities_conv(sky_uv, uv_px, grid_shape, W, beta))[:setup['n_vis']]
+    gridded = iu.grid_visibilities_conv(jnp.asarray(setup['w_vis'] * _pad(vis, len(setup['w_vis']))),
+                                        uv_px, grid_shape, W, beta)
+    return dict(setup, vis=vis, uv_px=np.asarray(uv_px),
+                obs=(fft.uv2sky(gridded) * setup['corr'])[setup['crop']])
+
+
+def compute_noisy_observation(noiseless, sigma, seed=None):
+    # Gridding is linear: the noisy dirty image is the noiseless one plus the
+    # dirty image of the noise visibilities alone. A sample of weight m
+    # stands for m baselines and gets the noise of their mean, of variance
+    # sigma^2 / m.
+    iu = argosim.imaging_utils
+    obs = noiseless['obs']
+    if sigma != 0.:
+        W, beta = noiseless['kernel']
+        ny, nx = noiseless['shape']
+        ny_p, nx_p = noiseless['grid_shape']
+        py0 = (ny_p - ny) // 2
+        px0 = (nx_p - nx) // 2
+        vis = noiseless['vis']
+        with _RANDOM_LOCK:
+            noise = np.asarray(iu.add_noise_vis(np.zeros_like(vis), sigma, seed=seed))
+        if noiseless['weights'] is not None:
+            noise = noise / np.sqrt(noiseless['weights'])
+        noise = _pad(noise, len(noiseless['w_vis']))
+        gridded = iu.grid_visibilities_conv(jnp.asarray(noiseless['w_vis'] * noise), jnp.asarray(noiseless['uv_px']),
+                                            noiseless['grid_shape'], W, beta)
+        crop = (slice(py0, py0 + ny), slice(px0, px0 + nx))
+        obs = obs + (fft.uv2sky(gridded) * noiseless['corr'])[crop]
+    return obs / noiseless['w_sum']
+
+
+def realism_options(imaging, params):
+    # realism of compute_imaging for the imaging parameters (primary_beam,
+    # dish_diameter, w_stacking, w_planes) of the observation params, None
+    # without wide-field effects
+    if not imaging.get('primary_beam') and not imaging.get('w_stacking'):
+        return None
+    return {
+        'dish_diameter': imaging['dish_diameter'] if imaging.get('primary_beam') else None,
+        'w_stacking': bool(imaging.get('w_stacking')),
+        'w_planes': imaging.get('w_planes'),
+        'freqs': uv_coverage.frequencies(params).tolist(),
+    }
+
+
+def compute_primary_beam(Npx, fov_size, freq, dish_diameter, cache=None, trace=None):
+    # Cached per frequency, FOV and Npx as the n - 1 map (compute_w_term), so
+    # that only the sky-dependent FFTs run again when the sky changes
+    key = hash_key('primary_beam', Npx, fov_size, freq, dish_diameter)
+    return _cached(cache, 'primary_beam', key,
+                   lambda: wide_field.primary_beam(Npx, fov_size, freq, dish_diameter), trace=trace)
+
+
+def compute_w_term(Npx, fov_size, cache=None, trace=None):
+    key = hash_key('w_term', Npx, fov_size)
+    return _cached(cache, 'w_term', key, lambda: wide_field.n_minus_one(Npx, fov_size), trace=trace)
+
+
+def _chunks(indices, length):
+    for start in range(0, len(indices), length):
+        yield indices[start:start + length]
+
+
+def compute_wide_field_observation(sky, track, fov_size, realism, weights=None, weighting='natural', robust=0.,
+                                   kernel_support=7, oversampling=2, cache=None, trace=None):
+    # compute_noiseless_observation with the wide-field effects of realism.
+    # The samples are predicted by group of (channel, w plane): the sky times
+    # the primary beam of the channel (one group per plane without it) and
+    # 1 / n, through the screen of the plane, in one FFT per group; then
+    # imaged back plane by plane. The groups are degridded and gridded in
+    # chunks of one padded length, which share one compiled kernel. The
+    # normalisation by the dirty beam peak is unchanged.
+    iu = argosim.imaging_utils
+    Npx = sky.shape[0]
+    setup = _imaging_setup(sky.shape, track, fov_size, weights=weights, weighting=weighting, robust=robust,
+                           kernel_support=kernel_support, oversampling=oversampling)
+    W, beta = setup['kernel']
+    grid_shape = setup['grid_shape']
+    crop = setup['crop']
+    corr = setup['corr']
+    n_vis = setup['n_vis']
+    uv_px = np.asarray(setup['uv_px'])[:n_vis]
+    w_vis = setup['w_vis'][:n_vis]
+    w_stacking = realism['w_stacking']
+
+    nm1 = compute_w_term(Npx, fov_size, cache=cache, trace=trace)
+    beams = [None]
+    channels = np.zeros(n_vis, dtype=np.int64)
+    if realism['dish_diameter'] is not None:
+        beams = [compute_primary_beam(Npx, fov_size, freq, realism['dish_diameter'], cache=cache, trace=trace)
+                 for freq in realism['freqs']]
+        channels = wide_field.sample_channels(n_vis, len(beams))
+    centres = np.zeros(1)
+    planes = np.zeros(n_vis, dtype=np.int64)
+    if w_stacking:
+        centres, planes = wide_field.plan_w_planes(np.asarray(track)[:, 2], np.abs(nm1).max(),
+                                                   realism['w_planes'])
+    groups = wide_field.sample_groups(channels, planes)
+    length = jit_length(-(-n_vis // len(groups)))
+
+    def chunk_px(chunk):
+        return jnp.asarray(_pad(uv_px[chunk], length, fill=grid_shape[0] // 2))
+
+    vis = np.zeros(n_vis, dtype=np.complex64)
+    sky_pad = np.zeros(grid_shape, dtype=np.result_type(corr.dtype, np.complex64))
+    with profiling.stage(trace, 'wide_field_degridding'):
+        for (channel, plane), indices in groups:
+            screened = sky / (1 + nm1) if beams[channel] is None else sky * beams[channel] / (1 + nm1)
+            if w_stacking:
+                screened = screened * wide_field.w_screen(nm1, centres[plane])
+            sky_pad[crop] = screened
+            sky_uv = fft.sky2uv(sky_pad * corr)
+            for chunk in _chunks(indices, length):
+                predicted = iu.degrid_visibilities_conv(sky_uv, chunk_px(chunk), grid_shape, W, beta)
+                vis[chunk] = np.asarray(predicted)[:len(chunk)]
+
+    obs = np.zeros(sky.shape)
+    with profiling.stage(trace, 'wide_field_gridding'):
+        for plane, centre in enumerate(centres):
+            indices = np.flatnonzero(planes == plane)
+            if not len(indices):
+                continue
+            gridded = 0
+            for chunk in _chunks(indices, length):
+                values = jnp.asarray(_pad(w_vis[chunk] * vis[chunk], length))
+                gridded = gridded + np.asarray(iu.grid_visibilities_conv(values, chunk_px(chunk), grid_shape, W, beta))
+            image = (fft.uv2sky(gridded, real=not w_stacking) * corr)[crop]
+            if w_stacking:
+                image = (image * np.conj(wide_field.w_screen(nm1, centre))).real
+            obs += image
+    beam_edge = None
+    if beams[0] is not None:
+        beam_edge = float(beams[len(beams) // 2][Npx // 2, 0])
+    # The noise is gridded on one plane (compute_noisy_observation): w-phases
+    # leave the statistics of each pixel of its image unchanged
+    return dict(setup, vis=vis, uv_px=np.asarray(setup['uv_px']), obs=obs,
+                wide_field={'w_planes': len(centres) if w_stacking else None, 'beam_edge': beam_edge})
+
+
+def compute_sky(Npx, fov_size, n_sources, min_source_size, max_source_size, seed=None, grid=False,
+                cache=None, trace=None):
+    # Sky model, with grid=True also its compute_sky_grid, as a dict to share
+    # between the observations of several arrays. A random sky (seed=None) is
+    # never cached.
+    sky_key = None
+    if seed is not None:
+        sky_key = hash_key('sky_model', Npx, fov_size, n_sources, min_source_size, max_source_size, seed)
+    sky_model = _cached(cache, 'sky_model', sky_key,
+                        lambda: compute_sky_model(Npx, fov_size, n_sources, min_source_size, max_source_size, seed=seed),
+                        trace=trace)
+    sky_uv = None
+    if grid:
+        grid_key = hash_key('sky_grid', sky_key) if sky_key is not None else None
+        sky_uv = _cached(cache, 'sky_grid', grid_key, lambda: compute_sky_grid(sky_model), trace=trace)
+    return {'key': sky_key, 'sky_model': sky_model, 'sky_uv': sky_uv}
+
+
+def compute_imaging(uv_points, fov_size, Npx, n_sources, min_source_size, max_source_size,
+                    noise_level, seed=None, uv_key=None, uv_weights=None, weighting='natural', robust=0.,
+                    sky=None, realism=None, cache=None, trace=None, progress=None):
+    # uv_weights are determined by uv_key. sky: a compute_sky result to
+    # observe, drawn from the other parameters by default. realism: the
+    # wide-field effects to simulate (see realism_options), the observation
+    # is then that of the sky seen through the primary beam.
+    _report(progress, 0, "Simulating sky model")
+    if sky is None:
+        sky = compute_sky(Npx, fov_size, n_sources, min_source_size, max_source_size, seed=seed,
+                          cache=cache, trace=trace)
+    sky_key = sky['key']
+    sky_model = sky['sky_model']
+
+    _report(progress, 30, "Simulating model visibilities")
+    vis_key = None
+    if sky_key is not None and uv_key is not None:
+        vis_key = hash_key('visibilities', sky_key, uv_key, fov_size, weighting, robust)
+        if realism is not None:
+            vis_key = hash_key(vis_key, realism)
+    if realism is None:
+        noiseless = _cached(cache, 'visibilities', vis_key,
+                            lambda: compute_noiseless_observation(sky_model, uv_points, fov_size, weights=uv_weights,
+                                                                  weighting=weighting, robust=robust,
+                                                                  sky_uv=sky['sky_uv']),
+                            trace=trace)
+    else:
+        noiseless = _cached(cache, 'visibilities', vis_key,
+                            lambda: compute_wide_field_observation(sky_model, uv_points, fov_size, realism,
+                                                                   weights=uv_weights, weighting=weighting,
+                                                                   robust=robust, cache=cache, trace=trace),
+                            trace=trace)
+
+    _report(progress, 70, "Adding noise")
+    obs_key = None
+    if vis_key is not None:
+        obs_key = hash_key('observation', vis_key, noise_level, seed)
+    obs = _cached(cache, 'observation', obs_key,
+                  lambda: compute_noisy_observation(noiseless, noise_level, seed=seed), trace=trace)
+
+    params = {'Npx': Npx, 'n_sources': n_sources, 'min_source_size': min_source_size,
+              'max_source_size': max_source_size, 'noise_level': noise_level, 'seed': seed,
+              'weighting': weighting, 'robust': robust}
+    result = {'fov_size': fov_size, 'params': params, 'sky_model': sky_model, 'observation': obs}
+    if realism is not None:
+        params.update({'primary_beam': realism['dish_diameter'] is not None, 'w_stacking': realism['w_stacking'],
+                       'w_planes': realism['w_planes']})
+        if realism['dish_diameter'] is not None:
+            params['dish_diameter'] = realism['dish_diameter']
+        result['wide_field'] = noiseless['wide_field']
+    _report(progress, 100, "Done")
+    return result
+
+
+def ensemble_batch_size(grid_shape, n_realizations, memory_budget=ENSEMBLE_MEMORY):
+    # Realizations per batch: about 6 complex (ny_p, nx_p) arrays each
+    per_realization = 6 * grid_shape[0] * grid_shape[1] * 16
+    return int(min(n_realizations, max(1, memory_budget // per_realization)))
+
+
+def compute_ensemble(uv_points, fov_size, Npx, n_sources, min_source_size, max_source_size,
+                     noise_level, n_realizations, seed=None, uv_key=None, uv_weights=None,
+                     weighting='natural', robust=0., memory_budget=ENSEMBLE_MEMORY, precision='float64',
+                     cache=None, trace=None, progress=None):
+    # n_realizations skies and noise realizations from np.random.default_rng(seed),
+    # imaged in batches: one stacked FFT per batch for the model visibilities
+    # and one for the dirty images. The draws do not depend on the batch size,
+    # and only the mean, the std and the first realization are kept.
+    # A random ensemble (seed=None) is never cached. precision sets the dtype
+    # of the skies, noise and statistics.
+    dtype = real_dtype({'precision': precision})
+    key = None
+    if seed is not None and uv_key is not None:
+        key = hash_key('ensemble', uv_key, fov_size, Npx, n_sources, min_source_size, max_source_size,
+                       noise_level, n_realizations, seed, weighting, robust, precision)
+
+    def compute():
+        _report(progress, 0, "Setting up the ensemble")
+        rng = np.random.default_rng(seed)
+        sources = ensemble.draw_sources(rng, n_realizations, n_sources, min_source_size, max_source_size)
+        setup = _imaging_setup((Npx, Npx), uv_points, fov_size, weights=uv_weights, weighting=weighting,
+                               robust=robust)
+        W, beta = setup['kernel']
+        grid_shape = setup['grid_shape']
+        crop = setup['crop']
+        corr = setup['corr']
+        w_vis = setup['w_vis'].astype(dtype)
+        n_vis = setup['n_vis']
+        batch = ensemble_batch_size(grid_shape, n_realizations, memory_budget)
+        stats = ensemble.RunningStats(dtype)
+        metrics = {name: [] for name in ensemble.METRICS}
+        first = None
+        for start in range(0, n_realizations, batch):
+            _report(progress, 5 + 90 * start // n_realizations,
+                    f"Realizations {start + 1}-{min(start + batch, n_realizations)} of {n_realizations}")
+            n = min(batch, n_realizations - start)
+            skies = ensemble.render_skies({k: v[start:start + n] for k, v in sources.items()}, Npx, fov_size,
+                                          dtype=dtype)
+            sky_pad = np.zeros((n,) + grid_shape, dtype=corr.dtype)
+            sky_pad[(slice(None),) + crop] = skies
+            sky_uv = fft.sky2uv(sky_pad * corr)
+            vis = ensemble.degrid_batch(sky_uv, setup['uv_px'], grid_shape, W, beta)
+            vis[:, n_vis:] = 0.
+            if noise_level != 0.:
+                vis[:, :n_vis] += ensemble.draw_noise(rng, n, n_vis, noise_level, weights=setup['weights'],
+                                                      dtype=dtype)
+            gridded = ensemble.grid_batch(w_vis * vis, setup['uv_px'], grid_shape, W, beta)
+            obs = (fft.uv2sky(gridded) * corr)[(slice(None),) + crop] / setup['w_sum']
+            stats.add(obs)
+            for name, values in ensemble.fidelity(obs, skies).items():
+                metrics[name].append(values)
+            if first is None:
+                first = (skies[0], obs[0])
+        _report(progress, 100, "Done")
+        return {
+            'sky_model': first[0],
+            'observation': first[1],
+            'mean': stats.mean,
+            'std': stats.std(),
+            'metrics': {name: np.concatenate(values) for name, values in metrics.items()},
+        }
+
+    result = _cached(cache, 'ensemble', key, compute, trace=trace)
+    return dict(result, fov_size=fov_size, params={
+        'Npx': Npx, 'n_sources': n_sources, 'min_source_size': min_source_size,
+        'max_source_size': max_source_size, 'noise_level': noise_level, 'seed': seed,
+        'weighting': weighting, 'robust': robust, 'n_realizations': n_realizations, 'precision': precision})
+
+
+def compute_comparison(arrays, params, imaging, cache=None, max_workers=None, trace=None, progress=None):
+    # Aperture synthesis and imaging of several arrays, as (label, antenna,
+    # load_baselines) tuples, with the same observation params and imaging
+    # parameters (compute_imaging keywords, seed included). The sky model and
+    # its uv plane are computed once and observed by every array; the arrays
+    # then run concurrently on threads sharing the stage cache. The beams and
+    # observations are compared to those of the first array.
+    if not arrays:
+        raise ValueError("No array to compare.")
+    fov_size = params['fov']
+    Npx = params['Npx']
+    _report(progress, 0, "Simulating sky model")
+    sky = compute_sky(Npx, fov_size, imaging['n_sources'], imaging['min_source_size'],
+                      imaging['max_source_size'], seed=imaging.get('seed'), grid=True, cache=cache, trace=trace)
+
+    done = []
+
+    def simulate(label, antenna, load_baselines):
+        report = None
+        if progress is not None:
+            report = lambda percent, message: progress(10 + 85 * len(done) // len(arrays), f"{label}: {message}")
+        # No UVCoverage engine: the widgets keep theirs
+        aperture = compute_aperture(antenna, params, cache=cache, load_baselines=load_baselines, progress=report)
+        obs = compute_imaging(aperture['uv_points'], fov_size, Npx, imaging['n_sources'],
+                              imaging['min_source_size'], imaging['max_source_size'], imaging['noise_level'],
+                              seed=imaging.get('seed'), uv_key=aperture['uv_key'],
+                              uv_weights=aperture['uv_weights'], weighting=imaging.get('weighting', 'natural'),
+                              robust=imaging.get('robust', 0.), sky=sky,
+                              realism=realism_options(imaging, params), cache=cache, progress=report)
+        done.append(label)
+        _report(progress, 10 + 85 * len(done) // len(arrays), f"Simulated {label}")
+        return {'label': label, 'n_baselines': aperture['n_baselines'],
+                'dirty_beam': aperture['dirty_beam'], 'observation': obs['observation']}
+
+    workers = max_workers or min(len(arrays), os.cpu_count() or 1)
+    with profiling.stage(trace, 'arrays'):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(simulate, *array) for array in arrays]
+            results = [future.result() for future in futures]
+    with profiling.stage(trace, 'differences'):
+        reference = results[0]
+        for result in results:
+            result['beam_difference'] = result['dirty_beam'] - reference['dirty_beam']
+            result['observation_difference'] = result['observation'] - reference['observation']
+    _report(progress, 100, "Done")
+    return {
+        'fov_size': fov_size,
+        'params': params,
+        'imaging': imaging,
+        'sky_model': sky['sky_model'],
+        'results': results,
+    }
+
+
+def compute_imaging_beam(aperture, weighting='natural', robust=0., cache=None, trace=None):
+    # Dirty beam of an aperture result under the imaging weighting, to CLEAN
+    # its observations: the beam of the aperture when the weightings agree,
+    # else the beam of its uv grid (cached by compute_aperture)
+    params = aperture['params']
+    if weighting == params.get('weighting', 'uniform') and (weighting != 'briggs'
+                                                            or robust == params.get('robust', 0.)):
+        return aperture['dirty_beam']
+    if aperture.get('uv_points') is None:
+        raise ValueError(f"The {weighting} dirty beam needs the uv samples of the aperture.")
+    Npx = params['Npx']
+    fov_size = params['fov']
+    grid_key = None
+    if aperture.get('uv_key') is not None:
+        grid_key = hash_key('uv_grid', aperture['uv_key'], Npx, fov_size, False)
+    counts = compute_uv_grid(aperture['uv_points'], Npx, fov_size, cache=cache, key=grid_key,
+                             memory_budget=grid_memory_budget(params), weights=aperture.get('uv_weights'),
+                             dtype=real_dtype(params), trace=trace)
+    beam_key = hash_key('dirty_beam', grid_key, weighting, robust) if grid_key is not None else None
+    return compute_dirty_beam(counts, weighting, robust, cache=cache, key=beam_key, trace=trace)
+
+
+def compute_clean(observation, beam, gain=0.1, max_iter=1000, threshold=0., patch=25, trace=None, progress=None,
+                  stop=None):
+    # CLEAN of an observation (see deconvolution.clean), never cached: a run
+    # stopped early (stop() true) is partial
+    _report(progress, 0, "Cleaning")
+    with profiling.stage(trace, 'clean') as record:
+        result = deconvolution.clean(observation, beam, gain=gain, max_iter=max_iter, threshold=threshold,
+                                     patch=patch, progress=progress, stop=stop)
+        record.update(profiling.describe(result))
+    _report(progress, 100, "Done")
+    result['params'] = {'gain': gain, 'max_iter': max_iter, 'threshold': threshold, 'patch': patch}
+    return result
@@ -0,0 +1,243 @@
+# profiling.py
+# Per-stage instrumentation of the simulation runs. A Trace records, for each
+# stage of a run (baselines, uv tracks, gridding, FFT, noise, drawing...), its
+# wall time, whether it was served by the stage cache, the size of its output
+# and the peak memory. With capture=True the run is also profiled with
+# cProfile, and tracemalloc measures the peak memory allocated in each stage.
+# The Profiler keeps the last traces for the status overlay and exports them
+# as a JSON trace.
+import cProfile
+import io
+import json
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import partial
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Functions listed in the cProfile summary of a run
+PROFILE_TOP = 25
+# Held by the run being captured. cProfile hooks the whole process
+# (sys.monitoring since Python 3.12), which refuses a second active profiler,
+# and tracemalloc is process-wide: the runs overlapping a captured one are
+# only timed.
+_CAPTURE_LOCK = threading.Lock()
+
+
+def peak_rss_mb():
+    # Peak resident memory of the process (MB), None if unavailable
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kB elsewhere
+    return round(peak / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def describe(value):
+    # Shape and size of a stage output
+    if isinstance(value, dict):
+        arrays = [v for v in value.values() if hasattr(v, 'nbytes')]
+        return {'nbytes': int(sum(a.nbytes for a in arrays))}
+    if hasattr(value, 'shape') and hasattr(value, 'nbytes'):
+        return {'shape': list(value.shape), 'nbytes': int(value.nbytes)}
+    return {}
+
+
+class Trace:
+    def __init__(self, name, capture=False):
+        self.name = name
+        self.capture = capture
+        self.start = time.time()
+        self.stages = []
+        self.profile = None
+        self._capturing = False  # holds _CAPTURE_LOCK
+        self._local = threading.local()
+
+    def _open_peaks(self):
+        # Traced peaks (bytes) of the stages open in the calling thread, innermost last
+        if not hasattr(self._local, 'peaks'):
+            self._local.peaks = []
+        return self._local.peaks
+
+    @contextmanager
+    def stage(self, name):
+        # Yields the stage record, to which the caller can add its output.
+        # tracemalloc has a single peak: an enclosing stage keeps its peak so
+        # far before a nested stage resets it, and gets the nested peak back.
+        # A nested stage (e.g. the kernels of the wide-field visibilities) is
+        # part of the time of the stage around it.
+        record = {'stage': name}
+        tracing = self._capturing and tracemalloc.is_tracing()
+        open_peaks = self._open_peaks()
+        if open_peaks:
+            record['nested'] = True
+        if tracing:
+            if open_peaks:
+                open_peaks[-1] = max(open_peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        open_peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['time'] = round(time.perf_counter() - start, 6)
+            record['peak_rss_mb'] = peak_rss_mb()
+            peak = open_peaks.pop()
+            if tracing:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                if open_peaks:
+                    open_peaks[-1] = max(open_peaks[-1], peak)
+                record['peak_traced_mb'] = round(peak / 2**20, 3)
+            self.stages.append(record)
+
+    def run(self, fn, *args, **kwargs):
+        # Runs fn(*args, trace=self, **kwargs), under cProfile and tracemalloc
+        # in capture mode, unless another run is being captured
+        if not self.capture:
+            return fn(*args, trace=self, **kwargs)
+        if not _CAPTURE_LOCK.acquire(blocking=False):
+            self.profile = "Not profiled: another run was being profiled at the same time."
+            return fn(*args, trace=self, **kwargs)
+        profiler = None
+        started_tracemalloc = False
+        try:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:  # another profiling tool, e.g. a debugger
+                profiler = None
+                self.profile = f"Not profiled: {e}."
+            started_tracemalloc = not tracemalloc.is_tracing()
+            if started_tracemalloc:
+                tracemalloc.start()
+            self._capturing = True
+            return fn(*args, trace=self, **kwargs)
+        finally:
+            self._capturing = False
+            if profiler is not None:
+                profiler.disable()
+            if started_tracemalloc:
+                tracemalloc.stop()
+            _CAPTURE_LOCK.release()
+            if profiler is not None:
+                out = io.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_TOP)
+                self.profile = out.getvalue()
+
+    def total(self):
+        # Stages marked as background overlap the others, nested ones are
+        # counted in the stages around them
+        return sum(s['time'] for s in self.stages if not s.get('background') and not s.get('nested'))
+
+    def sizes(self):
+        # Problem sizes read from the stage outputs
+        sizes = {}
+        for s in self.stages:
+            shape = s.get('shape')
+            if shape is None:
+                continue
+            if s['stage'] == 'baselines':
+                sizes['baselines'] = shape[0]
+            elif s['stage'] == 'uv_tracks':
+                sizes['uv_samples'] = shape[0]
+            elif s['stage'] in ('uv_grid', 'uv_mask', 'dirty_beam', 'sky_model'):
+                sizes['grid'] = 'x'.join(str(n) for n in shape)
+        return sizes
+
+    def summary(self):
+        stages = " · ".join(f"{s['stage']} {s['time']:.3f}" + (" (cached)" if s.get('cached') else "")
+                            + (" (background)" if s.get('background') else "")
+                            + (" (nested)" if s.get('nested') else "") for s in self.stages)
+        sizes = self.sizes()
+        text = f"{self.name}: {self.total():.3f} s | {stages}"
+        if sizes:
+            text += " | " + ", ".join(f"{k} {v}" for k, v in sizes.items())
+        return text
+
+    def details(self):
+        lines = [f"{self.name} ({self.total():.3f} s)"]
+        for s in self.stages:
+            line = f"{s['stage']}: {s['time'] * 1e3:.1f} ms"
+            if s.get('cached'):
+                line += ", cached"
+            if s.get('background'):
+                line += ", in the background"
+            if s.get('nested'):
+                line += ", within the stage after it"
+            if 'shape' in s:
+                line += f", shape {tuple(s['shape'])}"
+            if 'nbytes' in s:
+                line += f", {s['nbytes'] / 2**20:.2f} MB"
+            if 'peak_traced_mb' in s:
+                line += f", peak alloc {s['peak_traced_mb']:.1f} MB"
+            if s.get('peak_rss_mb') is not None:
+                line += f", peak RSS {s['peak_rss_mb']:.0f} MB"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def to_dict(self):
+        trace = {
+            'name': self.name,
+            'start': self.start,
+            'total': round(self.total(), 6),
+            'sizes': self.sizes(),
+            'stages': self.stages,
+        }
+        if self.profile is not None:
+            trace['profile'] = self.profile
+        return trace
+
+
+def traced(trace, fn):
+    # fn run under the trace, or fn itself without a trace
+    return fn if trace is None else partial(trace.run, fn)
+
+
+def stage(trace, name):
+    # trace.stage(name), or a no-op without a trace
+    return nullcontext({}) if trace is None else trace.stage(name)
+
+
+class Profiler:
+    # Traces of the last runs, shared by the widgets
+    def __init__(self, max_traces=200):
+        self._lock = threading.Lock()
+        self.traces = deque(maxlen=max_traces)
+        self.capture = False
+
+    def new_trace(self, name):
+        return Trace(name, capture=self.capture)
+
+    def record(self, trace):
+        with self._lock:
+            self.traces.append(trace)
+
+    def last(self):
+        with self._lock:
+            return self.traces[-1] if self.traces else None
+
+    def clear(self):
+        with self._lock:
+            self.traces.clear()
+
+    def export(self, path):
+        with self._lock:
+            traces = [t.to_dict() for t in self.traces]
+        with open(path, 'w') as f:
+            json.dump({'traces': traces}, f, indent=2, default=_json_default)
+
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,322 @@
+# rendering.py
+# Persistent matplotlib panels for the widgets. The axes and artists are
+# created once and updated in place (AxesImage.set_data, scatter offsets), and
+# the changing artists are animated: a full canvas draw only happens when the
+# layout changes (axis limits, image extent, panel kind), otherwise the cached
+# background is restored and only those artists are redrawn and blitted.
+# Dense uv coverages are drawn as a 2D density image instead of markers, so
+# the redraw time does not grow with the number of baselines. The baselines of
+# large arrays are binned straight from the antenna pairs.
+import numpy as np
+
+# Number of points above which a uv coverage is drawn as a density image
+DENSITY_THRESHOLD = 50000
+# Bins per axis of the density image
+DENSITY_BINS = 256
+# Antenna indices are only annotated for arrays up to this size
+MAX_ANTENNA_LABELS = 64
+
+
+class Blitter:
+    # Blitting manager (as in the matplotlib blitting tutorial): redraws the
+    # animated artists on top of the cached background after every full draw
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.fig = canvas.figure
+        self._background = None
+        self._artists = []
+        self.layout_changed = True
+        canvas.mpl_connect('draw_event', self._on_draw)
+
+    def add_artist(self, artist):
+        artist.set_animated(True)
+        self._artists.append(artist)
+
+    def remove_artist(self, artist):
+        if artist in self._artists:
+            self._artists.remove(artist)
+
+    def reset(self):
+        self._artists = []
+        self._background = None
+        self.layout_changed = True
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        for artist in self._artists:
+            if artist.get_visible():
+                self.fig.draw_artist(artist)
+
+    def draw(self):
+        # Full draw when the layout changed, blit otherwise
+        if self.layout_changed or self._background is None:
+            self.layout_changed = False
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self._background)
+            self._draw_animated()
+            self.canvas.blit(self.fig.bbox)
+
+
+class Panel:
+    def __init__(self, ax, blitter):
+        self.ax = ax
+        self.blitter = blitter
+        ax.title.set_text("")
+        blitter.add_artist(ax.title)
+
+    def set_title(self, title):
+        self.ax.title.set_text(title)
+
+    def _set_limits(self, xlim, ylim):
+        xlim = tuple(float(x) for x in xlim)
+        ylim = tuple(float(y) for y in ylim)
+        if self.ax.get_xlim() != xlim or self.ax.get_ylim() != ylim:
+            self.ax.set_xlim(xlim)
+            self.ax.set_ylim(ylim)
+            self.blitter.layout_changed = True
+
+
+class ImagePanel(Panel):
+    # Image over a (fov, fov) degree extent with a colorbar, as argosim.plot_utils.plot_sky.
+    # symmetric: colour limits centred on zero (difference maps)
+    def __init__(self, ax, blitter, cbar=True, cmap=None, symmetric=False):
+        super().__init__(ax, blitter)
+        self.cbar = cbar
+        self.cmap = cmap
+        self.symmetric = symmetric
+        self.clim = None
+        self.image = None
+        self.colorbar = None
+        ax.set_xlabel("l [deg]")
+        ax.set_ylabel("m [deg]")
+
+    def _clim(self, image):
+        if self.clim is not None:
+            return self.clim
+        if self.symmetric:
+            vmax = float(np.max(np.abs(image))) or 1.
+            return -vmax, vmax
+        return np.min(image), np.max(image)
+
+    def set_image(self, image, fov_size, title=None):
+        # Drawn from a float32 copy, which matplotlib keeps
+        image = np.asarray(image, dtype=np.float32)
+        extent = (-fov_size / 2, fov_size / 2, -fov_size / 2, fov_size / 2)
+        if self.image is None:
+            vmin, vmax = self._clim(image) if self.symmetric or self.clim else (None, None)
+            self.image = self.ax.imshow(image, extent=extent, origin='lower', cmap=self.cmap,
+                                        vmin=vmin, vmax=vmax)
+            self.blitter.add_artist(self.image)
+            if self.cbar:
+                self.colorbar = self.ax.figure.colorbar(self.image, ax=self.ax)
+                if self.clim is None:
+                    self.blitter.add_artist(self.colorbar.ax)
+            self.blitter.layout_changed = True
+        else:
+            if tuple(self.image.get_extent()) != extent:
+                self.image.set_extent(extent)
+                self.blitter.layout_changed = True
+            self.image.set_data(image)
+            if self.clim is None:
+                self.image.set_clim(*self._clim(image))
+                if self.colorbar is not None:
+                    self.colorbar.update_normal(self.image)
+        self._set_limits(extent[:2], extent[2:])
+        self.set_title(title if title is not None else f"Sky ({image.shape[0]}x{image.shape[1]})")
+
+    def fix_clim(self, clim):
+        # Fixed (vmin, vmax) colour limits for the next images, None to follow
+        # each image again. A fixed colorbar is drawn with the background
+        # instead of being redrawn with every blit (animations).
+        if clim is not None:
+            clim = (float(clim[0]), float(clim[1]))
+        if clim == self.clim:
+            return
+        self.clim = clim
+        if self.image is None:
+            return
+        if clim is not None:
+            self.image.set_clim(*clim)
+        if self.colorbar is not None:
+            self.colorbar.update_normal(self.image)
+            self.colorbar.ax.set_animated(clim is None)
+            if clim is None:
+                self.blitter.add_artist(self.colorbar.ax)
+            else:
+                self.blitter.remove_artist(self.colorbar.ax)
+        self.blitter.layout_changed = True
+
+
+class PointsPanel(Panel):
+    # Scatter of 2D points (in m, shown in k-units) that switches to a density
+    # image above DENSITY_THRESHOLD points, as argosim.plot_utils.plot_baselines
+    def __init__(self, ax, blitter, s=5, c='darkred', ENU=False, density_threshold=None):
+        super().__init__(ax, blitter)
+        self.density_threshold = DENSITY_THRESHOLD if density_threshold is None else density_threshold
+        self.scatter = ax.scatter(np.empty(0), np.empty(0), s=s, c=c)
+        blitter.add_artist(self.scatter)
+        self.density = ax.imshow(np.ma.masked_all((DENSITY_BINS, DENSITY_BINS)), origin='lower',
+                                 cmap='inferno_r', extent=(-1, 1, -1, 1), aspect='auto',
+                                 interpolation='nearest')
+        self.density.set_visible(False)
+        blitter.add_artist(self.density)
+        if ENU:
+            ax.set_xlabel("East [km]")
+            ax.set_ylabel("North [km]")
+        else:
+            ax.set_xlabel(r"$u$(k$\lambda$)")
+            ax.set_ylabel(r"$v$(k$\lambda$)")
+        ax.set_aspect("equal", adjustable="box")
+
+    def set_points(self, points, limit=None, title=None):
+        # limit: half-width of the (square) view in k-units, default to the
+        # extent of the points. Dense points (e.g. memory-mapped uv sets) are
+        # binned chunk by chunk.
+        if limit is None:
+            limit = np.max(np.abs(points[:, :2])) / 1000. if len(points) else 1.
+        if len(points) > self.density_threshold:
+            self.set_density(density_image(points, limit, DENSITY_BINS), limit, title=title)
+            return
+        self._set_limits((-limit, limit), (-limit, limit))
+        self.scatter.set_offsets(np.asarray(points[:, :2]) / 1000.)
+        self.density.set_visible(False)
+        self.scatter.set_visible(True)
+        if title is not None:
+            self.set_title(title)
+
+    def set_density(self, density, limit, title=None):
+        # Precomputed density image (see density_image) over [-limit, limit]^2
+        self._set_limits((-limit, limit), (-limit, limit))
+        self.density.set_data(density)
+        self.density.set_extent((-limit, limit, -limit, limit))
+        self.density.autoscale()
+        self.scatter.set_offsets(np.empty((0, 2)))
+        self.density.set_visible(True)
+        self.scatter.set_visible(False)
+        if title is not None:
+            self.set_title(title)
+
+
+class ArrayPanel(PointsPanel):
+    # Antenna positions (centred, in km) with their indices, as argosim.plot_utils.plot_antenna_arr
+    def __init__(self, ax, blitter):
+        super().__init__(ax, blitter, s=20, c='mediumblue', ENU=True)
+        ax.set_xlabel("E [km]")
+        ax.set_ylabel("N [km]")
+        self.labels = []
+
+    def set_array(self, array, title="Array"):
+        array = np.asarray(array) - np.mean(array, axis=0)
+        limit = np.max(np.abs(array[:, :2])) / 1000. * 1.1 if len(array) else 1.
+        self.set_points(array, limit=limit, title=title)
+        n_labels = len(array) if len(array) <= MAX_ANTENNA_LABELS else 0
+        while len(self.labels) > n_labels:
+            label = self.labels.pop()
+            self.blitter.remove_artist(label)
+            label.remove()
+        while len(self.labels) < n_labels:
+            label = self.ax.annotate("", (0, 0))
+            self.blitter.add_artist(label)
+            self.labels.append(label)
+        for i, label in enumerate(self.labels):
+            label.set_text(str(i + 1))
+            label.xy = (array[i, 0] / 1000., array[i, 1] / 1000.)
+            label.set_position(label.xy)
+
+
+def bin_indices(xy, limit, bins):
+    # Flat bin index of the 2D points (in m) that fall in [-limit, limit]^2 (in k-units)
+    idx = np.floor((np.asarray(xy) / 1000. + limit) * (bins / (2 * limit))).astype(np.int64)
+    idx = idx[np.all((idx >= 0) & (idx < bins), axis=1)]
+    return idx[:, 1] * bins + idx[:, 0]
+
+
+def _bin_counts(xy, limit, bins):
+    # Flat (bins * bins) histogram of 2D points (in m) over [-limit, limit]^2 (in k-units)
+    return np.bincount(bin_indices(xy, limit, bins), minlength=bins * bins)
+
+
+def log_density(counts, bins):
+    # Log-count image with empty bins masked
+    return np.ma.masked_equal(np.log10(counts.reshape(bins, bins) + 1.), 0.)
+
+
+def density_image(points, limit, bins, chunk=2**20):
+    # (bins, bins) density image of the points (in m) over [-limit, limit]^2
+    # (in k-units)
+    counts = np.zeros(bins * bins, dtype=np.int64)
+    for start in range(0, len(points), chunk):
+        counts += _bin_counts(points[start:start + chunk, :2], limit, bins)
+    return log_density(counts, bins)
+
+
+def baseline_density(antenna, limit, bins, chunk=2**20):
+    # density_image of the baselines of an antenna array (as
+    # argosim.antenna_utils.get_baselines), binned from the antenna pairs
+    # chunk by chunk without building the baseline array
+    antenna = np.asarray(antenna, dtype=float)[:, :2]
+    n = len(antenna)
+    rows = max(1, chunk // max(n, 1))
+    counts = np.zeros(bins * bins, dtype=np.int64)
+    for start in range(0, n, rows):
+        i = np.arange(start, min(start + rows, n))
+        diffs = antenna[i, None] - antenna[None]
+        # No (i, i) baselines
+        diffs = diffs[i[:, None] != np.arange(n)[None]]
+        counts += _bin_counts(diffs, limit, bins)
+    return log_density(counts, bins)
+
+
+class PanelFigure:
+    # Figure made of persistent panels side by side, or on a grid of ncols
+    # columns. The panels are created on first use, and again after an error
+    # message replaced them or the panel types changed. With share, the axes
+    # of all the panels are linked: zooming or panning one moves the others.
+    def __init__(self, canvas, panel_types, ncols=None, share=False):
+        self.canvas = canvas
+        self.fig = canvas.figure
+        self.panel_types = panel_types
+        self.ncols = ncols
+        self.share = share
+        self.blitter = Blitter(canvas)
+        self._panels = None
+
+    def set_panel_types(self, panel_types, ncols=None):
+        if list(panel_types) != list(self.panel_types) or ncols != self.ncols:
+            self.panel_types = list(panel_types)
+            self.ncols = ncols
+            self._panels = None
+
+    def panels(self):
+        if self._panels is None:
+            self.fig.clear()
+            self.blitter.reset()
+            n = len(self.panel_types)
+            ncols = self.ncols or n
+            nrows = -(-n // ncols)
+            self._panels = []
+            first = None
+            for i, panel_type in enumerate(self.panel_types):
+                if self.share and first is not None:
+                    ax = self.fig.add_subplot(nrows, ncols, i + 1, sharex=first, sharey=first)
+                else:
+                    ax = self.fig.add_subplot(nrows, ncols, i + 1)
+                first = first or ax
+                self._panels.append(panel_type(ax, self.blitter))
+        return self._panels
+
+    def draw(self):
+        self.blitter.draw()
+
+    def show_error(self, message):
+        self._panels = None
+        self.blitter.reset()
+        self.fig.clear()
+        ax = self.fig.add_subplot(1, 1, 1)
+        ax.text(0.5, 0.5, message, ha='center', va='center', fontsize=12, color='red')
+        ax.axis('off')
+        self.canvas.draw()
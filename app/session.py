@@ -0,0 +1,324 @@
+# session.py
+# State of a simulation session, independent of Qt: the current antenna
+# array, the typed parameters of the stages, their last results, and which
+# results are out of date. The stages form a chain (array -> aperture ->
+# imaging -> clean). Setting a parameter marks its stage dirty, and the stages
+# downstream with it unless the parameter only affects its own stage (e.g.
+# the weighting of the dirty beam); compute() then only runs the dirty stages
+# a result depends on. A random result (an image without a seed) drawn again
+# also makes the stages downstream dirty. The widgets push their parsed
+# inputs into the session and observe it (see worker.SessionEvents);
+# batch.py drives one headless.
+import threading
+
+import numpy as np
+
+import gridding
+
+# Stages in dependency order, each one depending on the previous
+STAGES = ['aperture', 'imaging', 'clean']
+
+
+def _at_least(minimum, message):
+    return lambda value: message if value < minimum else None
+
+
+def _positive(message):
+    return lambda value: message if value <= 0 else None
+
+
+def _within(low, high, message):
+    return lambda value: message if not low <= value <= high else None
+
+
+class Param:
+    # A typed parameter. kind converts the input (e.g. the text of a field);
+    # optional parameters may be None ("None"). check returns the error
+    # message of an invalid value. propagates: changing the parameter also
+    # makes the downstream stages dirty.
+    def __init__(self, name, kind, default, optional=False, choices=None, check=None, propagates=True):
+        self.name = name
+        self.kind = kind
+        self.default = default
+        self.optional = optional
+        self.choices = choices
+        self.check = check
+        self.propagates = propagates
+
+    def parse(self, value):
+        if self.optional and (value is None or value == "None"):
+            return None
+        if self.kind is bool and isinstance(value, str):
+            value = value.strip().lower() in ('1', 'true', 'yes', 'on')
+        try:
+            value = self.kind(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid {self.name}: {value!r}.")
+        if self.choices is not None and value not in self.choices:
+            raise ValueError(f"Invalid {self.name} '{value}'. Choose from {', '.join(self.choices)}.")
+        message = self.check(value) if self.check is not None else None
+        if message:
+            raise ValueError(message)
+        return value
+
+
+# Observation parameters, as pipeline.compute_aperture (GUI defaults)
+APERTURE_PARAMS = [
+    Param('latitude', float, 35., check=_within(-90., 90., "Latitude must be within [-90, 90] degrees.")),
+    Param('declination', float, 35., check=_within(-90., 90., "Declination must be within [-90, 90] degrees.")),
+    Param('start_time', float, -1.),
+    Param('duration', float, 2., check=_at_least(0., "Duration can't be negative.")),
+    Param('timestep', float, 15., check=_positive("Time step must be positive.")),
+    Param('central_freq', float, 2., check=_positive("Central frequency must be positive.")),
+    Param('bandwidth', float, 0.2, check=_at_least(0., "Bandwidth can't be negative.")),
+    Param('nchan', int, 5, check=_at_least(1, "Number of channels must be positive.")),
+    Param('fov', float, 0.1, check=lambda f: "FOV must be within (0, 180] degrees." if not 0 < f <= 180 else None),
+    Param('Npx', int, 256, check=_at_least(2, "Npx must be at least 2.")),
+    Param('grid_memory', float, 256., propagates=False, check=_positive("Grid memory must be positive.")),
+    Param('redundancy', bool, False),
+    Param('max_baselines', int, None, optional=True, check=_at_least(2, "Max baselines must be at least 2.")),
+    Param('weighting', str, 'uniform', choices=gridding.WEIGHTINGS, propagates=False),
+    Param('robust', float, 0., propagates=False),
+    Param('channel_beams', bool, False, propagates=False),
+    Param('precision', str, 'float64', choices=gridding.PRECISIONS),
+]
+# Imaging parameters (sizes in degrees), as pipeline.compute_imaging; with
+# n_realizations, an ensemble (pipeline.compute_ensemble). primary_beam
+# (dish_diameter in metres) and w_stacking (w_planes, None for automatic)
+# add the wide-field effects (see pipeline.realism_options).
+IMAGING_PARAMS = [
+    Param('n_sources', int, 3, check=lambda n: ("Number of sources must be positive." if n <= 0 else
+                                                "The maximum number of sources is set to 50." if n > 50 else None)),
+    Param('min_source_size', float, 5 / 3600),
+    Param('max_source_size', float, 10 / 3600),
+    Param('noise_level', float, 0.1, check=_at_least(0., "Noise level can't be negative.")),
+    Param('seed', int, None, optional=True),
+    Param('weighting', str, 'natural', choices=gridding.WEIGHTINGS),
+    Param('robust', float, 0.),
+    Param('n_realizations', int, None, optional=True,
+          check=_at_least(1, "The number of realizations must be positive.")),
+    Param('primary_beam', bool, False),
+    Param('dish_diameter', float, 12., check=lambda d: "Dish diameter must be positive." if d <= 0 else None),
+    Param('w_stacking', bool, False),
+    Param('w_planes', int, None, optional=True, check=_at_least(1, "The number of w planes must be positive.")),
+]
+# CLEAN parameters, as pipeline.compute_clean: loop gain, most components,
+# threshold on the residual peak and half-width (px) of the beam patch of the
+# minor cycles
+CLEAN_PARAMS = [
+    Param('gain', float, 0.1, check=lambda g: "CLEAN gain must be in (0, 1]." if not 0 < g <= 1 else None),
+    Param('max_iter', int, 1000, check=_at_least(1, "The number of CLEAN iterations must be positive.")),
+    Param('threshold', float, 0., check=_at_least(0., "CLEAN threshold can't be negative.")),
+    Param('patch', int, 25, check=_at_least(1, "The beam patch must be at least 1 px wide.")),
+]
+PARAMS = {'aperture': APERTURE_PARAMS, 'imaging': IMAGING_PARAMS, 'clean': CLEAN_PARAMS}
+
+
+def _check_aperture(params):
+    if params['bandwidth'] >= 2 * params['central_freq']:
+        raise ValueError("Bandwidth must be less than twice the central frequency.")
+
+
+def _check_imaging(params):
+    if params['min_source_size'] > params['max_source_size']:
+        raise ValueError("Minimum source size should be smaller than maximum source size.")
+    if params['min_source_size'] <= 0 or params['max_source_size'] <= 0:
+        raise ValueError("Source sizes must be positive.")
+    if params['n_realizations'] is not None and (params['primary_beam'] or params['w_stacking']):
+        raise ValueError("Ensembles don't simulate the primary beam and the w-term.")
+
+
+# Checks across the parameters of a stage
+CHECKS = {'aperture': _check_aperture, 'imaging': _check_imaging}
+
+
+class Session:
+    def __init__(self, cache=None):
+        self.cache = cache  # StageCache of the computations
+        self.array = None  # {'antenna', 'label', 'load_baselines'}
+        self._params = {stage: {p.name: p.default for p in PARAMS[stage]} for stage in STAGES}
+        self._results = {stage: None for stage in STAGES}
+        self._dirty = set(STAGES)
+        # Bumped each time a stage is made dirty: a result computed meanwhile is not kept
+        self._versions = {stage: 0 for stage in STAGES}
+        self._listeners = []
+        self._lock = threading.RLock()
+
+    def subscribe(self, listener):
+        # listener(event, stage) with event 'dirty' (the stage was up to date)
+        # or 'computed', called from the thread that made the change
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self._listeners.remove(listener)
+
+    def _notify(self, events):
+        for event, stage in events:
+            for listener in list(self._listeners):
+                listener(event, stage)
+
+    def _mark_dirty(self, stage, downstream=True):
+        # (event, stage) of the stages made dirty, call with the lock held
+        stages = STAGES[STAGES.index(stage):] if downstream else [stage]
+        events = []
+        for s in stages:
+            self._versions[s] += 1
+            if s not in self._dirty:
+                self._dirty.add(s)
+                events.append(('dirty', s))
+        return events
+
+    def params(self, stage):
+        with self._lock:
+            return dict(self._params[stage])
+
+    def parse(self, stage, values):
+        # Parameters of the stage with values (by name, e.g. the texts of the
+        # fields) in place of the current ones, raises ValueError if invalid
+        specs = {p.name: p for p in PARAMS[stage]}
+        unknown = set(values) - set(specs)
+        if unknown:
+            raise ValueError(f"Unknown {stage} parameters: {', '.join(sorted(unknown))}")
+        params = self.params(stage)
+        for name, value in values.items():
+            params[name] = specs[name].parse(value)
+        if stage in CHECKS:
+            CHECKS[stage](params)
+        return params
+
+    def update(self, stage, values):
+        # Sets parameters of the stage, returns the names of those that changed
+        params = self.parse(stage, values)
+        with self._lock:
+            changed = [p for p in PARAMS[stage] if params[p.name] != self._params[stage][p.name]]
+            self._params[stage] = params
+            events = []
+            if changed:
+                events = self._mark_dirty(stage, downstream=any(p.propagates for p in changed))
+        self._notify(events)
+        return [p.name for p in changed]
+
+    def set_array(self, antenna, label=None, load_baselines=None):
+        # antenna: (n, 3) ENU positions, or None. load_baselines: loader of
+        # cached baselines (see pipeline.compute_baselines).
+        with self._lock:
+            previous = self.array
+            if antenna is None:
+                self.array = None
+            else:
+                antenna = np.asarray(antenna)
+                self.array = {'antenna': antenna, 'label': label, 'load_baselines': load_baselines}
+            same = (previous is not None and self.array is not None
+                    and np.array_equal(previous['antenna'], antenna)
+                    and (previous['load_baselines'] is None) == (load_baselines is None))
+            events = [] if same else self._mark_dirty(STAGES[0])
+        self._notify(events)
+
+    def is_dirty(self, stage):
+        with self._lock:
+            return stage in self._dirty
+
+    def result(self, stage):
+        # Last result of the stage, out of date if is_dirty(stage)
+        with self._lock:
+            return self._results[stage]
+
+    def invalidate(self, stage=STAGES[0]):
+        # Recompute the stage and those downstream on the next compute()
+        with self._lock:
+            events = self._mark_dirty(stage)
+        self._notify(events)
+
+    def set_result(self, stage, result):
+        # A result obtained elsewhere (e.g. loaded from a result store) as
+        # the up-to-date result of the stage, with its parameters
+        with self._lock:
+            self._params[stage] = {p.name: result['params'].get(p.name, p.default) for p in PARAMS[stage]}
+            events = self._mark_dirty(stage)
+            self._results[stage] = result
+            self._dirty.discard(stage)
+        self._notify([e for e in events if e[1] != stage])
+
+    def _volatile(self, stage, params):
+        # Random results (no seed) are drawn again on each request
+        return stage == 'imaging' and params['seed'] is None
+
+    def needs_compute(self, stage):
+        # Whether compute(stage) would compute anything
+        with self._lock:
+            for name in STAGES[:STAGES.index(stage) + 1]:
+                if name in self._dirty or self._results[name] is None:
+                    return True
+            return self._volatile(stage, self._params[stage])
+
+    def compute(self, stage, force=False, store=True, trace=None, progress=None, **options):
+        # Result of the stage, after computing the dirty stages it depends
+        # on. The stage itself is computed if dirty, random or forced, with
+        # options (coverage, preview_Npx for the aperture, stop for CLEAN);
+        # store=False leaves its result out of the session, e.g. previews. A
+        # result whose parameters changed while computing is returned but not
+        # kept.
+        upstream = {}
+        for name in STAGES[:STAGES.index(stage) + 1]:
+            target = name == stage
+            with self._lock:
+                params = dict(self._params[name])
+                version = self._versions[name]
+                result = self._results[name]
+                array = self.array
+                up_to_date = name not in self._dirty and result is not None
+            if up_to_date and not (target and (force or self._volatile(name, params))):
+                upstream[name] = result
+                continue
+            compute = getattr(self, '_compute_' + name)
+            result = compute(params, array, upstream, trace=trace, progress=progress, **(options if target else {}))
+            if store or not target:
+                events = []
+                with self._lock:
+                    if self._versions[name] == version:
+                        self._results[name] = result
+                        self._dirty.discard(name)
+                        events.append(('computed', name))
+                        if self._volatile(name, params) and name != STAGES[-1]:
+                            events += self._mark_dirty(STAGES[STAGES.index(name) + 1])
+                self._notify(events)
+            upstream[name] = result
+        return upstream[stage]
+
+    def _compute_aperture(self, params, array, upstream, trace=None, progress=None, coverage=None,
+                          preview_Npx=None):
+        import pipeline
+        if array is None:
+            raise ValueError("No antenna array available.")
+        return pipeline.compute_aperture(array['antenna'], params, cache=self.cache, coverage=coverage,
+                                         preview_Npx=preview_Npx, trace=trace, progress=progress,
+                                         load_baselines=array['load_baselines'])
+
+    def _compute_imaging(self, params, array, upstream, trace=None, progress=None):
+        # On the uv samples, FOV and Npx of the aperture result
+        import pipeline
+        aperture = upstream['aperture']
+        observation = aperture['params']
+        args = (aperture['uv_points'], observation['fov'], observation['Npx'], params['n_sources'],
+                params['min_source_size'], params['max_source_size'], params['noise_level'])
+        kwargs = {'seed': params['seed'], 'uv_key': aperture['uv_key'], 'uv_weights': aperture['uv_weights'],
+                  'weighting': params['weighting'], 'robust': params['robust'], 'cache': self.cache,
+                  'trace': trace, 'progress': progress}
+        if params['n_realizations'] is not None:
+            return pipeline.compute_ensemble(*args, params['n_realizations'],
+                                             precision=observation.get('precision', 'float64'), **kwargs)
+        return pipeline.compute_imaging(*args, realism=pipeline.realism_options(params, observation), **kwargs)
+
+    def _compute_clean(self, params, array, upstream, trace=None, progress=None, stop=None):
+        # Of the observation, with the dirty beam of the aperture under the imaging weighting
+        import pipeline
+        imaging = upstream['imaging']
+        if 'mean' in imaging:
+            raise ValueError("CLEAN needs a single observation, not an ensemble.")
+        beam = pipeline.compute_imaging_beam(upstream['aperture'], imaging['params'].get('weighting', 'natural'),
+                                             imaging['params'].get('robust', 0.), cache=self.cache, trace=trace)
+        result = pipeline.compute_clean(imaging['observation'], beam, gain=params['gain'],
+                                        max_iter=params['max_iter'], threshold=params['threshold'],
+                                        patch=params['patch'], trace=trace, progress=progress, stop=stop)
+        result['fov_size'] = imaging['fov_size']
+        return result
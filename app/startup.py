@@ -0,0 +1,69 @@
+# startup.py
+# Cold start of the GUI (see argosim-gui.py). The window only needs Qt and
+# matplotlib: the modules of the simulations, slow to import (JAX through
+# argosim, scipy.fft), are imported in a background thread once the window is
+# shown, and the default array is drawn once the window is painted and the
+# import is done. Startup records the time of each milestone since the
+# launch, for the profiling overlay and --timings.
+import importlib
+import sys
+import threading
+import time
+
+# Modules imported in the background, as first needed by the simulations
+PRELOAD_MODULES = ['pipeline']
+
+
+class Startup:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.milestones = []  # (name, seconds since the start)
+        self.preload_modules = []
+        self.preload_time = None
+        self.preload_error = None
+        self._preloaded = threading.Event()
+
+    def preload(self, modules=PRELOAD_MODULES):
+        self.preload_modules = list(modules)
+        threading.Thread(target=self._import, args=(modules,), daemon=True).start()
+
+    def _import(self, modules):
+        start = time.perf_counter()
+        try:
+            for module in modules:
+                importlib.import_module(module)
+        except Exception as e:
+            # Raised again where the module is used
+            self.preload_error = e
+        finally:
+            self.preload_time = time.perf_counter() - start
+            self._preloaded.set()
+
+    def preloaded(self):
+        return self._preloaded.is_set()
+
+    def mark(self, name):
+        if name not in dict(self.milestones):
+            self.milestones.append((name, time.perf_counter() - self.start))
+
+    def trace(self):
+        # The milestones as a profiling trace, one stage per interval; the
+        # background import overlaps them
+        import profiling
+        trace = profiling.Trace("startup")
+        trace.start = time.time() - (time.perf_counter() - self.start)
+        previous = 0.
+        for name, t in self.milestones:
+            trace.stages.append({'stage': name, 'time': round(t - previous, 6)})
+            previous = t
+        if self.preload_time is not None:
+            trace.stages.append({'stage': 'preload', 'time': round(self.preload_time, 6), 'background': True})
+        if trace.stages:
+            trace.stages[-1]['peak_rss_mb'] = profiling.peak_rss_mb()
+        return trace
+
+    def report(self, file=sys.stderr):
+        lines = [f"{name}: {t:.3f} s" for name, t in self.milestones]
+        if self.preload_time is not None:
+            lines.append(f"preload ({', '.join(self.preload_modules)}, background): {self.preload_time:.3f} s")
+        print("Startup times since launch:\n  " + "\n  ".join(lines), file=file)
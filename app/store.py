@@ -0,0 +1,82 @@
+# store.py
+# On-disk result store. A result is a <name>.argosim directory holding a
+# params.json file and one .npy file per array (uv tracks, uv mask, dirty
+# beam, sky model, observation...). Arrays are streamed to disk chunk by chunk
+# and reloaded as read-only memory maps: reopening a result is immediate and
+# large uv sets are paged from disk as they are accessed.
+import json
+import os
+import shutil
+
+import numpy as np
+
+SUFFIX = '.argosim'
+_META = 'params.json'
+# Rows written per chunk
+_CHUNK = 2**20
+
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def store_path(path):
+    return path if path.endswith(SUFFIX) else path + SUFFIX
+
+
+def is_store(path):
+    return os.path.isfile(os.path.join(path, _META))
+
+
+def write_array(filename, array, chunk=_CHUNK):
+    # Streams an array (numpy, memory map or JAX) to a .npy file without a
+    # full in-memory copy
+    if np.ndim(array) == 0:
+        np.save(filename, np.asarray(array))
+        return
+    out = np.lib.format.open_memmap(filename, mode='w+', dtype=np.dtype(array.dtype), shape=tuple(array.shape))
+    for start in range(0, len(array), chunk):
+        out[start:start + chunk] = np.asarray(array[start:start + chunk])
+    out.flush()
+    del out
+
+
+def save_result(path, arrays, params=None, chunk=_CHUNK):
+    # Writes into a temporary directory first, so that an interrupted save
+    # never leaves a partial result behind. Returns the store path.
+    path = store_path(path)
+    if os.path.exists(path) and not is_store(path):
+        raise FileExistsError(f"{path} exists and is not a result store.")
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    names = []
+    for name, array in arrays.items():
+        if array is None:
+            continue
+        write_array(os.path.join(tmp, name + '.npy'), array, chunk)
+        names.append(name)
+    with open(os.path.join(tmp, _META), 'w') as f:
+        json.dump({'params': params or {}, 'arrays': names}, f, indent=2, default=_json_default)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp, path)
+    return path
+
+
+def load_result(path, mmap=True):
+    # Returns (params, arrays). With mmap=True the arrays are read-only
+    # memory maps of the files (zero-copy).
+    if not is_store(path):
+        raise FileNotFoundError(f"{path} is not a result store.")
+    with open(os.path.join(path, _META)) as f:
+        meta = json.load(f)
+    arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+              for name in meta['arrays']}
+    return meta['params'], arrays
+
@@ -1,5 +1,10 @@
 # utils.py
-from PyQt6.QtWidgets import QApplication
+import math
+
+from PyQt6.QtWidgets import (
+    QApplication, QWidget, QHBoxLayout, QProgressBar, QPushButton, QSlider, QDoubleSpinBox
+)
+from PyQt6.QtCore import Qt, pyqtSignal
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 
 
@@ -11,3 +16,118 @@ class ScrollableFigureCanvas(FigureCanvas):
             QApplication.sendEvent(parent, event)
         else:
             super().wheelEvent(event)
+
+
+class JobProgressBar(QWidget):
+    # Progress bar and cancel button following the jobs of a JobRunner
+    def __init__(self, runner, parent=None):
+        super().__init__(parent)
+        self.runner = runner
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setValue(0)
+        self.progress_bar.setTextVisible(True)
+        self.progress_bar.setFormat("Idle")
+        layout.addWidget(self.progress_bar, 4)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.runner.cancel)
+        layout.addWidget(self.cancel_button, 1)
+        self.setLayout(layout)
+
+        self.runner.started.connect(self._on_started)
+        self.runner.progress.connect(self._on_progress)
+        self.runner.finished.connect(lambda _: self._on_stopped("Done"))
+        self.runner.failed.connect(lambda _: self._on_stopped("Failed"))
+        self.runner.cancelled.connect(lambda: self._on_stopped("Cancelled"))
+        self.runner.running_changed.connect(self.cancel_button.setEnabled)
+
+    def _on_started(self):
+        self.progress_bar.setValue(0)
+        self.progress_bar.setFormat("Starting...")
+
+    def _on_progress(self, percent, message):
+        self.progress_bar.setValue(percent)
+        self.progress_bar.setFormat(f"{message} (%p%)")
+
+    def _on_stopped(self, message):
+        if message == "Done":
+            self.progress_bar.setValue(100)
+        self.progress_bar.setFormat(message)
+
+
+class SliderSpinBox(QWidget):
+    # Slider and spin box bound to the same value. Exposes text()/setText()
+    # like the QLineEdit parameter fields, and emits valueChanged while the
+    # slider is dragged. With log_scale the slider moves in log(value).
+    valueChanged = pyqtSignal(float)
+
+    def __init__(self, minimum, maximum, step, decimals=2, integer=False, log_scale=False, parent=None):
+        super().__init__(parent)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.step = step
+        self.integer = integer
+        self.log_scale = log_scale
+        self._slider_steps = 1000 if log_scale else int(round((maximum - minimum) / step))
+
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.slider = QSlider(Qt.Orientation.Horizontal)
+        self.slider.setRange(0, self._slider_steps)
+        layout.addWidget(self.slider, 2)
+        self.spin_box = QDoubleSpinBox()
+        self.spin_box.setDecimals(0 if integer else decimals)
+        self.spin_box.setRange(minimum, maximum)
+        self.spin_box.setSingleStep(step)
+        self.spin_box.setKeyboardTracking(False)
+        layout.addWidget(self.spin_box, 1)
+        self.setLayout(layout)
+
+        self.slider.valueChanged.connect(self._on_slider_changed)
+        self.spin_box.valueChanged.connect(self._on_spin_box_changed)
+
+    def _to_slider(self, value):
+        if self.log_scale:
+            t = math.log(value / self.minimum) / math.log(self.maximum / self.minimum)
+        else:
+            t = (value - self.minimum) / (self.maximum - self.minimum)
+        return int(round(t * self._slider_steps))
+
+    def _from_slider(self, position):
+        t = position / self._slider_steps
+        if self.log_scale:
+            value = self.minimum * (self.maximum / self.minimum) ** t
+        else:
+            value = self.minimum + t * (self.maximum - self.minimum)
+        # Snap to the spin box step
+        return self.minimum + round((value - self.minimum) / self.step) * self.step
+
+    def _on_slider_changed(self, position):
+        value = self._from_slider(position)
+        if not math.isclose(value, self.spin_box.value()):
+            self.spin_box.blockSignals(True)
+            self.spin_box.setValue(value)
+            self.spin_box.blockSignals(False)
+            self.valueChanged.emit(self.value())
+
+    def _on_spin_box_changed(self, value):
+        self.slider.blockSignals(True)
+        self.slider.setValue(self._to_slider(value))
+        self.slider.blockSignals(False)
+        self.valueChanged.emit(self.value())
+
+    def value(self):
+        value = self.spin_box.value()
+        return int(round(value)) if self.integer else value
+
+    def setValue(self, value):
+        self.spin_box.setValue(float(value))
+
+    def text(self):
+        return str(self.value())
+
+    def setText(self, text):
+        self.setValue(float(text))
@@ -0,0 +1,223 @@
+# uv_coverage.py
+# Incremental uv-coverage engine. The uvw coordinates of a baseline are linear
+# in frequency, so the engine keeps the tracks in metres per (time, baseline)
+# and scales them per channel. When only the time or frequency parameters
+# change, only the new hour-angle samples are computed, and the uv grid is
+# updated by adding/removing the samples that changed. For Hermitian baseline
+# sets only the i < j baselines are tracked and gridded. Baselines can carry a
+# weight (multiplicity of grouped redundant baselines, inverse sampling
+# fraction of subsampled ones), which the grid counts. The uv samples are
+# float64 or float32 (dtype); the tracks in metres and the running grid stay
+# float64, so that removed samples leave the cells they were added to. The
+# cells emptied again are zeroed, as fractional weights may not cancel exactly.
+import threading
+
+import numpy as np
+
+import gridding
+
+C_LIGHT = 299792458.0
+
+
+def hour_angles(params):
+    # Hour-angle samples (hr) on the lattice start_time + k * timestep, so that
+    # tracks sharing a start time and timestep share their samples.
+    dt = params['timestep'] / 60
+    n_times = int(params['duration'] * 60 / params['timestep']) + 1
+    return params['start_time'] + dt * np.arange(n_times)
+
+
+def frequencies(params):
+    # Channel frequencies (Hz), as in argosim.antenna_utils.uv_track_multiband
+    f = params['central_freq'] * 1e9
+    df = params['bandwidth'] * 1e9
+    return np.linspace(f - df / 2, f + df / 2, params['nchan'])
+
+
+def uvw_metres(X, Y, Z, dec, ha):
+    # argosim.antenna_utils.XYZ_to_uvw at unit wavelength, vectorized over the
+    # hour angles: returns (n_times, n_baselines, 3)
+    ha = ha[:, None]
+    u = np.sin(ha) * X + np.cos(ha) * Y
+    v = -np.sin(dec) * np.cos(ha) * X + np.sin(dec) * np.sin(ha) * Y + np.cos(dec) * Z
+    w = np.cos(dec) * np.cos(ha) * X - np.cos(dec) * np.sin(ha) * Y + np.sin(dec) * Z
+    return np.stack([u, v, w], axis=-1)
+
+
+def _keys(values, resolution):
+    # Integer keys to match samples between updates
+    return np.rint(np.asarray(values) / resolution).astype(np.int64)
+
+
+class UVCoverage:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._geometry = None
+        self._xyz = None
+        self._dec = None
+        self.hour_angles = np.empty(0)
+        self.freqs = np.empty(0)
+        self._pairs = None   # gridding.hermitian_pairs of the baselines
+        self._weights = None  # (n_tracked,) weights, None for unit weights
+        self.track_m = None  # (n_times, n_tracked, 3) in metres
+        self.uv = None       # (n_freqs, n_times, n_tracked, 3) in wavelengths
+        self._grid = None    # (Npx, fov_size, counts)
+        self._preview = None  # UVCoverage of the previews
+        self.last_update = {}
+
+    def reset(self):
+        with self._lock:
+            self._geometry = None
+            self._grid = None
+            self._preview = None
+
+    def preview_engine(self):
+        # Engine of the low-resolution previews (grid=False), which would
+        # otherwise invalidate the grid of this one
+        with self._lock:
+            if self._preview is None:
+                self._preview = UVCoverage()
+            return self._preview
+
+    def update(self, baselines, params, geometry_key=None, memory_budget=None, grid=True, weights=None,
+               dtype=np.float64):
+        # Returns the flattened uv samples (ordered as uv_track_multiband:
+        # channel, time, baseline) and the histogram of their (Npx, Npx) cells,
+        # or None if the samples lie out of the uv grid. Both are computed under
+        # one lock so that concurrent (stale) jobs cannot interleave. With
+        # grid=False only the tracks are updated and the grid is invalidated.
+        # The weights are part of the geometry (geometry_key), and so is the
+        # dtype: samples of another precision may fall in other cells.
+        with self._lock:
+            geometry = (geometry_key, params['latitude'], params['declination'], np.dtype(dtype).str)
+            if geometry_key is None or geometry != self._geometry:
+                self._set_geometry(baselines, params, weights)
+                self._geometry = geometry
+            old_uv = self.uv
+            kept_t, added_t, removed_t = self._update_times(hour_angles(params))
+            kept_f, added_f, removed_f = self._update_freqs(frequencies(params))
+            self.uv = np.multiply(self.freqs[:, None, None, None] / C_LIGHT, self.track_m[None], dtype=dtype)
+            self.last_update = {
+                'computed_times': int(len(added_t[1])),
+                'reused_times': int(len(kept_t[1])),
+                'computed_freqs': int(len(added_f[1])),
+                'reused_freqs': int(len(kept_f[1])),
+            }
+            if not grid:
+                self._grid = None
+                return self.uv_points(), None
+            try:
+                counts = self._update_grid(old_uv, kept_t, added_t, removed_t, kept_f, added_f, removed_f,
+                                           params['Npx'], params['fov'], memory_budget)
+            except ValueError:
+                counts = None
+            return self.uv_points(), counts
+
+    def uv_points(self):
+        # All baselines, ordered as the input baselines
+        if self._pairs is None:
+            return self.uv.reshape(-1, 3).copy()
+        _, half_index, sign = self._pairs
+        return (self.uv[:, :, half_index] * sign[:, None].astype(self.uv.dtype)).reshape(-1, 3)
+
+    def _set_geometry(self, baselines, params, weights=None):
+        # uv(-b) = -uv(b): track only one baseline of each pair when possible
+        self._pairs = gridding.hermitian_pairs(baselines)
+        if self._pairs is not None:
+            baselines = np.asarray(baselines)[self._pairs[0]]
+            if weights is not None:
+                weights = np.asarray(weights)[self._pairs[0]]
+        self._weights = None if weights is None else np.asarray(weights, dtype=float)
+        # Imported on first use, as JAX is slow to import (see argosim-gui.py)
+        import argosim.antenna_utils
+        import jax.numpy as jnp
+        X, Y, Z = argosim.antenna_utils.ENU_to_XYZ(jnp.asarray(baselines), params['latitude'] / 180 * np.pi)
+        self._xyz = tuple(np.asarray(c, dtype=np.float64) for c in (X, Y, Z))
+        self._dec = params['declination'] / 180 * np.pi
+        n_baselines = self._xyz[0].shape[0]
+        self.hour_angles = np.empty(0)
+        self.freqs = np.empty(0)
+        self.track_m = np.empty((0, n_baselines, 3))
+        self.uv = np.empty((0, 0, n_baselines, 3))
+        self._grid = None
+
+    def _sample_weights(self, samples):
+        # Weights of (..., n_tracked, 3) samples, flattened as the samples
+        if self._weights is None:
+            return None
+        return np.broadcast_to(self._weights, samples.shape[:-1]).ravel()
+
+    @staticmethod
+    def _match(old_keys, new_keys):
+        # Index pairs of the kept entries, indices of added (new) and removed (old) entries
+        kept_new = np.flatnonzero(np.isin(new_keys, old_keys))
+        kept_old = np.searchsorted(old_keys, new_keys[kept_new]) if len(old_keys) else np.empty(0, np.int64)
+        added = np.flatnonzero(~np.isin(new_keys, old_keys))
+        removed = np.flatnonzero(~np.isin(old_keys, new_keys))
+        return (kept_old, kept_new), (None, added), (removed, None)
+
+    def _update_times(self, new_hours):
+        # Hour angles are matched to the millisecond
+        old_keys = _keys(self.hour_angles, 1 / 3.6e6)
+        new_keys = _keys(new_hours, 1 / 3.6e6)
+        kept, added, removed = self._match(old_keys, new_keys)
+        track_m = np.empty((len(new_hours),) + self.track_m.shape[1:])
+        track_m[kept[1]] = self.track_m[kept[0]]
+        if len(added[1]):
+            X, Y, Z = self._xyz
+            track_m[added[1]] = uvw_metres(X, Y, Z, self._dec, new_hours[added[1]] * np.pi / 12)
+        self.hour_angles = new_hours
+        self.track_m = track_m
+        return kept, added, removed
+
+    def _update_freqs(self, new_freqs):
+        # Frequencies are matched to the Hz
+        old_keys = _keys(self.freqs, 1.)
+        new_keys = _keys(new_freqs, 1.)
+        kept, added, removed = self._match(old_keys, new_keys)
+        self.freqs = new_freqs
+        return kept, added, removed
+
+    def _update_grid(self, old_uv, kept_t, added_t, removed_t, kept_f, added_f, removed_f, Npx, fov_size,
+                     memory_budget=None):
+        hermitian = self._pairs is not None
+        n_new = self.uv.shape[0] * self.uv.shape[1]
+        n_changed = (self.uv.shape[0] * len(added_t[1]) + len(added_f[1]) * len(kept_t[1])
+                     + old_uv.shape[0] * len(removed_t[0]) + len(removed_f[0]) * len(kept_t[0]))
+        incremental = (self._grid is not None and self._grid[:2] == (Npx, fov_size)
+                       and n_changed < n_new)
+        self.last_update['regridded_samples'] = (n_changed if incremental else n_new) * self.uv.shape[2]
+        try:
+            if not incremental:
+                self._grid = None
+                counts = gridding.grid_uv_counts(self.uv.reshape(-1, 3), Npx, fov_size,
+                                                 weights=self._sample_weights(self.uv), hermitian=hermitian,
+                                                 memory_budget=memory_budget).ravel()
+            else:
+                counts = self._grid[2]
+                # (new channels x added times) + (added channels x kept times)
+                added = [self.uv[:, added_t[1]], self.uv[added_f[1]][:, kept_t[1]]]
+                # (old channels x removed times) + (removed channels x kept times)
+                removed = [old_uv[:, removed_t[0]], old_uv[removed_f[0]][:, kept_t[0]]]
+                changed = [(s, 1.) for s in added if s.size]
+                changed += [(s, -1.) for s in removed if s.size]
+                for samples, _ in changed:
+                    gridding.check_uv_range(*gridding.uv_extent(samples.reshape(-1, 3)), Npx, fov_size,
+                                            hermitian=hermitian)
+                # Only the cells hit by the changed samples are touched
+                for samples, sign in changed:
+                    cells = gridding.cell_indices(samples.reshape(-1, 3), Npx, fov_size)
+                    weights = self._sample_weights(samples)
+                    weights = np.full(len(cells), sign) if weights is None else sign * weights
+                    if hermitian:
+                        cells = np.concatenate([cells, gridding.mirror_cells(cells, Npx)])
+                        weights = np.concatenate([weights, weights])
+                    np.add.at(counts, cells, weights)
+                    # Unit weights cancel exactly, fractional ones may not
+                    if sign < 0 and self._weights is not None:
+                        gridding.clear_residues(counts, cells, self._weights.min())
+        except (ValueError, MemoryError):
+            self._grid = None
+            raise
+        self._grid = (Npx, fov_size, counts)
+        return counts.reshape(Npx, Npx).astype(self.uv.dtype)
@@ -0,0 +1,81 @@
+# wide_field.py
+# Wide-field effects of the imaging (see pipeline.compute_imaging with
+# realism): the primary beam of the antennas and the w-term. The primary beam
+# is the Airy power pattern of a uniformly illuminated dish, per channel
+# frequency. The w-term is corrected by w-stacking: the samples are binned in
+# w planes, and the sky of each plane goes through the phase screen
+# exp(-2i pi w (n - 1)) of the plane centre before its FFT (prediction); the
+# image of each plane through the conjugate screen after it (imaging). The
+# screens use the same sign as fft.sky2uv, V = sum I exp(-2i pi (ul + vm)).
+# Images are on an (l, m) grid of fov / Npx pixels (sine projection), l along
+# the columns, centred on pixel Npx // 2 as the uv grids.
+import numpy as np
+import scipy.special
+
+from uv_coverage import C_LIGHT
+
+# Max residual phase (cycles) of the w-term over the FOV within a w plane
+W_TOLERANCE = 0.05
+# Most w planes of the automatic planning
+MAX_W_PLANES = 64
+
+
+def lm_grid(Npx, fov_size):
+    # (l, m) direction cosines of the pixels, each (Npx, Npx)
+    offsets = (np.arange(Npx) - Npx // 2) * np.deg2rad(fov_size) / Npx
+    return np.meshgrid(offsets, offsets)
+
+
+def primary_beam(Npx, fov_size, freq, dish_diameter):
+    # Airy power pattern (2 J1(x) / x)^2, x = pi D f sin(r) / c, at freq (Hz)
+    l, m = lm_grid(Npx, fov_size)
+    x = np.pi * dish_diameter * freq / C_LIGHT * np.sqrt(l**2 + m**2)
+    beam = np.ones_like(x)
+    nonzero = x > 0
+    beam[nonzero] = (2 * scipy.special.j1(x[nonzero]) / x[nonzero])**2
+    return beam
+
+
+def n_minus_one(Npx, fov_size):
+    # n - 1 = sqrt(1 - l^2 - m^2) - 1 of the pixels, without cancellation
+    l, m = lm_grid(Npx, fov_size)
+    r2 = np.minimum(l**2 + m**2, 1.)
+    return -r2 / (1 + np.sqrt(1 - r2))
+
+
+def plan_w_planes(w, max_n_minus_one, n_planes=None):
+    # Plane centres and the plane of each sample, for samples of w
+    # (wavelengths). Without n_planes, just enough evenly spaced planes for
+    # W_TOLERANCE, at most MAX_W_PLANES.
+    w = np.asarray(w)
+    w_min, w_max = (float(w.min()), float(w.max())) if len(w) else (0., 0.)
+    if n_planes is None:
+        n_planes = int(np.ceil((w_max - w_min) * abs(max_n_minus_one) / (2 * W_TOLERANCE)))
+        n_planes = min(max(n_planes, 1), MAX_W_PLANES)
+    width = (w_max - w_min) / n_planes
+    centres = w_min + (np.arange(n_planes) + 0.5) * width
+    if width == 0:
+        return centres, np.zeros(len(w), dtype=np.int64)
+    return centres, np.clip(((w - w_min) / width).astype(np.int64), 0, n_planes - 1)
+
+
+def w_screen(n_minus_one, w):
+    # Phase screen of the prediction at w, exp(-2i pi w (n - 1))
+    return np.exp(-2j * np.pi * w * n_minus_one)
+
+
+def sample_channels(n_samples, nchan):
+    # Channel of each sample, ordered (channel, time, baseline)
+    if n_samples % nchan:
+        raise ValueError(f"{n_samples} uv samples can't be split into {nchan} channels.")
+    return np.repeat(np.arange(nchan), n_samples // nchan)
+
+
+def sample_groups(*labels):
+    # (labels, indices) of the samples sharing each combination of labels
+    # (arrays of one label per sample), in order
+    keys = np.stack(labels, axis=1)
+    combos, inverse = np.unique(keys, axis=0, return_inverse=True)
+    order = np.argsort(inverse.ravel(), kind='stable')
+    bounds = np.cumsum(np.bincount(inverse.ravel(), minlength=len(combos)))[:-1]
+    return [(tuple(int(v) for v in combo), indices) for combo, indices in zip(combos, np.split(order, bounds))]
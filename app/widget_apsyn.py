@@ -1,24 +1,40 @@
 # widget_apsyn.py
 import sys
+import time
 from PyQt6.QtWidgets import (
-    QWidget, QLabel, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton
+    QWidget, QLabel, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QCheckBox, QComboBox, QSlider
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer, pyqtSignal
 
 from matplotlib.figure import Figure
 
-import argosim
-import argosim.antenna_utils
-import argosim.imaging_utils
-import argosim.plot_utils
 import numpy as np
 
-from utils import ScrollableFigureCanvas
+import gridding
+import profiling
+from rendering import PanelFigure, PointsPanel, ImagePanel
+from uv_coverage import UVCoverage
+from utils import ScrollableFigureCanvas, JobProgressBar, SliderSpinBox
+from worker import JobRunner, SessionEvents
+
+# Live scrubbing: coarse beam resolution, delay (ms) before the coarse preview
+# and before the full-resolution refinement once the parameters stop changing
+PREVIEW_NPX = 64
+PREVIEW_DELAY = 30
+REFINE_DELAY = 400
+# Earth-rotation playback rate (frames per second), one time slice per frame
+ANIMATION_FPS = 30
 
 class ApertureSynthesisWidget(QWidget):
-    def __init__(self, array_widget=None):
+    # Emitted after each full-resolution simulation (not after previews)
+    simulation_finished = pyqtSignal()
+
+    def __init__(self, session, profiler=None):
         super().__init__()
-        self.array_widget = array_widget  # Reference to InterferometricArrayWidget
+        self.session = session  # Shared session.Session: current array, parameters and results
+        self.profiler = profiler  # Shared profiling.Profiler
+        self._trace = None
+        self.coverage = UVCoverage()  # Incremental uv tracks of the last simulation
         layout = QVBoxLayout()
         title = QLabel("Aperture Synthesis")
         title.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -30,22 +46,22 @@ class ApertureSynthesisWidget(QWidget):
 
         # Group 1: (Array latitude, Source declination)
         group1 = QHBoxLayout()
-        self.param_widgets['latitude'] = QLineEdit()
+        self.param_widgets['latitude'] = SliderSpinBox(-90, 90, 0.5, decimals=1)
         self.param_widgets['latitude'].setText("35")
         self.param_labels['latitude'] = QLabel("Array Latitude (°):")
         group1.addWidget(self.param_labels['latitude'])
         group1.addWidget(self.param_widgets['latitude'])
-        self.param_widgets['declination'] = QLineEdit()
+        self.param_widgets['declination'] = SliderSpinBox(-90, 90, 0.5, decimals=1)
         self.param_widgets['declination'].setText("35")
         self.param_labels['declination'] = QLabel("Source Declination (°):")
         group1.addWidget(self.param_labels['declination'])
         group1.addWidget(self.param_widgets['declination'])
-        self.param_widgets['fov'] = QLineEdit()
+        self.param_widgets['fov'] = SliderSpinBox(0.001, 5, 0.001, decimals=3, log_scale=True)
         self.param_widgets['fov'].setText("0.1")
         self.param_labels['fov'] = QLabel("FOV size (°):")
         group1.addWidget(self.param_labels['fov'])
         group1.addWidget(self.param_widgets['fov'])
-        self.param_widgets['Npx'] = QLineEdit()
+        self.param_widgets['Npx'] = SliderSpinBox(16, 4096, 16, integer=True)
         self.param_widgets['Npx'].setText("256")
         self.param_labels['Npx'] = QLabel("Npx:")
         group1.addWidget(self.param_labels['Npx'])
@@ -59,7 +75,7 @@ class ApertureSynthesisWidget(QWidget):
         self.param_labels['start_time'] = QLabel("Start Time (hr, rel. to transit):")
         group2.addWidget(self.param_labels['start_time'])
         group2.addWidget(self.param_widgets['start_time'])
-        self.param_widgets['duration'] = QLineEdit()
+        self.param_widgets['duration'] = SliderSpinBox(0.25, 24, 0.25)
         self.param_widgets['duration'].setText("2")
         self.param_labels['duration'] = QLabel("Duration (hr):")
         group2.addWidget(self.param_labels['duration'])
@@ -88,8 +104,62 @@ class ApertureSynthesisWidget(QWidget):
         self.param_labels['nchan'] = QLabel("Number of Channels:")
         group3.addWidget(self.param_labels['nchan'])
         group3.addWidget(self.param_widgets['nchan'])
+        self.param_widgets['grid_memory'] = QLineEdit()
+        self.param_widgets['grid_memory'].setText("256")
+        self.param_labels['grid_memory'] = QLabel("Gridding Memory (MB):")
+        group3.addWidget(self.param_labels['grid_memory'])
+        group3.addWidget(self.param_widgets['grid_memory'])
+        # Identical baselines are tracked once, weighted by their multiplicity
+        self.redundancy_checkbox = QCheckBox("Merge redundant baselines")
+        self.redundancy_checkbox.toggled.connect(self._on_param_scrubbed)
+        group3.addWidget(self.redundancy_checkbox)
         layout.addLayout(group3)
 
+        # Group 4: beam weighting, per-channel beams, quick look at large arrays
+        # on a stratified subset of the baselines
+        group4 = QHBoxLayout()
+        self.weighting_combo = QComboBox()
+        self.weighting_combo.addItems([w.capitalize() for w in gridding.WEIGHTINGS])
+        self.weighting_combo.currentTextChanged.connect(self._on_param_scrubbed)
+        group4.addWidget(QLabel("Beam Weighting:"))
+        group4.addWidget(self.weighting_combo)
+        self.param_widgets['robust'] = QLineEdit()
+        self.param_widgets['robust'].setText("0")
+        self.param_labels['robust'] = QLabel("Robust:")
+        group4.addWidget(self.param_labels['robust'])
+        group4.addWidget(self.param_widgets['robust'])
+        self.channel_beams_checkbox = QCheckBox("Per-channel beams")
+        self.channel_beams_checkbox.toggled.connect(self._push_params)
+        group4.addWidget(self.channel_beams_checkbox)
+        self.beam_combo = QComboBox()
+        self.beam_combo.addItem("MFS")
+        self.beam_combo.currentIndexChanged.connect(self._on_beam_selected)
+        group4.addWidget(self.beam_combo)
+        self.param_widgets['max_baselines'] = QLineEdit()
+        self.param_widgets['max_baselines'].setText("None")
+        self.param_labels['max_baselines'] = QLabel("Max Baselines (quick look):")
+        group4.addWidget(self.param_labels['max_baselines'])
+        group4.addWidget(self.param_widgets['max_baselines'])
+        layout.addLayout(group4)
+
+        # Group 5: precision of the uv samples, grids and beams (float32 halves
+        # their memory), its memory saving and its difference to float64
+        group5 = QHBoxLayout()
+        self.precision_combo = QComboBox()
+        self.precision_combo.addItems([p.capitalize() for p in gridding.PRECISIONS])
+        self.precision_combo.currentTextChanged.connect(self._on_param_scrubbed)
+        group5.addWidget(QLabel("Precision:"))
+        group5.addWidget(self.precision_combo)
+        self.precision_label = QLabel()
+        self.precision_label.setWordWrap(True)
+        group5.addWidget(self.precision_label, 4)
+        self.precision_button = QPushButton("Compare with Float64")
+        self.precision_button.setToolTip("Simulate the current aperture in float32 and float64 and report "
+                                         "their largest differences.")
+        self.precision_button.clicked.connect(self._check_precision)
+        group5.addWidget(self.precision_button, 1)
+        layout.addLayout(group5)
+
         # Buttons row
         button_row = QHBoxLayout()
         self.sim_button = QPushButton("Simulate")
@@ -99,16 +169,78 @@ class ApertureSynthesisWidget(QWidget):
         self.reset_button.clicked.connect(self._reset_defaults)
         self.reset_button.clicked.connect(self._simulate)
         button_row.addWidget(self.reset_button, 1)
+        self.live_checkbox = QCheckBox("Live update")
+        self.live_checkbox.setChecked(True)
+        button_row.addWidget(self.live_checkbox)
         layout.addLayout(button_row)
+        self.stale_label = QLabel()
+        self.stale_label.setStyleSheet("color: gray; font-style: italic;")
+        layout.addWidget(self.stale_label)
+
+        # Earth-rotation playback of the last track, time slice by time slice
+        animation_row = QHBoxLayout()
+        self.play_button = QPushButton("Play Track")
+        self.play_button.setCheckable(True)
+        self.play_button.toggled.connect(self._on_play_toggled)
+        animation_row.addWidget(self.play_button, 1)
+        self.frame_slider = QSlider(Qt.Orientation.Horizontal)
+        self.frame_slider.setEnabled(False)
+        self.frame_slider.valueChanged.connect(self._on_frame_scrubbed)
+        animation_row.addWidget(self.frame_slider, 4)
+        self.frame_label = QLabel()
+        animation_row.addWidget(self.frame_label, 1)
+        layout.addLayout(animation_row)
+        self.animation = None
+        self._beam_floor = None  # Colour scale floor of the playback, set with the animation
+        self.animation_timer = QTimer(self)
+        self.animation_timer.setInterval(1000 // ANIMATION_FPS)
+        self.animation_timer.timeout.connect(self._next_frame)
+        self._frame_times = []
+
+        # Live scrubbing: a coarse preview shortly after each change, then the
+        # full resolution once the parameters settle
+        self.preview_timer = QTimer(self)
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(PREVIEW_DELAY)
+        self.preview_timer.timeout.connect(self._preview)
+        self.refine_timer = QTimer(self)
+        self.refine_timer.setSingleShot(True)
+        self.refine_timer.setInterval(REFINE_DELAY)
+        self.refine_timer.timeout.connect(self._simulate)
+        for key in ['latitude', 'declination', 'fov', 'Npx', 'duration']:
+            self.param_widgets[key].valueChanged.connect(self._on_param_scrubbed)
+        # The other fields are pushed to the session once edited
+        for key in ['start_time', 'timestep', 'central_freq', 'bandwidth', 'nchan', 'grid_memory', 'robust',
+                    'max_baselines']:
+            self.param_widgets[key].editingFinished.connect(self._push_params)
+        # Out-of-date results, and apertures computed by the imaging jobs
+        self.session_events = SessionEvents(session, parent=self)
+        self.session_events.dirty.connect(self._on_stage_dirty)
+        self.session_events.computed.connect(self._on_stage_computed)
+
+        # Background simulation jobs
+        self.runner = JobRunner(parent=self)
+        self.runner.finished.connect(self._on_simulation_finished)
+        self.runner.failed.connect(self._on_simulation_failed)
+        self.job_progress = JobProgressBar(self.runner)
+        layout.addWidget(self.job_progress)
+        # Precision checks, next to the simulations
+        self.precision_runner = JobRunner(parent=self)
+        self.precision_runner.finished.connect(self._on_precision_checked)
+        self.precision_runner.failed.connect(lambda e: self.precision_label.setText(f"Error: {str(e)}"))
 
         # Matplotlib FigureCanvas for uv and dirty beam
         self.fig = Figure(figsize=(6, 3))
         self.canvas = ScrollableFigureCanvas(self.fig)
         self.canvas.setMinimumHeight(400)
         layout.addWidget(self.canvas, stretch=1)
+        self.plots = PanelFigure(self.canvas, [PointsPanel, ImagePanel])
 
         self.setLayout(layout)
         self.current_uv_points = None
+        self.current_uv_weights = None
+        self.current_uv_key = None
+        self.current_result = None
 
     def _reset_defaults(self):
         self.param_widgets['latitude'].setText("35")
@@ -121,80 +253,347 @@ class ApertureSynthesisWidget(QWidget):
         self.param_widgets['nchan'].setText("5")
         self.param_widgets['fov'].setText("0.1")
         self.param_widgets['Npx'].setText("256")
+        self.param_widgets['max_baselines'].setText("None")
+        self.param_widgets['robust'].setText("0")
+        self.weighting_combo.setCurrentText("Uniform")
+        self.channel_beams_checkbox.setChecked(False)
+        self.precision_combo.setCurrentText("Float64")
+
+    def _show_error(self, message):
+        self.plots.show_error(message)
+
+    def _on_param_scrubbed(self):
+        if self._push_params() is None or not self.live_checkbox.isChecked():
+            return
+        self.preview_timer.start()
+        self.refine_timer.start()
+
+    def _preview(self):
+        self._submit(preview_Npx=PREVIEW_NPX)
 
     def _simulate(self):
-        # Gather parameters
+        self.refine_timer.stop()
+        self._submit()
+
+    def _inputs(self):
+        # Parameter fields, as texts and states
+        inputs = {key: widget.text() for key, widget in self.param_widgets.items()}
+        inputs.update({
+            'redundancy': self.redundancy_checkbox.isChecked(),
+            'weighting': self.weighting_combo.currentText().lower(),
+            'channel_beams': self.channel_beams_checkbox.isChecked(),
+            'precision': self.precision_combo.currentText().lower(),
+        })
+        return inputs
+
+    def _push_params(self):
+        # Sets the parameters of the session to the inputs, returns them (None if invalid)
         try:
-            latitude = float(self.param_widgets['latitude'].text())
-            declination = float(self.param_widgets['declination'].text())
-            start_time = float(self.param_widgets['start_time'].text())
-            duration = float(self.param_widgets['duration'].text())
-            timestep = float(self.param_widgets['timestep'].text())
-            central_freq = float(self.param_widgets['central_freq'].text())
-            bandwidth = float(self.param_widgets['bandwidth'].text())
-            nchan = int(self.param_widgets['nchan'].text())
-            fov_size = float(self.param_widgets['fov'].text())
-            Npx = int(self.param_widgets['Npx'].text())
-        except Exception as e:
-            self.fig.clear()
-            ax = self.fig.add_subplot(1, 1, 1)
-            ax.text(0.5, 0.5, f"Error:\n{str(e)}", ha='center', va='center', fontsize=12, color='red')
-            ax.axis('off')
-            self.canvas.draw()
+            self.session.update('aperture', self._inputs())
+        except ValueError as e:
+            self.runner.cancel()
+            self._show_error(f"Error:\n{str(e)}")
             self.current_uv_points = None
+            self.current_uv_weights = None
+            self.current_uv_key = None
+            return None
+        return self.session.params('aperture')
+
+    def _submit(self, preview_Npx=None):
+        if self._push_params() is None:
+            return
+        if self.session.array is None:
+            self.runner.cancel()
+            self._show_error("No antenna array available.")
+            return
+
+        # Compute the uv points and dirty beam in the background
+        self._trace = None
+        if self.profiler is not None:
+            self._trace = self.profiler.new_trace("aperture" if preview_Npx is None else "aperture (preview)")
+        self.runner.submit(profiling.traced(self._trace, self.session.compute), 'aperture', force=True,
+                           coverage=self.coverage, preview_Npx=preview_Npx, store=preview_Npx is None)
+
+    def _update_stale_label(self):
+        result = self.current_result
+        stale = result is not None and not result['preview'] and self.session.is_dirty('aperture')
+        self.stale_label.setText("The array or the parameters changed since this simulation." if stale else "")
+
+    def _on_stage_dirty(self, stage):
+        if stage != 'aperture' or self.current_result is None:
             return
+        self._update_stale_label()
+        # E.g. a new array: simulated again once the edits settle
+        if self.live_checkbox.isChecked():
+            self.refine_timer.start()
 
-        # Get current antenna array from InterferometricArrayWidget
-        antenna = None
-        if self.array_widget is not None:
-            antenna = self.array_widget.get_current_antenna()
-        if antenna is None:
-            self.fig.clear()
-            ax = self.fig.add_subplot(1, 1, 1)
-            ax.text(0.5, 0.5, "No antenna array available.", ha='center', va='center', fontsize=12, color='red')
-            ax.axis('off')
-            self.canvas.draw()
+    def _on_stage_computed(self, stage):
+        if stage != 'aperture':
             return
+        # Computed by an imaging job, from the parameters of the session
+        result = self.session.result('aperture')
+        if result is not self.current_result and not self.runner.is_running():
+            self._show_result(result)
+        self._update_stale_label()
 
-        # Compute the uv points and dirty beam
-        baselines = argosim.antenna_utils.get_baselines(antenna)
-        uv_points, _ = argosim.antenna_utils.uv_track_multiband(
-            b_ENU=baselines, lat=latitude/180*np.pi, dec=declination/180*np.pi, 
-            track_time=duration, t_0=start_time, n_times=int(duration*60/timestep),
-            f=central_freq*1e9, df=bandwidth*1e9, n_freqs=nchan)
-        self.current_uv_points = uv_points
-        try:
-            uv_mask, _ = argosim.imaging_utils.grid_uv_samples(uv_samples=uv_points, sky_uv_shape=(Npx, Npx), fov_size=(fov_size, fov_size))
-        except ValueError as e:
-            self.fig.clear()
-            ax = self.fig.add_subplot(1, 1, 1)
-            ax.text(0.5, 0.5, f"Error:\n{str(e)}\nReduce FOV size.", ha='center', va='center', fontsize=12, color='red')
-            ax.axis('off')
-            self.canvas.draw()
+    def _check_precision(self):
+        params = self._push_params()
+        if params is None:
+            self.precision_label.setText("Error: invalid parameters.")
             return
-        dirty_beam = argosim.imaging_utils.uv2sky(uv_mask)
+        array = self.session.array
+        if array is None:
+            self.precision_label.setText("No antenna array available.")
+            return
+        import pipeline
+        self.precision_label.setText("Comparing float32 with float64...")
+        self.precision_runner.submit(pipeline.compute_precision_check, array['antenna'], params,
+                                     cache=self.session.cache, load_baselines=array['load_baselines'])
+
+    def _on_precision_checked(self, report):
+        import pipeline
+        self.precision_label.setText("Float32: " + pipeline.summarize_precision(report))
+
+    def _on_simulation_failed(self, error):
+        if self._trace is not None:
+            self.profiler.record(self._trace)
+        self.current_uv_points = None
+        self.current_uv_weights = None
+        self.current_uv_key = None
+        self.current_result = None
+        import pipeline
+        if isinstance(error, pipeline.UVRangeError):
+            self._show_error(f"Error:\n{str(error)}\nReduce FOV size.")
+        else:
+            self._show_error(f"Error:\n{str(error)}")
+
+    def _on_simulation_finished(self, result):
+        with profiling.stage(self._trace, 'draw'):
+            self._show_result(result)
+        if self._trace is not None:
+            self.profiler.record(self._trace)
+        if not result['preview']:
+            self.simulation_finished.emit()
+
+    def _show_result(self, result):
+        params = result['params']
+        fov_size = params['fov']
+        Npx = params['Npx']
+        uv_points = result['uv_points']
+        self.current_uv_points = uv_points
+        self.current_uv_weights = result['uv_weights']
+        self.current_uv_key = result['uv_key']
+        self.current_result = result
+        self._update_stale_label()
+        self._stop_animation()
+        if not result['preview']:
+            import pipeline
+            precision = params.get('precision', 'float64').capitalize()
+            self.precision_label.setText(f"{precision}: "
+                                         + pipeline.summarize_precision(pipeline.precision_report(result)))
 
         # Plot
-        self.fig.clear()
-        ax1 = self.fig.add_subplot(1, 2, 1)
-        # ax1.imshow(np.abs(uv_mask), origin='lower', cmap='viridis')
-        # argosim.plot_utils.plot_sky_uv(np.abs(uv_mask), fov_size=(0.1,0.1), )
-        argosim.plot_utils.plot_baselines(uv_points, ax=ax1, fig=self.fig)
+        uv_panel, _ = self.plots.panels()
         max_uv = (180/np.pi) * Npx / (2*fov_size) / 1e3
-        ax1.set_xlim((-max_uv, max_uv))
-        ax1.set_ylim((-max_uv, max_uv))
-        ax1.set_title('uv Coverage')
-        ax2 = self.fig.add_subplot(1, 2, 2)
-        # ax2.imshow(dirty_beam, origin='lower', cmap='viridis')
-        argosim.plot_utils.plot_sky(dirty_beam, fov_size=(fov_size, fov_size), ax=ax2, fig=self.fig, title='Dirty Beam')
-        ax2.set_title("Dirty Beam")
-        self.canvas.draw()
-
-    def get_current_uv_points(self):
-        return self.current_uv_points
-    
-    def get_current_fov_size(self):
-        return self.param_widgets['fov'].text()
-    
-    def get_current_Npx(self):
-        return self.param_widgets['Npx'].text()
+        if result['n_subsampled'] is not None:
+            title = f"uv Coverage (quick look, {result['n_subsampled']} of {result['n_baselines']} baselines)"
+        elif result['uv_weights'] is not None:
+            title = "uv Coverage (redundant baselines merged)"
+        else:
+            title = 'uv Coverage'
+        uv_panel.set_points(uv_points, limit=max_uv, title=title)
+        if not result['preview']:
+            self._update_beam_choices(result.get('channel_beams'))
+        self._show_beam()
+
+    def _update_beam_choices(self, channel_beams):
+        # MFS, then one entry per channel beam. The selection is kept if possible.
+        n_items = 1 if channel_beams is None else 1 + len(channel_beams)
+        if self.beam_combo.count() == n_items:
+            return
+        index = self.beam_combo.currentIndex()
+        self.beam_combo.blockSignals(True)
+        self.beam_combo.clear()
+        self.beam_combo.addItem("MFS")
+        self.beam_combo.addItems([f"Channel {i + 1}" for i in range(n_items - 1)])
+        self.beam_combo.setCurrentIndex(index if index < n_items else 0)
+        self.beam_combo.blockSignals(False)
+
+    def _on_beam_selected(self):
+        if self.current_result is not None:
+            self._show_beam()
+
+    def _show_beam(self):
+        result = self.current_result
+        params = result['params']
+        weighting = params.get('weighting', 'uniform')
+        index = self.beam_combo.currentIndex()
+        if index > 0 and result.get('channel_beams') is not None:
+            beam = result['channel_beams'][index - 1]
+            title = f"Dirty Beam ({weighting}, channel {index})"
+        else:
+            beam = result['dirty_beam']
+            title = f"Dirty Beam ({weighting}, MFS)" if params['nchan'] > 1 else f"Dirty Beam ({weighting})"
+        if result['preview']:
+            title += f" (preview, {beam.shape[0]} px)"
+        _, beam_panel = self.plots.panels()
+        beam_panel.set_image(beam, params['fov'], title=title)
+        self.plots.draw()
+
+    def _stop_animation(self):
+        # A new result replaces the track being played
+        self.animation_timer.stop()
+        if self.animation is not None:
+            self.plots.panels()[1].fix_clim(None)
+        self.animation = None
+        self.play_button.blockSignals(True)
+        self.play_button.setChecked(False)
+        self.play_button.setText("Play Track")
+        self.play_button.blockSignals(False)
+        self.frame_slider.setEnabled(False)
+        self.frame_label.setText("")
+
+    def _ensure_animation(self):
+        if self.animation is not None:
+            return True
+        result = self.current_result
+        if result is None or result['preview']:
+            self.frame_label.setText("No full-resolution track to play.")
+            return False
+        from animation import TrackAnimation
+        try:
+            self.animation = TrackAnimation(result['uv_points'], result['params'], weights=result['uv_weights'])
+        except Exception as e:
+            self.frame_label.setText(f"Error: {str(e)}")
+            return False
+        # Lowest sidelobe of the full-track beam, relative to its peak
+        self.animation.seek(self.animation.n_frames)
+        beam = self.animation.beam()
+        self._beam_floor = beam.min() / beam.max()
+        self.frame_slider.blockSignals(True)
+        self.frame_slider.setRange(1, self.animation.n_frames)
+        self.frame_slider.setValue(self.animation.n_frames)
+        self.frame_slider.blockSignals(False)
+        self.frame_slider.setEnabled(True)
+        return True
+
+    def _on_play_toggled(self, checked):
+        _, beam_panel = self.plots.panels()
+        if not checked:
+            self.animation_timer.stop()
+            self.play_button.setText("Play Track")
+            # Colour scale of the frame shown again
+            beam_panel.fix_clim(None)
+            if self.animation is not None:
+                self._show_frame(self.frame_slider.value())
+            return
+        if not self._ensure_animation():
+            self.play_button.blockSignals(True)
+            self.play_button.setChecked(False)
+            self.play_button.blockSignals(False)
+            return
+        # During playback the beams are drawn on the colour scale of the
+        # full-track beam, so that the colorbar stays in the background
+        beam_panel.fix_clim((self._beam_floor, 1.))
+        self._frame_times = []
+        # Start over from the first slice once the track was played through
+        if self.frame_slider.value() >= self.animation.n_frames:
+            self.frame_slider.blockSignals(True)
+            self.frame_slider.setValue(self.frame_slider.minimum())
+            self.frame_slider.blockSignals(False)
+            self._show_frame(self.frame_slider.minimum())
+        self.play_button.setText("Pause")
+        self.animation_timer.start()
+
+    def _next_frame(self):
+        frame = self.frame_slider.value() + 1
+        self.frame_slider.blockSignals(True)
+        self.frame_slider.setValue(frame)
+        self.frame_slider.blockSignals(False)
+        self._show_frame(frame)
+        if frame >= self.animation.n_frames:
+            self.play_button.setChecked(False)
+
+    def _on_frame_scrubbed(self, frame):
+        if self._ensure_animation():
+            self._show_frame(frame)
+
+    def _show_frame(self, frame):
+        # Only the slices between the frame shown and this one are gridded
+        animation = self.animation
+        animation.seek(frame)
+        params = animation.params
+        hour_angle = f"HA {animation.hour_angle():+.2f} h"
+        uv_panel, beam_panel = self.plots.panels()
+        # The titles stay the same from frame to frame, the hour angle is in the label
+        title = "uv Coverage (Earth rotation)"
+        if animation.n_samples <= uv_panel.density_threshold:
+            uv_panel.set_points(animation.points(), limit=animation.density_limit, title=title)
+        else:
+            uv_panel.set_density(animation.density(), animation.density_limit, title=title)
+        # Beams normalised to a unit peak, which grows with the samples
+        beam = animation.beam()
+        beam /= beam.max() or 1.
+        beam_panel.set_image(beam, params['fov'],
+                             title=f"Dirty Beam ({params.get('weighting', 'uniform')}, normalised)")
+        self.plots.draw()
+        # Frame rate over the last second of playback
+        now = time.perf_counter()
+        self._frame_times = [t for t in self._frame_times if now - t < 1.] + [now]
+        fps = f", {len(self._frame_times)} fps" if self.animation_timer.isActive() else ""
+        self.frame_label.setText(f"{hour_angle} ({animation.frame}/{animation.n_frames}{fps})")
+
+    def set_params(self, params):
+        # Fill in the parameter fields without triggering a live update
+        for key, value in params.items():
+            if key in self.param_widgets:
+                widget = self.param_widgets[key]
+                widget.blockSignals(True)
+                widget.setText(str(value))
+                widget.blockSignals(False)
+        for widget, value in [(self.redundancy_checkbox, bool(params.get('redundancy', False))),
+                              (self.channel_beams_checkbox, bool(params.get('channel_beams', False)))]:
+            widget.blockSignals(True)
+            widget.setChecked(value)
+            widget.blockSignals(False)
+        for combo, value in [(self.weighting_combo, params.get('weighting', 'uniform')),
+                             (self.precision_combo, params.get('precision', 'float64'))]:
+            combo.blockSignals(True)
+            combo.setCurrentText(value.capitalize())
+            combo.blockSignals(False)
+
+    def get_results(self):
+        # (metadata, arrays) of the result shown, None if there is none
+        result = self.current_result
+        if result is None:
+            return None
+        metadata = {key: result[key] for key in ['params', 'preview', 'uv_key', 'n_baselines', 'n_subsampled']}
+        arrays = {
+            'uv_points': result['uv_points'],
+            'uv_weights': result['uv_weights'],
+            'uv_mask': np.real(result['uv_mask']),
+            'dirty_beam': result['dirty_beam'],
+            'channel_beams': result['channel_beams'],
+        }
+        return metadata, arrays
+
+    def show_results(self, metadata, arrays):
+        # Display a stored result, e.g. memory-mapped from a result store
+        self.preview_timer.stop()
+        self.refine_timer.stop()
+        self.runner.cancel()
+        self.set_params(metadata['params'])
+        result = {
+            'params': metadata['params'],
+            'preview': metadata['preview'],
+            'uv_key': metadata['uv_key'],
+            'n_baselines': metadata.get('n_baselines'),
+            'n_subsampled': metadata.get('n_subsampled'),
+            'uv_points': arrays['uv_points'],
+            'uv_weights': arrays.get('uv_weights'),
+            'uv_mask': arrays['uv_mask'],
+            'dirty_beam': arrays['dirty_beam'],
+            'channel_beams': arrays.get('channel_beams'),
+        }
+        self.session.set_result('aperture', result)
+        self._show_result(result)
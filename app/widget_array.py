@@ -1,4 +1,6 @@
 # widget_array.py
+from functools import partial
+
 from PyQt6.QtWidgets import (
     QWidget, QLabel, QVBoxLayout, QHBoxLayout, QComboBox, QLineEdit, QPushButton
 )
@@ -6,14 +8,29 @@ from PyQt6.QtCore import Qt
 
 from matplotlib.figure import Figure
 
-import argosim.antenna_utils
-import argosim.plot_utils
+import numpy as np
+
+import profiling
+from catalog import TemplateCatalog
+from rendering import DENSITY_BINS, PanelFigure, ArrayPanel, PointsPanel, baseline_density
+from utils import ScrollableFigureCanvas, JobProgressBar
+from worker import JobRunner
 
-from utils import ScrollableFigureCanvas
+# Large-array mode: above this number of baselines the uv-plane panel is a
+# density image binned from the antenna pairs. The baselines themselves are
+# only computed when the aperture synthesis needs them.
+LARGE_ARRAY_BASELINES = 10000
 
 class InterferometricArrayWidget(QWidget):
-    def __init__(self):
+    def __init__(self, session, profiler=None, catalog=None, render=True):
+        # With render=False the default array is only drawn by render(), e.g.
+        # once the window is shown
         super().__init__()
+        self.session = session  # Shared session.Session, whose array is the one shown
+        self.profiler = profiler  # Shared profiling.Profiler
+        self.catalog = catalog if catalog is not None else TemplateCatalog()
+        self._deferred = not render
+        self._trace = None
         layout = QVBoxLayout()
         title = QLabel("Interferometric Array")
         title.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -54,12 +71,9 @@ class InterferometricArrayWidget(QWidget):
         self.param_widgets['span_height'] = QLineEdit()
         self.param_labels['span_height'] = QLabel("North-south span (m):")
 
-        # Template arrays: select array
+        # Template arrays: select array (bundled and user templates, see catalog.py)
         self.template_combo = QComboBox()
-        self.template_combo.addItems(["Argos", 
-                                  "Kat-7",
-                                  "Meerkat",
-                                  "SKA-Mid_197"])
+        self.template_combo.addItems(self.catalog.names())
         self.template_combo.setCurrentText("Meerkat")
         self.template_combo.currentTextChanged.connect(self._plot_array_and_baselines)
 
@@ -80,6 +94,13 @@ class InterferometricArrayWidget(QWidget):
         button_row.addWidget(self.reset_button, 1)
         layout.addLayout(button_row)
 
+        # Background baseline computation
+        self.runner = JobRunner(parent=self)
+        self.runner.finished.connect(self._on_baselines_finished)
+        self.runner.failed.connect(self._on_baselines_failed)
+        self.job_progress = JobProgressBar(self.runner)
+        layout.addWidget(self.job_progress)
+
         # Set default values for Y-shaped
         self._reset_defaults()
 
@@ -89,10 +110,17 @@ class InterferometricArrayWidget(QWidget):
         self.canvas.setMinimumHeight(400)
         self.canvas.setMinimumWidth(1000)
         layout.addWidget(self.canvas, stretch=1)
+        self.plots = PanelFigure(self.canvas, [ArrayPanel, PointsPanel])
 
         self.setLayout(layout)
         self._on_type_changed(self.type_combo.currentText())
         self.current_antenna = None
+        self.current_template = None
+        self.current_label = None
+        self._plot_array_and_baselines()
+
+    def render(self):
+        self._deferred = False
         self._plot_array_and_baselines()
 
     def _on_type_changed(self, text):
@@ -126,8 +154,12 @@ class InterferometricArrayWidget(QWidget):
         self._plot_array_and_baselines()
 
     def _plot_array_and_baselines(self):
+        if self._deferred:
+            return
         array_type = self.type_combo.currentText()
+        template = None
         try:
+            import argosim.antenna_utils
             if array_type == "Y-shaped":
                 n_antenna = int(self.param_widgets['n_antenna'].text())
                 radius = float(self.param_widgets['radius'].text())
@@ -144,31 +176,96 @@ class InterferometricArrayWidget(QWidget):
                 span_height = float(self.param_widgets['span_height'].text())
                 antenna = argosim.antenna_utils.uni_antenna_array(n_antenna_E=n_x, n_antenna_N=n_y, E_lim=span_width, N_lim=span_height)
             elif array_type == "Templates":
-                antenna_file = 'assets/' + self.template_combo.currentText() + '.enu.txt'
-                antenna = argosim.antenna_utils.load_antenna_enu_txt(antenna_file)
+                template = self.template_combo.currentText()
+                antenna = self.catalog.antenna(template)
             else:
                 return
-            baselines = argosim.antenna_utils.get_baselines(antenna)
-            self.current_antenna = antenna
+            self.current_antenna = np.asarray(antenna)
+            self.current_template = template
+            self.current_label = template or f"{array_type} ({len(self.current_antenna)} antennas)"
         except Exception as e:
-            self.fig.clear()
-            ax = self.fig.add_subplot(1, 1, 1)
-            ax.text(0.5, 0.5, f"Error:\n{str(e)}", ha='center', va='center', fontsize=12, color='red')
-            ax.axis('off')
-            self.canvas.draw()
+            self.runner.cancel()
+            self._show_error(f"Error:\n{str(e)}")
             self.current_antenna = None
+            self.current_template = None
+            self.current_label = None
+            self.session.set_array(None)
             return
+        self.session.set_array(self.current_antenna, self.current_label, self.get_current_baselines_loader())
+        self._submit_plot(self.current_antenna)
 
-        self.fig.clear()
-        ax1 = self.fig.add_subplot(1, 2, 1)
-        argosim.plot_utils.plot_antenna_arr(antenna, fig=self.fig, ax=ax1)
-        ax2 = self.fig.add_subplot(1, 2, 2)
-        argosim.plot_utils.plot_baselines(baselines, fig=self.fig, ax=ax2)
-        self.canvas.draw()
+    def _submit_plot(self, antenna):
+        # The uv-plane panel is computed in the background, the array is plotted with it
+        self._trace = self.profiler.new_trace("array") if self.profiler is not None else None
+        self.runner.submit(profiling.traced(self._trace, self._compute_baseline_plot), antenna)
+
+    @staticmethod
+    def _compute_baseline_plot(antenna, trace=None, progress=None):
+        # Baselines (in float64 numpy, as argosim.antenna_utils.get_baselines),
+        # or their density image in large-array mode
+        n = len(antenna)
+        result = {'antenna': antenna, 'n_baselines': n * (n - 1), 'baselines': None, 'density': None}
+        with profiling.stage(trace, 'baseline_plot'):
+            if progress is not None:
+                progress(0, "Computing baselines")
+            if n * (n - 1) > LARGE_ARRAY_BASELINES:
+                result['limit'] = max(np.ptp(antenna[:, 0]), np.ptp(antenna[:, 1])) / 1000. or 1.
+                result['density'] = baseline_density(antenna, result['limit'], DENSITY_BINS)
+            else:
+                i, j = np.where(~np.eye(n, dtype=bool))
+                result['baselines'] = antenna[i] - antenna[j]
+        return result
+
+    def _on_baselines_failed(self, error):
+        if self._trace is not None:
+            self.profiler.record(self._trace)
+        self._show_error(f"Error:\n{str(error)}")
+
+    def _on_baselines_finished(self, result):
+        with profiling.stage(self._trace, 'draw'):
+            self._show_result(result)
+        if self._trace is not None:
+            self.profiler.record(self._trace)
+
+    def _show_result(self, result):
+        array_panel, baselines_panel = self.plots.panels()
+        array_panel.set_array(result['antenna'])
+        if result['density'] is not None:
+            baselines_panel.set_density(result['density'], result['limit'],
+                                        title=f"uv-plane ({result['n_baselines']} baselines)")
+        else:
+            baselines_panel.set_points(result['baselines'], title="uv-plane")
+        self.plots.draw()
+
+    def get_results(self):
+        # (metadata, arrays) of the array shown, None if there is none. The
+        # baselines follow from the antenna positions and are not stored.
+        if self.current_antenna is None:
+            return None
+        return {}, {'antenna': self.current_antenna}
+
+    def show_results(self, metadata, arrays):
+        # Display a stored array, which becomes the current antenna array
+        self.runner.cancel()
+        self.current_antenna = np.asarray(arrays['antenna'])
+        self.current_template = None
+        self.current_label = f"Loaded ({len(self.current_antenna)} antennas)"
+        self.session.set_array(self.current_antenna, self.current_label)
+        self._submit_plot(self.current_antenna)
+
+    def _show_error(self, message):
+        self.plots.show_error(message)
 
     def get_current_antenna(self):
         return self.current_antenna
 
+    def get_current_baselines_loader(self):
+        # Loader of the cached baselines of the current template, None for
+        # the other arrays (see pipeline.compute_baselines)
+        if self.current_template is None:
+            return None
+        return partial(self.catalog.baselines, self.current_template)
+
     def _reset_defaults(self):
         self.type_combo.setCurrentText("Y-shaped")
         self.param_widgets['n_antenna'].setText("7")
@@ -0,0 +1,224 @@
+# widget_clean.py
+# CLEAN deconvolution of the observation of the imaging widget (see
+# deconvolution.py), with the dirty beam of the aperture under the imaging
+# weighting. Runs in the background; Stop ends the run after the current
+# major cycle and keeps what was cleaned so far, Cancel drops it.
+import threading
+from functools import partial
+
+from PyQt6.QtWidgets import (
+    QWidget, QLabel, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QCheckBox
+)
+from PyQt6.QtCore import Qt
+
+from matplotlib.figure import Figure
+
+import profiling
+from rendering import PanelFigure, ImagePanel
+from utils import ScrollableFigureCanvas, JobProgressBar
+from worker import JobRunner, SessionEvents
+
+STOP_REASONS = {
+    'max_iter': "iteration limit reached",
+    'threshold': "threshold reached",
+    'diverging': "stopped early, the residual grew",
+    'max_major': "major cycle limit reached",
+    'stopped': "stopped",
+}
+
+class CleanWidget(QWidget):
+    def __init__(self, session, imaging_widget=None, profiler=None):
+        super().__init__()
+        self.session = session  # Shared session.Session: observation, dirty beam and parameters
+        self.imaging_widget = imaging_widget
+        self.profiler = profiler  # Shared profiling.Profiler
+        self._trace = None
+        self._stop = threading.Event()
+        layout = QVBoxLayout()
+        title = QLabel("Deconvolution (CLEAN)")
+        title.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        title.setStyleSheet("font-weight: bold; font-size: 16px;")
+        layout.addWidget(title)
+
+        # CLEAN parameters
+        param_row = QHBoxLayout()
+        self.gain_label = QLabel("Gain:")
+        self.gain_input = QLineEdit()
+        self.gain_input.setText("0.1")
+        param_row.addWidget(self.gain_label)
+        param_row.addWidget(self.gain_input)
+        self.max_iter_label = QLabel("Max iterations:")
+        self.max_iter_input = QLineEdit()
+        self.max_iter_input.setText("1000")
+        param_row.addWidget(self.max_iter_label)
+        param_row.addWidget(self.max_iter_input)
+        self.threshold_label = QLabel("Threshold:")
+        self.threshold_input = QLineEdit()
+        self.threshold_input.setText("0")
+        param_row.addWidget(self.threshold_label)
+        param_row.addWidget(self.threshold_input)
+        self.patch_label = QLabel("Beam patch (px):")
+        self.patch_input = QLineEdit()
+        self.patch_input.setText("25")
+        self.patch_input.setToolTip("Half-width of the beam patch of the minor cycles")
+        param_row.addWidget(self.patch_label)
+        param_row.addWidget(self.patch_input)
+        layout.addLayout(param_row)
+
+        # Buttons row
+        button_row = QHBoxLayout()
+        self.clean_button = QPushButton("Run CLEAN")
+        self.clean_button.clicked.connect(self._run_clean)
+        button_row.addWidget(self.clean_button, 4)
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.setToolTip("Stop after the current major cycle and show the result so far")
+        self.stop_button.setEnabled(False)
+        self.stop_button.clicked.connect(self._stop_clean)
+        button_row.addWidget(self.stop_button, 1)
+        self.reset_button = QPushButton("Reset to Defaults")
+        self.reset_button.clicked.connect(self._reset_defaults)
+        button_row.addWidget(self.reset_button, 1)
+        self.live_checkbox = QCheckBox("Live update")
+        self.live_checkbox.setChecked(True)
+        button_row.addWidget(self.live_checkbox)
+        layout.addLayout(button_row)
+        self.metrics_label = QLabel()
+        self.metrics_label.setWordWrap(True)
+        layout.addWidget(self.metrics_label)
+        self.stale_label = QLabel()
+        self.stale_label.setStyleSheet("color: gray; font-style: italic;")
+        layout.addWidget(self.stale_label)
+        # The fields are pushed to the session once edited
+        for field in [self.gain_input, self.max_iter_input, self.threshold_input, self.patch_input]:
+            field.editingFinished.connect(self._push_params)
+
+        # Follow the new observations once cleaned
+        self.current_result = None
+        if self.imaging_widget is not None:
+            self.imaging_widget.runner.finished.connect(self._on_imaging_updated)
+        self.session_events = SessionEvents(session, parent=self)
+        self.session_events.dirty.connect(self._update_stale_label)
+        self.session_events.computed.connect(self._update_stale_label)
+
+        # Background CLEAN jobs
+        self.runner = JobRunner(parent=self)
+        self.runner.finished.connect(self._on_clean_finished)
+        self.runner.failed.connect(self._on_clean_failed)
+        self.runner.running_changed.connect(self.stop_button.setEnabled)
+        self.job_progress = JobProgressBar(self.runner)
+        layout.addWidget(self.job_progress)
+
+        # Restored image, residual and clean components
+        self.fig = Figure(figsize=(9, 3))
+        self.canvas = ScrollableFigureCanvas(self.fig)
+        self.canvas.setMinimumHeight(350)
+        layout.addWidget(self.canvas, stretch=1)
+        self.plots = PanelFigure(self.canvas, [ImagePanel, partial(ImagePanel, cmap='RdBu_r', symmetric=True),
+                                               ImagePanel], ncols=3)
+
+        self.setLayout(layout)
+
+    def _reset_defaults(self):
+        self.gain_input.setText("0.1")
+        self.max_iter_input.setText("1000")
+        self.threshold_input.setText("0")
+        self.patch_input.setText("25")
+
+    def _inputs(self):
+        return {
+            'gain': self.gain_input.text(),
+            'max_iter': self.max_iter_input.text(),
+            'threshold': self.threshold_input.text(),
+            'patch': self.patch_input.text(),
+        }
+
+    def _push_params(self):
+        # Sets the parameters of the session to the inputs, returns them (None if invalid)
+        try:
+            self.session.update('clean', self._inputs())
+        except ValueError as e:
+            self.runner.cancel()
+            self._show_error(f"Error:\n{str(e)}")
+            return None
+        return self.session.params('clean')
+
+    def _run_clean(self):
+        self._submit(force=True)
+
+    def _submit(self, force=False):
+        if self._push_params() is None:
+            return
+        if self.session.result('imaging') is None:
+            self.runner.cancel()
+            self._show_error("Missing observation.")
+            return
+        if not force and not self.session.needs_compute('clean'):
+            return
+        # A new Stop event for each job: stopping one never stops the next
+        self._stop = threading.Event()
+        self._trace = self.profiler.new_trace("clean") if self.profiler is not None else None
+        self.runner.submit(profiling.traced(self._trace, self.session.compute), 'clean', force=force,
+                           stop=self._stop.is_set)
+
+    def _stop_clean(self):
+        self._stop.set()
+
+    def _on_imaging_updated(self):
+        if self.live_checkbox.isChecked() and self.current_result is not None:
+            self._submit()
+
+    def _on_clean_failed(self, error):
+        if self._trace is not None:
+            self.profiler.record(self._trace)
+        self._show_error(f"Error:\n{str(error)}")
+
+    def _on_clean_finished(self, result):
+        with profiling.stage(self._trace, 'draw'):
+            self._show_result(result)
+        if self._trace is not None:
+            self.profiler.record(self._trace)
+
+    def _show_result(self, result):
+        self.current_result = result
+        fov_size = result['fov_size']
+        restored_panel, residual_panel, model_panel = self.plots.panels()
+        restored_panel.set_image(result['restored'], fov_size, title='Restored Image')
+        residual_panel.set_image(result['residual'], fov_size, title='Residual')
+        model_panel.set_image(result['model'], fov_size, title='Clean Components')
+        self.metrics_label.setText(
+            f"{result['iterations']} components in {result['major_cycles']} major cycles, "
+            f"residual peak {result['residual_peak']:.3g} "
+            f"({STOP_REASONS.get(result['stop_reason'], result['stop_reason'])}), "
+            f"restoring beam FWHM {result['restoring_fwhm']:.2f} px")
+        self.plots.draw()
+        self._update_stale_label()
+
+    def _update_stale_label(self):
+        stale = self.current_result is not None and self.session.is_dirty('clean')
+        self.stale_label.setText("The observation or the parameters changed since this image." if stale else "")
+
+    def get_results(self):
+        # (metadata, arrays) of the result shown, None if there is none
+        result = self.current_result
+        if result is None:
+            return None
+        metadata = {key: result[key] for key in ['fov_size', 'params', 'iterations', 'major_cycles', 'peaks',
+                                                 'residual_peak', 'restoring_fwhm', 'stop_reason']}
+        arrays = {'clean_' + name: result[name] for name in ['model', 'residual', 'restored']}
+        return metadata, arrays
+
+    def show_results(self, metadata, arrays):
+        # Display a stored result, e.g. memory-mapped from a result store
+        self.runner.cancel()
+        params = metadata['params']
+        self.gain_input.setText(str(params['gain']))
+        self.max_iter_input.setText(str(params['max_iter']))
+        self.threshold_input.setText(str(params['threshold']))
+        self.patch_input.setText(str(params['patch']))
+        result = dict(metadata)
+        result.update({name: arrays['clean_' + name] for name in ['model', 'residual', 'restored']})
+        self.session.set_result('clean', result)
+        self._show_result(result)
+
+    def _show_error(self, message):
+        self.plots.show_error(message)
@@ -0,0 +1,148 @@
+# widget_compare.py
+# Side-by-side comparison of several antenna arrays: the arrays added to the
+# list are simulated with the observation and imaging parameters of the session (see
+# pipeline.compute_comparison), one row each: dirty beam, observation, and
+# their differences to the first array. The axes of all the panels are linked.
+from functools import partial
+
+from PyQt6.QtWidgets import (
+    QWidget, QLabel, QVBoxLayout, QHBoxLayout, QPushButton, QListWidget
+)
+from PyQt6.QtCore import Qt
+
+from matplotlib.figure import Figure
+
+import profiling
+from rendering import PanelFigure, ImagePanel
+from utils import ScrollableFigureCanvas, JobProgressBar
+from worker import JobRunner
+
+# Maximum number of arrays compared at once
+MAX_ARRAYS = 6
+# Panels of each row
+ROW_PANELS = [ImagePanel, ImagePanel, partial(ImagePanel, cmap='RdBu_r', symmetric=True),
+              partial(ImagePanel, cmap='RdBu_r', symmetric=True)]
+ROW_HEIGHT = 300
+
+class ComparisonWidget(QWidget):
+    def __init__(self, session, profiler=None):
+        super().__init__()
+        self.session = session  # Shared session.Session: current array and parameters
+        self.profiler = profiler  # Shared profiling.Profiler
+        self._trace = None
+        self.arrays = []  # (label, antenna, load_baselines)
+        layout = QVBoxLayout()
+        title = QLabel("Array Comparison")
+        title.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        title.setStyleSheet("font-weight: bold; font-size: 16px;")
+        layout.addWidget(title)
+
+        # Arrays to compare, the first one is the reference
+        list_row = QHBoxLayout()
+        self.array_list = QListWidget()
+        self.array_list.setMaximumHeight(100)
+        list_row.addWidget(self.array_list, 4)
+        button_column = QVBoxLayout()
+        self.add_button = QPushButton("Add Current Array")
+        self.add_button.clicked.connect(self._add_current_array)
+        button_column.addWidget(self.add_button)
+        self.remove_button = QPushButton("Remove")
+        self.remove_button.clicked.connect(self._remove_selected)
+        button_column.addWidget(self.remove_button)
+        self.clear_button = QPushButton("Clear")
+        self.clear_button.clicked.connect(self._clear)
+        button_column.addWidget(self.clear_button)
+        list_row.addLayout(button_column, 1)
+        layout.addLayout(list_row)
+
+        self.compare_button = QPushButton("Compare")
+        self.compare_button.clicked.connect(self._compare)
+        layout.addWidget(self.compare_button)
+
+        # Background comparison jobs
+        self.runner = JobRunner(parent=self)
+        self.runner.finished.connect(self._on_comparison_finished)
+        self.runner.failed.connect(self._on_comparison_failed)
+        self.job_progress = JobProgressBar(self.runner)
+        layout.addWidget(self.job_progress)
+
+        # One row of linked panels per array
+        self.fig = Figure(figsize=(12, 3))
+        self.canvas = ScrollableFigureCanvas(self.fig)
+        self.canvas.setMinimumHeight(ROW_HEIGHT)
+        layout.addWidget(self.canvas, stretch=1)
+        self.plots = PanelFigure(self.canvas, ROW_PANELS, ncols=len(ROW_PANELS), share=True)
+        self.current_result = None
+
+        self.setLayout(layout)
+
+    def _add_current_array(self):
+        array = self.session.array
+        if array is None:
+            self._show_error("Missing antenna array.")
+            return
+        if len(self.arrays) >= MAX_ARRAYS:
+            self._show_error(f"At most {MAX_ARRAYS} arrays can be compared.")
+            return
+        label = array['label'] or f"Array {len(self.arrays) + 1}"
+        # The same array twice gets a numbered label
+        if label in [a[0] for a in self.arrays]:
+            label = f"{label} #{len(self.arrays) + 1}"
+        self.arrays.append((label, array['antenna'], array['load_baselines']))
+        self.array_list.addItem(label)
+
+    def _remove_selected(self):
+        row = self.array_list.currentRow()
+        if row < 0:
+            return
+        self.array_list.takeItem(row)
+        del self.arrays[row]
+
+    def _clear(self):
+        self.array_list.clear()
+        self.arrays = []
+
+    def _compare(self):
+        if len(self.arrays) < 2:
+            self.runner.cancel()
+            self._show_error("Add at least two arrays to compare.")
+            return
+        params = self.session.params('aperture')
+        imaging = self.session.params('imaging')
+
+        import pipeline
+        self._trace = self.profiler.new_trace("comparison") if self.profiler is not None else None
+        self.runner.submit(profiling.traced(self._trace, pipeline.compute_comparison), list(self.arrays),
+                           params, imaging, cache=self.session.cache)
+
+    def _on_comparison_failed(self, error):
+        if self._trace is not None:
+            self.profiler.record(self._trace)
+        self._show_error(f"Error:\n{str(error)}")
+
+    def _on_comparison_finished(self, result):
+        with profiling.stage(self._trace, 'draw'):
+            self._show_result(result)
+        if self._trace is not None:
+            self.profiler.record(self._trace)
+
+    def _show_result(self, result):
+        self.current_result = result
+        results = result['results']
+        fov_size = result['fov_size']
+        self.plots.set_panel_types(ROW_PANELS * len(results), ncols=len(ROW_PANELS))
+        self.canvas.setMinimumHeight(ROW_HEIGHT * len(results))
+        panels = self.plots.panels()
+        reference = results[0]['label']
+        for row, array in enumerate(results):
+            beam_panel, obs_panel, beam_diff_panel, obs_diff_panel = panels[4 * row:4 * row + 4]
+            beam_panel.set_image(array['dirty_beam'], fov_size,
+                                 title=f"{array['label']}: Dirty Beam ({array['n_baselines']} baselines)")
+            obs_panel.set_image(array['observation'], fov_size, title=f"{array['label']}: Observation")
+            beam_diff_panel.set_image(array['beam_difference'], fov_size, title=f"Beam - {reference}")
+            obs_diff_panel.set_image(array['observation_difference'], fov_size,
+                                     title=f"Observation - {reference}")
+        self.plots.draw()
+
+    def _show_error(self, message):
+        self.plots.show_error(message)
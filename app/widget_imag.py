@@ -1,23 +1,27 @@
 import sys
 from PyQt6.QtWidgets import (
-    QWidget, QLabel, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton
+    QWidget, QLabel, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QCheckBox, QComboBox
 )
 from PyQt6.QtCore import Qt
 
 from matplotlib.figure import Figure
 
-import argosim
-import argosim.imaging_utils
-import argosim.data_utils
-import argosim.plot_utils
 import numpy as np
 
-from utils import ScrollableFigureCanvas
+import ensemble
+import gridding
+import profiling
+from rendering import PanelFigure, ImagePanel
+from utils import ScrollableFigureCanvas, JobProgressBar
+from worker import JobRunner, SessionEvents
 
 class ImagingWidget(QWidget):
-    def __init__(self, aperture_widget=None):
+    def __init__(self, session, aperture_widget=None, profiler=None):
         super().__init__()
+        self.session = session  # Shared session.Session: current array, parameters and results
         self.aperture_widget = aperture_widget
+        self.profiler = profiler  # Shared profiling.Profiler
+        self._trace = None
         layout = QVBoxLayout()
         title = QLabel("Imaging")
         title.setAlignment(Qt.AlignmentFlag.AlignCenter)
@@ -51,8 +55,40 @@ class ImagingWidget(QWidget):
         self.seed_input.setText("None")
         param_row.addWidget(self.seed_label)
         param_row.addWidget(self.seed_input)
+        self.weighting_label = QLabel("Weighting:")
+        self.weighting_combo = QComboBox()
+        self.weighting_combo.addItems([w.capitalize() for w in gridding.WEIGHTINGS])
+        self.weighting_combo.setCurrentText("Natural")
+        param_row.addWidget(self.weighting_label)
+        param_row.addWidget(self.weighting_combo)
+        self.robust_label = QLabel("Robust:")
+        self.robust_input = QLineEdit()
+        self.robust_input.setText("0")
+        param_row.addWidget(self.robust_label)
+        param_row.addWidget(self.robust_input)
         layout.addLayout(param_row)
 
+        # Wide-field effects: primary beam of the dishes and w-term
+        wide_row = QHBoxLayout()
+        self.beam_checkbox = QCheckBox("Primary beam")
+        self.beam_checkbox.setToolTip("Observe the sky through the Airy beam of the dishes, per channel.")
+        wide_row.addWidget(self.beam_checkbox)
+        self.dish_label = QLabel("Dish diameter (m):")
+        self.dish_input = QLineEdit()
+        self.dish_input.setText("12")
+        wide_row.addWidget(self.dish_label)
+        wide_row.addWidget(self.dish_input)
+        self.w_checkbox = QCheckBox("w-term")
+        self.w_checkbox.setToolTip("Simulate the w-term of wide fields by w-stacking.")
+        wide_row.addWidget(self.w_checkbox)
+        self.w_planes_label = QLabel("w planes:")
+        self.w_planes_input = QLineEdit()
+        self.w_planes_input.setText("None")
+        self.w_planes_input.setToolTip("None: just enough planes for the FOV")
+        wide_row.addWidget(self.w_planes_label)
+        wide_row.addWidget(self.w_planes_input)
+        layout.addLayout(wide_row)
+
         # Buttons row
         button_row = QHBoxLayout()
         self.sim_button = QPushButton("Simulate Imaging")
@@ -61,13 +97,57 @@ class ImagingWidget(QWidget):
         self.reset_button = QPushButton("Reset to Defaults")
         self.reset_button.clicked.connect(self._reset_defaults)
         button_row.addWidget(self.reset_button, 1)
+        self.live_checkbox = QCheckBox("Live update")
+        self.live_checkbox.setChecked(True)
+        button_row.addWidget(self.live_checkbox)
+        # Ensemble mode: mean and std of K sky and noise realizations
+        self.ensemble_checkbox = QCheckBox("Ensemble")
+        self.ensemble_checkbox.setToolTip("Simulate several random skies and noise realizations at once and "
+                                          "show the mean and standard deviation of the observations.")
+        button_row.addWidget(self.ensemble_checkbox)
+        self.realizations_label = QLabel("Realizations:")
+        self.realizations_input = QLineEdit()
+        self.realizations_input.setText("32")
+        button_row.addWidget(self.realizations_label)
+        button_row.addWidget(self.realizations_input)
         layout.addLayout(button_row)
+        self.metrics_label = QLabel()
+        self.metrics_label.setWordWrap(True)
+        layout.addWidget(self.metrics_label)
+        self.stale_label = QLabel()
+        self.stale_label.setStyleSheet("color: gray; font-style: italic;")
+        layout.addWidget(self.stale_label)
+        # The fields are pushed to the session once edited
+        for field in [self.n_sources_input, self.min_size_input, self.max_size_input, self.noise_input,
+                      self.seed_input, self.robust_input, self.realizations_input, self.dish_input,
+                      self.w_planes_input]:
+            field.editingFinished.connect(self._push_params)
+        self.weighting_combo.currentTextChanged.connect(self._push_params)
+        for checkbox in [self.ensemble_checkbox, self.beam_checkbox, self.w_checkbox]:
+            checkbox.toggled.connect(self._push_params)
+
+        # Follow the full-resolution updates of the aperture once imaged
+        self.has_result = False
+        self.current_result = None
+        if self.aperture_widget is not None:
+            self.aperture_widget.simulation_finished.connect(self._on_aperture_updated)
+        self.session_events = SessionEvents(session, parent=self)
+        self.session_events.dirty.connect(self._update_stale_label)
+        self.session_events.computed.connect(self._on_stage_computed)
+
+        # Background imaging jobs
+        self.runner = JobRunner(parent=self)
+        self.runner.finished.connect(self._on_imaging_finished)
+        self.runner.failed.connect(self._on_imaging_failed)
+        self.job_progress = JobProgressBar(self.runner)
+        layout.addWidget(self.job_progress)
 
         # Matplotlib FigureCanvas for sky model and observation
         self.fig = Figure(figsize=(6, 3))
         self.canvas = ScrollableFigureCanvas(self.fig)
         self.canvas.setMinimumHeight(400)
         layout.addWidget(self.canvas, stretch=1)
+        self.plots = PanelFigure(self.canvas, [ImagePanel, ImagePanel])
 
         self.setLayout(layout)
 
@@ -77,77 +157,166 @@ class ImagingWidget(QWidget):
         self.min_size_input.setText("5")
         self.max_size_input.setText("10")
         self.seed_input.setText("None")
+        self.weighting_combo.setCurrentText("Natural")
+        self.robust_input.setText("0")
+        self.ensemble_checkbox.setChecked(False)
+        self.realizations_input.setText("32")
+        self.beam_checkbox.setChecked(False)
+        self.dish_input.setText("12")
+        self.w_checkbox.setChecked(False)
+        self.w_planes_input.setText("None")
 
-    def _simulate_imaging(self):
+    def _inputs(self):
+        # Parameter fields (sizes converted from arcseconds to degrees)
+        return {
+            'n_sources': self.n_sources_input.text(),
+            'min_source_size': float(self.min_size_input.text()) / 3600,
+            'max_source_size': float(self.max_size_input.text()) / 3600,
+            'noise_level': self.noise_input.text(),
+            'seed': self.seed_input.text(),
+            'weighting': self.weighting_combo.currentText().lower(),
+            'robust': self.robust_input.text(),
+            'n_realizations': self.realizations_input.text() if self.ensemble_checkbox.isChecked() else None,
+            'primary_beam': self.beam_checkbox.isChecked(),
+            'dish_diameter': self.dish_input.text(),
+            'w_stacking': self.w_checkbox.isChecked(),
+            'w_planes': self.w_planes_input.text(),
+        }
+
+    def _push_params(self):
+        # Sets the parameters of the session to the inputs, returns them (None if invalid)
         try:
-            noise_level = float(self.noise_input.text())
-            n_sources = int(self.n_sources_input.text())
-            # Convert arcseconds to degrees
-            min_source_size = float(self.min_size_input.text()) /3600
-            max_source_size = float(self.max_size_input.text()) /3600
-            # Assert valid values
-            if noise_level < 0.:
-                raise ValueError("Noise level can't be negative.")
-            if n_sources <= 0:
-                raise ValueError("Number of sources must be positive.")
-            if n_sources > 50:
-                raise ValueError("The maximum number of sources is set to 50.")
-            if min_source_size > max_source_size:
-                raise ValueError("Minimum source size should be smaller than maximum source size.")
-            if min_source_size <= 0 or max_source_size<= 0:
-                raise ValueError("Source sizes must be positive.")
-            # Seed handling
-            if self.seed_input.text() == "None":
-                seed = None
-            else:
-                seed = int(self.seed_input.text())
-        except Exception as e:
-            self.fig.clear()
-            ax = self.fig.add_subplot(1, 1, 1)
-            ax.text(0.5, 0.5, f"Error:\n{str(e)}", ha='center', va='center', fontsize=12, color='red')
-            ax.axis('off')
-            self.canvas.draw()
+            self.session.update('imaging', self._inputs())
+        except ValueError as e:
+            self.runner.cancel()
+            self._show_error(f"Error:\n{str(e)}")
+            return None
+        return self.session.params('imaging')
+
+    def _simulate_imaging(self):
+        self._submit(force=True)
+
+    def _submit(self, force=False):
+        # Unless forced, an image still up to date is not computed again
+        params = self._push_params()
+        if params is None:
             return
-        
-        # Get current uv points ApertureSynthesisWidget
-        uv_points = None
-        fov_size = None
-        Npx = None
-        if self.aperture_widget is not None:
-            try:
-                uv_points = self.aperture_widget.get_current_uv_points()
-                fov_size = float(self.aperture_widget.get_current_fov_size())
-                Npx = int(self.aperture_widget.get_current_Npx())
-            except Exception as e:
-                self.fig.clear()
-                ax = self.fig.add_subplot(1, 1, 1)
-                ax.text(0.5, 0.5, f"Error:\n{str(e)}", ha='center', va='center', fontsize=12, color='red')
-                ax.axis('off')
-                self.canvas.draw()
-                return
-        if uv_points is None:
-            self.fig.clear()
-            ax = self.fig.add_subplot(1, 1, 1)
-            ax.text(0.5, 0.5, "Missing aperture.", ha='center', va='center', fontsize=12, color='red')
-            ax.axis('off')
-            self.canvas.draw()
+        # Imaged on the uv samples of the last aperture, simulated again first
+        # if the array or the observation changed since
+        if self.session.result('aperture') is None:
+            self.runner.cancel()
+            self._show_error("Missing aperture.")
+            return
+        if not force and not self.session.needs_compute('imaging'):
             return
-    
-        # Simulate the sky model: n_sources with sizes betweeen (min_source_size, max_source_size)
-        if seed is not None:
-            np.random.seed(seed)
-        rand_sizes = np.random.rand(n_sources)
-        source_sizes = rand_sizes * (max_source_size-min_source_size) + min_source_size
-        sky_model = argosim.data_utils.n_source_sky((Npx, Npx), fov_size, deg_size_list=source_sizes, source_intensity_list=[1.]*n_sources, seed=seed, norm='max')
-        obs, _ = argosim.imaging_utils.simulate_dirty_observation(sky_model, uv_points, fov_size, sigma=noise_level)
-
-        self.fig.clear()
-        ax1 = self.fig.add_subplot(1, 2, 1)
-        # ax1.imshow(sky_model, origin='lower', cmap='inferno')
-        argosim.plot_utils.plot_sky(sky_model, fov_size=(fov_size, fov_size), ax=ax1, fig=self.fig)
-        ax1.set_title('Ground Truth Sky Model')
-        ax2 = self.fig.add_subplot(1, 2, 2)
-        # ax2.imshow(obs, origin='lower', cmap='inferno')
-        argosim.plot_utils.plot_sky(obs, fov_size=(fov_size, fov_size), ax=ax2, fig=self.fig)
-        ax2.set_title('Observation')
-        self.canvas.draw()
+
+        # Simulate the sky model and the observation in the background
+        self._trace = None
+        if self.profiler is not None:
+            self._trace = self.profiler.new_trace("imaging" if params['n_realizations'] is None else "ensemble")
+        self.runner.submit(profiling.traced(self._trace, self.session.compute), 'imaging', force=force)
+
+    def _on_aperture_updated(self):
+        if self.live_checkbox.isChecked() and self.has_result:
+            self._submit()
+
+    def _on_stage_computed(self, stage):
+        if stage == 'imaging':
+            # Computed by a CLEAN job, from the parameters of the session
+            result = self.session.result('imaging')
+            if result is not self.current_result and not self.runner.is_running():
+                self._show_result(result)
+        self._update_stale_label()
+
+    def _on_imaging_failed(self, error):
+        if self._trace is not None:
+            self.profiler.record(self._trace)
+        self._show_error(f"Error:\n{str(error)}")
+
+    def _on_imaging_finished(self, result):
+        with profiling.stage(self._trace, 'draw'):
+            self._show_result(result)
+        if self._trace is not None:
+            self.profiler.record(self._trace)
+
+    def _show_result(self, result):
+        self.current_result = result
+        fov_size = result['fov_size']
+        sky_model = result['sky_model']
+        obs = result['observation']
+        sky_panel, obs_panel = self.plots.panels()
+        if 'mean' in result:
+            n_realizations = result['params']['n_realizations']
+            sky_panel.set_image(result['mean'], fov_size, title=f'Ensemble Mean ({n_realizations} realizations)')
+            obs_panel.set_image(result['std'], fov_size, title='Ensemble Std')
+            self.metrics_label.setText("Fidelity over the realizations: " + ensemble.summarize(result['metrics']))
+        else:
+            sky_panel.set_image(sky_model, fov_size, title='Ground Truth Sky Model')
+            obs_panel.set_image(obs, fov_size, title='Observation')
+            self.metrics_label.setText(self._wide_field_summary(result.get('wide_field')))
+        self.plots.draw()
+        self.has_result = True
+        self._update_stale_label()
+
+    def _wide_field_summary(self, info):
+        if info is None:
+            return ""
+        notes = []
+        if info['beam_edge'] is not None:
+            notes.append(f"primary beam {info['beam_edge']:.3g} at the FOV edge")
+        if info['w_planes'] is not None:
+            notes.append(f"{info['w_planes']} w planes")
+        return "Wide field: " + ", ".join(notes)
+
+    def _update_stale_label(self):
+        stale = self.current_result is not None and self.session.is_dirty('imaging')
+        self.stale_label.setText("The aperture or the parameters changed since this image." if stale else "")
+
+    def get_results(self):
+        # (metadata, arrays) of the result shown, None if there is none
+        result = self.current_result
+        if result is None:
+            return None
+        metadata = {'fov_size': result['fov_size'], 'params': result['params']}
+        if 'wide_field' in result:
+            metadata['wide_field'] = result['wide_field']
+        arrays = {'sky_model': result['sky_model'], 'observation': result['observation']}
+        if 'mean' in result:
+            arrays.update({'ensemble_mean': result['mean'], 'ensemble_std': result['std']})
+            arrays.update({'ensemble_' + name: values for name, values in result['metrics'].items()})
+        return metadata, arrays
+
+    def show_results(self, metadata, arrays):
+        # Display a stored result, e.g. memory-mapped from a result store
+        self.runner.cancel()
+        params = metadata['params']
+        self.n_sources_input.setText(str(params['n_sources']))
+        self.min_size_input.setText(f"{params['min_source_size'] * 3600:g}")
+        self.max_size_input.setText(f"{params['max_source_size'] * 3600:g}")
+        self.noise_input.setText(str(params['noise_level']))
+        self.seed_input.setText(str(params['seed']))
+        self.weighting_combo.setCurrentText(params.get('weighting', 'natural').capitalize())
+        self.robust_input.setText(str(params.get('robust', 0.)))
+        self.beam_checkbox.setChecked(params.get('primary_beam', False))
+        self.dish_input.setText(str(params.get('dish_diameter', 12.)))
+        self.w_checkbox.setChecked(params.get('w_stacking', False))
+        self.w_planes_input.setText(str(params.get('w_planes')))
+        result = {
+            'fov_size': metadata['fov_size'],
+            'params': params,
+            'sky_model': arrays['sky_model'],
+            'observation': arrays['observation'],
+        }
+        if 'wide_field' in metadata:
+            result['wide_field'] = metadata['wide_field']
+        self.ensemble_checkbox.setChecked('n_realizations' in params)
+        if 'n_realizations' in params:
+            self.realizations_input.setText(str(params['n_realizations']))
+            result['mean'] = arrays['ensemble_mean']
+            result['std'] = arrays['ensemble_std']
+            result['metrics'] = {name: arrays['ensemble_' + name] for name in ensemble.METRICS}
+        self.session.set_result('imaging', result)
+        self._show_result(result)
+
+    def _show_error(self, message):
+        self.plots.show_error(message)
@@ -0,0 +1,151 @@
+# worker.py
+# Background execution of simulation jobs on a QThreadPool. Each widget owns a
+# JobRunner; submitting a new job cancels the one in flight ("latest request
+# wins") and results of stale jobs are dropped.
+import threading
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobSignals(QObject):
+    progress = pyqtSignal(int, int, str)  # job id, percent, message
+    finished = pyqtSignal(int, object)    # job id, result
+    failed = pyqtSignal(int, object)      # job id, exception
+    cancelled = pyqtSignal(int)           # job id
+
+
+class Job(QRunnable):
+    def __init__(self, job_id, fn, args, kwargs):
+        super().__init__()
+        self.job_id = job_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = JobSignals()
+        self.cancel_event = threading.Event()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def report(self, percent, message=""):
+        # Called by the pipeline between stages: abort as soon as possible
+        if self.is_cancelled():
+            raise JobCancelled()
+        self.signals.progress.emit(self.job_id, int(percent), message)
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, progress=self.report, **self.kwargs)
+        except JobCancelled:
+            self.signals.cancelled.emit(self.job_id)
+        except Exception as e:
+            if self.is_cancelled():
+                self.signals.cancelled.emit(self.job_id)
+            else:
+                self.signals.failed.emit(self.job_id, e)
+        else:
+            if self.is_cancelled():
+                self.signals.cancelled.emit(self.job_id)
+            else:
+                self.signals.finished.emit(self.job_id, result)
+
+
+class JobRunner(QObject):
+    started = pyqtSignal()
+    progress = pyqtSignal(int, str)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+    cancelled = pyqtSignal()
+    running_changed = pyqtSignal(bool)
+
+    def __init__(self, pool=None, parent=None):
+        super().__init__(parent)
+        self.pool = pool if pool is not None else QThreadPool.globalInstance()
+        self._next_id = 0
+        # The pool owns (and deletes) the runnables: only keep the id and the
+        # cancel flag of the job in flight.
+        self._current_id = None
+        self._current_cancel = None
+
+    def submit(self, fn, *args, **kwargs):
+        # The callable must accept a `progress` keyword argument
+        was_running = self.is_running()
+        if self._current_cancel is not None:
+            self._current_cancel.set()
+        self._next_id += 1
+        job = Job(self._next_id, fn, args, kwargs)
+        job.signals.progress.connect(self._on_progress)
+        job.signals.finished.connect(self._on_finished)
+        job.signals.failed.connect(self._on_failed)
+        job.signals.cancelled.connect(self._on_cancelled)
+        self._current_id = job.job_id
+        self._current_cancel = job.cancel_event
+        self.started.emit()
+        if not was_running:
+            self.running_changed.emit(True)
+        self.pool.start(job)
+        return job.job_id
+
+    def cancel(self):
+        if self._current_cancel is None:
+            return
+        self._current_cancel.set()
+        self._clear_current()
+        self.cancelled.emit()
+        self.running_changed.emit(False)
+
+    def is_running(self):
+        return self._current_id is not None
+
+    def wait(self, msecs=-1):
+        return self.pool.waitForDone(msecs)
+
+    def _is_current(self, job_id):
+        return self._current_id == job_id
+
+    def _clear_current(self):
+        self._current_id = None
+        self._current_cancel = None
+
+    def _on_progress(self, job_id, percent, message):
+        if self._is_current(job_id):
+            self.progress.emit(percent, message)
+
+    def _on_finished(self, job_id, result):
+        if self._is_current(job_id):
+            self._clear_current()
+            self.running_changed.emit(False)
+            self.finished.emit(result)
+
+    def _on_failed(self, job_id, error):
+        if self._is_current(job_id):
+            self._clear_current()
+            self.running_changed.emit(False)
+            self.failed.emit(error)
+
+    def _on_cancelled(self, job_id):
+        if self._is_current(job_id):
+            # Only reachable if the job cancelled itself
+            self._clear_current()
+            self.running_changed.emit(False)
+            self.cancelled.emit()
+
+
+class SessionEvents(QObject):
+    # Changes of a session.Session as signals, delivered in the thread of
+    # this object whichever thread made them (e.g. a stage computed by a job)
+    dirty = pyqtSignal(str)     # stage
+    computed = pyqtSignal(str)  # stage
+
+    def __init__(self, session, parent=None):
+        super().__init__(parent)
+        self.session = session
+        session.subscribe(self._on_event)
+        self.destroyed.connect(lambda: session.unsubscribe(self._on_event))
+
+    def _on_event(self, event, stage):
+        (self.dirty if event == 'dirty' else self.computed).emit(stage)
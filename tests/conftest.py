@@ -0,0 +1,37 @@
+# conftest.py
+# The app modules import each other as top-level modules (see
+# app/argosim-gui.py), so the tests run with app/ on the path. The fixtures
+# are small Kat-7 observations, quick enough for every test.
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'app'))
+
+import catalog
+
+PARAMS = {
+    'latitude': -30.7,
+    'declination': -30.,
+    'start_time': -2.,
+    'duration': 4.,
+    'timestep': 60.,
+    'central_freq': 2.,
+    'bandwidth': 0.2,
+    'nchan': 3,
+    'fov': 1.,
+    'Npx': 64,
+    'grid_memory': 256.,
+}
+
+
+@pytest.fixture(scope='session')
+def kat7():
+    return np.asarray(catalog.TemplateCatalog().antenna('Kat-7'))
+
+
+@pytest.fixture
+def params():
+    return dict(PARAMS)
@@ -0,0 +1,56 @@
+# test_batch.py
+import json
+
+import pytest
+
+import batch
+
+
+def test_expand_sweep_is_the_product_of_the_lists():
+    runs = batch.expand_sweep({'arrays': ['Kat-7', 'Meerkat'], 'duration': [2, 8], 'noise': [0, 0.1, 1],
+                               'fov': 0.5})
+    assert len(runs) == 12
+    assert all(run['fov'] == 0.5 and 'arrays' not in run for run in runs)
+    # Noise varies fastest, the first list slowest
+    assert [run['noise'] for run in runs[:3]] == [0, 0.1, 1]
+    assert [run['array'] for run in runs] == ['Kat-7'] * 6 + ['Meerkat'] * 6
+    expected = {key: value for key, value in batch.DEFAULTS.items() if key != 'arrays'}
+    expected.update({'array': 'Kat-7', 'duration': 2, 'noise': 0, 'fov': 0.5})
+    assert runs[0] == expected
+
+
+def test_group_runs_shares_all_but_the_noise():
+    runs = batch.expand_sweep({'duration': [2, 8], 'noise': [0, 0.1, 1]})
+    groups = batch.group_runs(runs)
+    assert [indices for indices, _ in groups] == [[0, 1, 2], [3, 4, 5]]
+    for indices, group in groups:
+        assert group == [runs[i] for i in indices]
+        assert len({run['duration'] for run in group}) == 1
+
+
+def test_check_runs_names_the_invalid_run():
+    runs = batch.expand_sweep({'timestep': [15, 0]})
+    with pytest.raises(ValueError, match="Run 00001: Time step must be positive."):
+        batch.check_runs(runs)
+
+
+def test_load_sweep_rejects_unknown_parameters(tmp_path):
+    path = tmp_path / 'sweep.json'
+    path.write_text(json.dumps({'durations': [2, 8]}))
+    with pytest.raises(ValueError, match="durations"):
+        batch.load_sweep(str(path))
+
+
+def test_run_group_writes_one_store_per_run(tmp_path):
+    import store
+    from conftest import PARAMS
+    runs = batch.expand_sweep(dict(PARAMS, noise=[0, 1]))
+    records = batch.run_group([0, 1], runs, str(tmp_path), batch.DEFAULT_PRODUCTS)
+    assert [record['status'] for record in records] == ['ok', 'ok']
+    params, arrays = store.load_result(str(tmp_path / records[1]['file']))
+    assert params == json.loads(json.dumps(runs[1]))
+    assert set(arrays) == set(batch.DEFAULT_PRODUCTS)
+    assert arrays['dirty_beam'].shape == (PARAMS['Npx'], PARAMS['Npx'])
+    # The second run only differs by its noise: its aperture is not computed again
+    assert 'dirty_beam' in [stage['stage'] for stage in records[0]['stages'] if not stage.get('cached')]
+    assert 'dirty_beam' not in [stage['stage'] for stage in records[1]['stages'] if not stage.get('cached')]
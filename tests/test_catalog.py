@@ -0,0 +1,60 @@
+# test_catalog.py
+import os
+
+import numpy as np
+import pytest
+
+import catalog
+import pipeline
+
+TEMPLATE = "# Name | E | N | U\n1 0. 0. 0.\n2 100. 0. 0.\n3 0. 50. 0.\n"
+
+
+@pytest.fixture
+def templates(tmp_path):
+    directory = tmp_path / 'templates'
+    directory.mkdir()
+    (directory / ('Small' + catalog.SUFFIX)).write_text(TEMPLATE)
+    return catalog.TemplateCatalog(dirs=[str(directory)], cache_dir=str(tmp_path / 'cache'))
+
+
+def cached_files(templates):
+    return sorted(os.listdir(templates.cache_dir)) if os.path.isdir(templates.cache_dir) else []
+
+
+def test_cache_matches_the_text_file(templates):
+    antenna = templates.antenna('Small')
+    np.testing.assert_array_equal(antenna, [[0., 0., 0.], [100., 0., 0.], [0., 50., 0.]])
+    assert len(cached_files(templates)) == 1
+    np.testing.assert_array_equal(templates.baselines('Small'), pipeline.compute_baselines(antenna))
+    # Reloaded from the cache by a new catalog
+    reloaded = catalog.TemplateCatalog(dirs=templates.dirs, cache_dir=templates.cache_dir)
+    np.testing.assert_array_equal(reloaded.antenna('Small'), antenna)
+    np.testing.assert_array_equal(reloaded.baselines('Small'), templates.baselines('Small'))
+
+
+def test_edited_template_is_converted_again(templates):
+    templates.antenna('Small')
+    before = cached_files(templates)
+    path = templates.path('Small')
+    with open(path, 'a') as f:
+        f.write("4 -30. 20. 0.\n")
+    antenna = templates.antenna('Small')
+    assert len(antenna) == 4
+    assert len(templates.baselines('Small')) == 12
+    assert len(cached_files(templates)) == 2 and set(before) < set(cached_files(templates))
+
+
+def test_earlier_directories_take_precedence(tmp_path, templates):
+    extra = tmp_path / 'extra'
+    extra.mkdir()
+    (extra / ('Small' + catalog.SUFFIX)).write_text(TEMPLATE.replace('100.', '200.'))
+    (extra / ('Other' + catalog.SUFFIX)).write_text(TEMPLATE)
+    both = catalog.TemplateCatalog(dirs=templates.dirs + [str(extra)], cache_dir=templates.cache_dir)
+    assert both.names() == ['Other', 'Small']
+    assert both.antenna('Small')[1, 0] == 100.
+
+
+def test_unknown_template(templates):
+    with pytest.raises(FileNotFoundError):
+        templates.antenna('Missing')
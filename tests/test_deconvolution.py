@@ -0,0 +1,46 @@
+# test_deconvolution.py
+import numpy as np
+import pytest
+from argosim.clean import clean_hogbom, pad_odd
+
+import deconvolution
+import pipeline
+
+
+@pytest.fixture(scope='module')
+def observation(kat7):
+    from conftest import PARAMS
+    aperture = pipeline.compute_aperture(kat7, PARAMS)
+    imaging = pipeline.compute_imaging(aperture['uv_points'], PARAMS['fov'], PARAMS['Npx'], 3, 60 / 3600,
+                                       120 / 3600, 0., seed=1)
+    return imaging['observation'], aperture['dirty_beam']
+
+
+def test_matches_clean_hogbom(observation):
+    # On odd images with a patch of the whole beam, the minor cycle is Hogbom's
+    # (clean_hogbom pads even images the same way). It cleans in the float32
+    # of the observation, this module in float64.
+    dirty, beam = observation
+    ny, nx = dirty.shape
+    result = deconvolution.clean(pad_odd(dirty), pad_odd(beam), gain=0.1, max_iter=100, patch=ny // 2)
+    _, model = clean_hogbom(dirty, beam, gamma=0.1, max_iter=100)
+    np.testing.assert_allclose(result['model'][:ny, :nx], model, rtol=1e-5, atol=1e-6)
+    assert result['iterations'] == 100
+
+
+def test_clark_cycles(observation):
+    dirty, beam = observation
+    result = deconvolution.clean(dirty, beam, gain=0.1, max_iter=500, patch=5)
+    assert result['major_cycles'] > 1
+    assert result['residual_peak'] < dirty.max()
+    # The residual is that of all the components, through the full beam
+    residual = dirty - deconvolution.Convolver(beam / beam.max())(result['model'])
+    np.testing.assert_allclose(result['residual'], residual, atol=1e-9)
+
+
+def test_stop_after_first_major_cycle(observation):
+    dirty, beam = observation
+    result = deconvolution.clean(dirty, beam, max_iter=500, patch=5, stop=lambda: True)
+    assert result['stop_reason'] == 'stopped'
+    assert result['major_cycles'] == 0
+    np.testing.assert_array_equal(result['residual'], dirty)
@@ -0,0 +1,43 @@
+# test_fft.py
+import numpy as np
+import pytest
+from argosim.imaging_utils import uv2sky, sky2uv
+
+import fft
+
+
+@pytest.fixture
+def sky():
+    return np.random.default_rng(0).normal(size=(64, 64))
+
+
+def test_uv2sky_matches_argosim(sky):
+    uv = np.asarray(sky2uv(sky))
+    np.testing.assert_allclose(fft.uv2sky(uv), np.asarray(uv2sky(uv)), atol=1e-6)
+    np.testing.assert_allclose(fft.uv2sky(uv, hermitian=True), np.asarray(uv2sky(uv)), atol=1e-6)
+    np.testing.assert_allclose(fft.uv2sky(uv, real=False).real, np.asarray(uv2sky(uv)), atol=1e-6)
+
+
+@pytest.mark.parametrize('shape', [(64, 64), (63, 63)])
+def test_sky2uv_matches_argosim(shape):
+    sky = np.random.default_rng(1).normal(size=shape)
+    expected = np.asarray(sky2uv(sky))
+    np.testing.assert_allclose(fft.sky2uv(sky), expected, atol=1e-4)
+    np.testing.assert_allclose(fft.sky2uv(sky.astype(complex)), expected, atol=1e-4)
+
+
+def test_round_trip(sky):
+    np.testing.assert_allclose(fft.uv2sky(fft.sky2uv(sky)), sky, atol=1e-12)
+
+
+def test_results_do_not_alias_buffers(sky):
+    # The results are not modified by the next calls of the same shape
+    complex_sky = sky.astype(complex)
+    results = [fft.uv2sky(complex_sky), fft.uv2sky(complex_sky, real=False),
+               fft.uv2sky(complex_sky, hermitian=True), fft.sky2uv(sky), fft.sky2uv(complex_sky)]
+    copies = [result.copy() for result in results]
+    fft.uv2sky(-complex_sky, real=False)
+    fft.sky2uv(-complex_sky)
+    fft.sky2uv(-sky)
+    for result, copy in zip(results, copies):
+        np.testing.assert_array_equal(result, copy)
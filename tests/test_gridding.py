@@ -0,0 +1,46 @@
+# test_gridding.py
+import numpy as np
+import pytest
+from argosim.imaging_utils import grid_uv_samples
+
+import gridding
+import pipeline
+
+
+@pytest.mark.parametrize('mask_type', ['binary', 'histogram'])
+def test_mask_matches_argosim(kat7, params, mask_type):
+    aperture = pipeline.compute_aperture(kat7, params)
+    uv = aperture['uv_points']
+    Npx, fov = params['Npx'], params['fov']
+    expected, _ = grid_uv_samples(uv, (Npx, Npx), (fov, fov), mask_type=mask_type)
+    counts = gridding.grid_uv_counts(uv, Npx, fov)
+    np.testing.assert_array_equal(gridding.uv_mask_from_counts(counts, mask_type), np.asarray(expected).real)
+    if mask_type == 'binary':
+        np.testing.assert_array_equal(aperture['uv_mask'], np.asarray(expected).real)
+
+
+def test_hermitian_half_matches_full(kat7, params):
+    uv = pipeline.compute_aperture(kat7, params)['uv_points']
+    Npx, fov = params['Npx'], params['fov']
+    upper = gridding.hermitian_pairs(np.asarray(pipeline.compute_baselines(kat7)))[0]
+    half = uv.reshape(params['nchan'], -1, len(upper) * 2, 3)[:, :, upper].reshape(-1, 3)
+    np.testing.assert_array_equal(gridding.grid_uv_counts(half, Npx, fov, hermitian=True),
+                                  gridding.grid_uv_counts(uv, Npx, fov))
+
+
+def test_out_of_grid_raises(kat7, params):
+    uv = pipeline.compute_aperture(kat7, params)['uv_points']
+    with pytest.raises(ValueError, match="out of the uv-plane"):
+        gridding.grid_uv_counts(uv, 8, 10.)
+
+
+def test_redundant_beams_match_full_set(params):
+    from argosim.antenna_utils import uni_antenna_array
+    grid = np.asarray(uni_antenna_array(n_antenna_E=4, n_antenna_N=3, E_lim=150., N_lim=100.))
+    for weighting in ['uniform', 'natural', 'briggs']:
+        run = dict(params, weighting=weighting)
+        full = pipeline.compute_aperture(grid, run)
+        redundant = pipeline.compute_aperture(grid, dict(run, redundancy=True))
+        assert len(redundant['baselines']) < len(full['baselines'])
+        np.testing.assert_array_equal(redundant['uv_mask'], full['uv_mask'])
+        np.testing.assert_array_equal(redundant['dirty_beam'], full['dirty_beam'])
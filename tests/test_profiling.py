@@ -0,0 +1,15 @@
+# test_profiling.py
+import types
+
+import pytest
+
+import profiling
+
+
+@pytest.mark.parametrize('platform, maxrss', [('linux', 3 * 2**10), ('darwin', 3 * 2**20)])
+def test_peak_rss_units(monkeypatch, platform, maxrss):
+    # 3 MB, reported in kB on Linux and in bytes on macOS
+    usage = types.SimpleNamespace(ru_maxrss=maxrss)
+    monkeypatch.setattr(profiling.sys, 'platform', platform)
+    monkeypatch.setattr(profiling, 'resource', types.SimpleNamespace(RUSAGE_SELF=0, getrusage=lambda who: usage))
+    assert profiling.peak_rss_mb() == 3.
@@ -0,0 +1,99 @@
+# test_session.py
+import pytest
+
+import session
+from cache import StageCache
+from conftest import PARAMS
+
+
+@pytest.fixture
+def sim(kat7):
+    s = session.Session(StageCache())
+    s.set_array(kat7, label='Kat-7')
+    s.update('aperture', PARAMS)
+    s.update('imaging', {'seed': 1})
+    return s
+
+
+def dirty(s):
+    return [stage for stage in session.STAGES if s.is_dirty(stage)]
+
+
+def test_starts_dirty():
+    assert dirty(session.Session()) == session.STAGES
+
+
+def test_compute_runs_the_dirty_stages_it_depends_on(sim):
+    sim.compute('imaging')
+    assert dirty(sim) == ['clean']
+    assert sim.result('aperture') is not None
+    assert not sim.needs_compute('imaging')
+
+
+def test_update_propagates_downstream(sim):
+    sim.compute('clean')
+    assert sim.update('aperture', {'duration': '3'}) == ['duration']
+    assert dirty(sim) == session.STAGES
+
+
+def test_update_of_a_local_parameter_stays_in_its_stage(sim):
+    sim.compute('clean')
+    assert sim.update('aperture', {'weighting': 'natural'}) == ['weighting']
+    assert dirty(sim) == ['aperture']
+
+
+def test_unchanged_value_keeps_the_results(sim):
+    sim.compute('clean')
+    assert sim.update('aperture', {'Npx': '64', 'fov': '1.0'}) == []
+    assert dirty(sim) == []
+
+
+def test_same_array_keeps_the_results(sim, kat7):
+    sim.compute('imaging')
+    sim.set_array(kat7.copy(), label='copy')
+    assert dirty(sim) == ['clean']
+    sim.set_array(kat7[:-1])
+    assert dirty(sim) == session.STAGES
+
+
+def test_random_image_makes_downstream_dirty(sim):
+    sim.update('imaging', {'seed': 'None'})
+    sim.compute('clean')
+    assert sim.needs_compute('imaging')
+    sim.compute('imaging')
+    assert dirty(sim) == ['clean']
+
+
+def test_listeners_get_dirty_and_computed_events(sim):
+    sim.compute('imaging')
+    events = []
+    sim.subscribe(lambda event, stage: events.append((event, stage)))
+    sim.update('imaging', {'noise_level': 0.5})
+    sim.compute('imaging')
+    assert events == [('dirty', 'imaging'), ('computed', 'imaging')]
+
+
+def test_stale_result_is_not_kept(sim):
+    # A parameter changed while computing: the result is returned, not kept
+    def progress(percent, message):
+        if percent == 100:
+            sim.update('aperture', {'duration': 3.})
+    result = sim.compute('aperture', progress=progress)
+    assert result['params']['duration'] == PARAMS['duration']
+    assert sim.is_dirty('aperture')
+
+
+@pytest.mark.parametrize('stage, values', [
+    ('aperture', {'timestep': 0}),
+    ('aperture', {'Npx': 1}),
+    ('aperture', {'fov': -1}),
+    ('aperture', {'bandwidth': 5, 'central_freq': 2}),
+    ('imaging', {'weighting': 'x'}),
+    ('clean', {'gain': 2}),
+    ('aperture', {'unknown': 1}),
+])
+def test_invalid_values_raise_and_change_nothing(sim, stage, values):
+    before = sim.params(stage)
+    with pytest.raises(ValueError):
+        sim.update(stage, values)
+    assert sim.params(stage) == before
@@ -0,0 +1,48 @@
+# test_store.py
+import os
+
+import numpy as np
+import pytest
+
+import store
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    arrays = {
+        'uv_points': rng.normal(size=(1000, 3)).astype(np.float32),
+        'dirty_beam': rng.normal(size=(16, 16)),
+        'uv_mask': rng.normal(size=(16, 16)) + 1j * rng.normal(size=(16, 16)),
+        'channel_beams': None,
+    }
+    params = {'Npx': np.int64(16), 'fov': 0.5, 'weights': np.arange(3), 'array': 'Kat-7', 'seed': None}
+    # Small chunks: the arrays are streamed over several writes
+    path = store.save_result(str(tmp_path / 'run'), arrays, params, chunk=64)
+    assert path.endswith(store.SUFFIX) and store.is_store(path)
+    loaded_params, loaded = store.load_result(path)
+    assert loaded_params == {'Npx': 16, 'fov': 0.5, 'weights': [0, 1, 2], 'array': 'Kat-7', 'seed': None}
+    assert set(loaded) == {'uv_points', 'dirty_beam', 'uv_mask'}
+    for name, array in loaded.items():
+        assert isinstance(array, np.memmap) and not array.flags.writeable
+        assert array.dtype == arrays[name].dtype
+        np.testing.assert_array_equal(array, arrays[name])
+    _, copies = store.load_result(path, mmap=False)
+    assert not isinstance(copies['dirty_beam'], np.memmap)
+
+
+def test_save_replaces_a_store(tmp_path):
+    path = store.save_result(str(tmp_path / 'run'), {'a': np.zeros(3), 'b': np.ones(2)})
+    store.save_result(path, {'a': np.ones(4)})
+    _, arrays = store.load_result(path)
+    assert list(arrays) == ['a']
+    np.testing.assert_array_equal(arrays['a'], np.ones(4))
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_refuses_other_directories(tmp_path):
+    other = tmp_path / ('data' + store.SUFFIX)
+    other.mkdir()
+    with pytest.raises(FileExistsError):
+        store.save_result(str(other), {'a': np.zeros(3)})
+    with pytest.raises(FileNotFoundError):
+        store.load_result(str(other))
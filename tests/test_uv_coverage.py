@@ -0,0 +1,87 @@
+# test_uv_coverage.py
+import numpy as np
+import pytest
+
+import gridding
+import pipeline
+from uv_coverage import UVCoverage
+
+
+def test_tracks_match_argosim(kat7, params):
+    baselines = pipeline.compute_baselines(kat7)
+    uv, _ = UVCoverage().update(baselines, params, geometry_key='kat7')
+    np.testing.assert_allclose(uv, pipeline.compute_uv_tracks(baselines, params), rtol=1e-6, atol=1e-3)
+
+
+@pytest.mark.parametrize('change', [
+    {'duration': 6.},
+    {'start_time': -1., 'duration': 2.},
+    {'nchan': 5, 'bandwidth': 0.3},
+    {'start_time': -3., 'duration': 5., 'nchan': 2},
+])
+def test_incremental_matches_full_recompute(kat7, params, change):
+    baselines = pipeline.compute_baselines(kat7)
+    coverage = UVCoverage()
+    coverage.update(baselines, params, geometry_key='kat7')
+    updated = dict(params, **change)
+    uv, counts = coverage.update(baselines, updated, geometry_key='kat7')
+    assert coverage.last_update['reused_times'] or coverage.last_update['reused_freqs']
+    full_uv, full_counts = UVCoverage().update(baselines, updated, geometry_key='kat7')
+    np.testing.assert_array_equal(uv, full_uv)
+    np.testing.assert_array_equal(counts, full_counts)
+    np.testing.assert_array_equal(counts, gridding.grid_uv_counts(full_uv, updated['Npx'], updated['fov']))
+
+
+def test_preview_keeps_the_refine_incremental(kat7, params):
+    from cache import StageCache
+    cache = StageCache()
+    coverage = UVCoverage()
+    pipeline.compute_aperture(kat7, params, cache=cache, coverage=coverage)
+    updated = dict(params, duration=6.)
+    preview = pipeline.compute_aperture(kat7, updated, cache=cache, coverage=coverage, preview_Npx=32)
+    assert preview['preview'] and preview['dirty_beam'].shape == (32, 32)
+    refined = pipeline.compute_aperture(kat7, updated, cache=cache, coverage=coverage)
+    n_samples = len(refined['uv_points'])
+    assert 0 < coverage.last_update['regridded_samples'] < n_samples
+    full = pipeline.compute_aperture(kat7, updated, coverage=UVCoverage())
+    np.testing.assert_array_equal(refined['uv_points'], full['uv_points'])
+    np.testing.assert_array_equal(refined['dirty_beam'], full['dirty_beam'])
+
+
+def fractional_weights(baselines):
+    # As subsampling weights, the same for both baselines of a pair
+    upper, half_index, _ = gridding.hermitian_pairs(baselines)
+    weights = np.random.default_rng(0).uniform(1, 10, len(upper)) / 3
+    return weights[half_index]
+
+
+def test_removed_fractional_weights_leave_empty_cells(params):
+    # Many baselines crossing the same fine cells, whose weights sum in
+    # another order when they are added than when they are removed
+    import catalog
+    baselines = catalog.TemplateCatalog().baselines('Meerkat')
+    weights = fractional_weights(baselines)
+    params = dict(params, fov=0.3, Npx=1024, duration=2.)
+    coverage = UVCoverage()
+    _, counts = coverage.update(baselines, params, geometry_key='meerkat', weights=weights)
+    coverage.update(baselines, dict(params, duration=4.), geometry_key='meerkat', weights=weights)
+    uv, restored = coverage.update(baselines, params, geometry_key='meerkat', weights=weights)
+    assert coverage.last_update['regridded_samples'] < len(uv)
+    np.testing.assert_array_equal(gridding.uv_mask_from_counts(restored), gridding.uv_mask_from_counts(counts))
+    np.testing.assert_allclose(restored, counts, atol=1e-12)
+
+
+def test_animation_slices_cancel(kat7, params):
+    from animation import TrackAnimation
+    baselines = pipeline.compute_baselines(kat7)
+    uv, _ = UVCoverage().update(baselines, params, geometry_key='kat7')
+    weights = np.tile(fractional_weights(baselines), len(uv) // len(baselines))
+    animation = TrackAnimation(uv, params, weights=weights)
+    reference = TrackAnimation(uv, params, weights=weights)
+    reference.seek(animation.n_frames - 2)
+    animation.seek(animation.n_frames)
+    animation.seek(animation.n_frames - 2)
+    np.testing.assert_array_equal(animation.counts > 0, reference.counts > 0)
+    animation.seek(animation.n_frames - 1)
+    animation.seek(animation.n_frames - 2)
+    np.testing.assert_array_equal(animation.counts > 0, reference.counts > 0)